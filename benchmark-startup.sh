@@ -0,0 +1,125 @@
+#!/bin/bash
+#
+# This script measures how long dns-tool spends importing modules before it
+# handles its first packet, using "python3 -X importtime", and checks that against
+# our budget.  Single lookups are run from cron thousands of times a day, so
+# startup time matters.
+#
+# A synthetic response is parsed from stdin with --json, which takes the same path
+# as a plain "dns-tool example.com --json" without needing the network.
+#
+# Usage: ./benchmark-startup.sh [ budget in ms ]
+#
+# The last line of output is "OK" if we're within budget.
+#
+
+# Errors are fatal
+set -e
+
+#set -x # Debugging
+
+#
+# Our budget in milliseconds, for the fastest of our runs.
+#
+BUDGET_MS=${1:-${STARTUP_BUDGET_MS:-50}}
+RUNS=5
+
+#
+# Modules which a plain lookup with --json should never import.  Each of these
+# should only be loaded by the mode or output format that needs it.
+#
+declare -a FORBIDDEN=(
+	"http.server"
+	"orjson"
+	"hashlib"
+	"mmap"
+	"lib.output_text"
+	"lib.archive"
+	"lib.axfr"
+	"lib.batch"
+	"lib.canonical"
+	"lib.chain"
+	"lib.cluster"
+	"lib.corpus"
+	"lib.replay"
+	"lib.stream"
+	"lib.sweep"
+	"lib.validate"
+	"lib.watch"
+	)
+
+cd $(dirname $0)
+
+TMP=$(mktemp -d)
+trap "rm -rf ${TMP}" EXIT
+
+#
+# Make our response, and strip the 2-byte length that --synthetic puts in front of it.
+#
+./dns-tool -q --synthetic 1 --seed 1 | tail -c +3 > ${TMP}/response.bin
+
+#
+# Run once first so that .pyc files are written and don't count against us.
+#
+./dns-tool -q --stdin --json < ${TMP}/response.bin > /dev/null
+
+BEST=""
+for RUN in $(seq ${RUNS})
+do
+	python3 -X importtime ./dns-tool -q --stdin --json < ${TMP}/response.bin 2> ${TMP}/importtime.txt > /dev/null
+
+	#
+	# Add up the self time (in microseconds) of every import.
+	#
+	TOTAL=$(awk -F'|' '/^import time:/ && !/self/ { split($1, a, ":"); total += a[2] } END { print total }' ${TMP}/importtime.txt)
+
+	if test -z "$BEST" -o "$TOTAL" -lt "${BEST:-0}"
+	then
+		BEST=$TOTAL
+		cp ${TMP}/importtime.txt ${TMP}/best.txt
+	fi
+
+done
+
+echo "Slowest imports (cumulative microseconds, top-level only):"
+awk -F'|' '/^import time:/ && !/self/ && $3 !~ /^  / { print $2 "|" $3 }' ${TMP}/best.txt \
+	| sort -t'|' -k1 -n -r | head -10 | sed -e "s/^/   /"
+
+STATUS="OK"
+
+for MODULE in ${FORBIDDEN[@]}
+do
+	if grep -q "| *${MODULE}$" ${TMP}/best.txt
+	then
+		echo "Module ${MODULE} was imported, but a plain lookup shouldn't need it"
+		STATUS="FAILED"
+	fi
+done
+
+#
+# humanize is only needed for the humanized TTLs, so a lookup which outputs nothing
+# (or only --fields without them) shouldn't import it.
+#
+python3 -X importtime ./dns-tool -q --stdin < ${TMP}/response.bin 2> ${TMP}/importtime.txt > /dev/null
+if grep -q "| *humanize$" ${TMP}/importtime.txt
+then
+	echo "Module humanize was imported, but a lookup without output shouldn't need it"
+	STATUS="FAILED"
+fi
+
+BEST_MS=$((BEST / 1000))
+echo "Import time: ${BEST_MS} ms (best of ${RUNS}), budget: ${BUDGET_MS} ms"
+
+if test "$BEST_MS" -gt "$BUDGET_MS"
+then
+	echo "Over budget by $((BEST_MS - BUDGET_MS)) ms"
+	STATUS="FAILED"
+fi
+
+echo "$STATUS"
+
+if test "$STATUS" != "OK"
+then
+	exit 1
+fi
+
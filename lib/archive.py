@@ -0,0 +1,280 @@
+#
+# This module reads and writes our archive format, which holds raw query and
+# response packets along with when they were sent, which server they were sent
+# to, and how long the response took.
+#
+# An archive is two files, both append-only:
+#
+# FILE - "DNSARC01", followed by records.  Each record is a header of
+#	timestamp (double), RTT in seconds (float, -1 if unknown), and the lengths
+#	of the server name, query, and response (unsigned shorts), followed by
+#	the server name, query, and response themselves.
+# FILE.idx - "DNSIDX01", followed by the offset of each record in FILE as an
+#	unsigned 64-bit integer.
+#
+# Everything is big-endian.  Readers mmap() both files, so packets can be read in
+# order or by number without reading the whole archive into memory.  If the index
+# is missing or behind (say, if we were killed between writes), the records it
+# doesn't cover are found by scanning.
+#
+
+
+import atexit
+import logging
+import mmap
+import os
+import struct
+import time
+
+from lib import output
+from lib import query
+
+
+logger = logging.getLogger()
+
+
+archive_magic = b"DNSARC01"
+index_magic = b"DNSIDX01"
+
+#
+# Our precompiled struct layouts
+#
+record_struct = struct.Struct(">dfHHH")
+offset_struct = struct.Struct(">Q")
+
+#
+# The archive and index we are recording into, if any.
+#
+stream = None
+index_stream = None
+
+
+def checkMagic(filename, magic):
+	"""
+	checkMagic(filename, magic): Make sure an existing file starts with our magic, so that we
+		don't append to (or read) something that isn't an archive.
+	"""
+
+	with open(filename, "rb") as fh:
+		if fh.read(len(magic)) != magic:
+			raise Exception("%s is not a dns-tool archive" % filename)
+
+
+def openArchive(filename):
+	"""
+	openArchive(filename): Start recording into an archive.  If it already exists, we append to it.
+	"""
+
+	global stream
+	global index_stream
+
+	for (name, magic) in ((filename, archive_magic), (filename + ".idx", index_magic)):
+		if os.path.exists(name) and os.path.getsize(name):
+			checkMagic(name, magic)
+
+	stream = open(filename, "ab")
+	if not stream.tell():
+		stream.write(archive_magic)
+
+	index_stream = open(filename + ".idx", "ab")
+	if not index_stream.tell():
+		index_stream.write(index_magic)
+
+	atexit.register(closeArchive)
+
+
+def writeRecord(server, rtt, query_message, response, timestamp = None):
+	"""
+	writeRecord(server, rtt, query_message, response, timestamp = None): Append a record to our archive.
+
+	rtt - How long the response took, in seconds.  None if we don't know.
+	timestamp - When the query was sent.  Defaults to now.
+	"""
+
+	if timestamp is None:
+		timestamp = time.time()
+
+	if rtt is None:
+		rtt = -1
+
+	server = bytes(server, "utf-8")
+	offset = stream.tell()
+
+	stream.write(record_struct.pack(timestamp, rtt, len(server), len(query_message), len(response)))
+	stream.write(server)
+	stream.write(query_message)
+	stream.write(response)
+
+	#
+	# The record goes out before its offset, so the index never points past the end of the archive.
+	#
+	stream.flush()
+	index_stream.write(offset_struct.pack(offset))
+
+
+def closeArchive():
+	"""
+	closeArchive(): Stop recording, and make sure everything has been written.
+	"""
+
+	global stream
+	global index_stream
+
+	if stream:
+		stream.close()
+		index_stream.close()
+
+	stream = None
+	index_stream = None
+
+
+class ArchiveReader():
+	"""
+	ArchiveReader: Read an archive, in order or by record number.
+
+	Each record is a tuple of (timestamp, server, rtt, query, response).  The query and
+	response are memoryviews into the archive, so nothing is copied until they're used.
+	rtt is None if it wasn't known.
+	"""
+
+	def __init__(self, filename):
+
+		checkMagic(filename, archive_magic)
+
+		self.fh = open(filename, "rb")
+		self.data = mmap.mmap(self.fh.fileno(), 0, access = mmap.ACCESS_READ)
+		self.view = memoryview(self.data)
+
+		#
+		# Use the index for as many records as it covers, and scan for the rest.
+		#
+		self.index = None
+		self.num_indexed = 0
+		self.extra = []
+
+		index_filename = filename + ".idx"
+		if os.path.exists(index_filename) and os.path.getsize(index_filename) > len(index_magic):
+			checkMagic(index_filename, index_magic)
+			self.index_fh = open(index_filename, "rb")
+			self.index = mmap.mmap(self.index_fh.fileno(), 0, access = mmap.ACCESS_READ)
+			self.num_indexed = (len(self.index) - len(index_magic)) // offset_struct.size
+
+		#
+		# Archives written before records were flushed ahead of their offsets can have an index
+		# which points past the end, so drop any index entries for records we don't have all of.
+		#
+		while self.num_indexed and not self.isComplete(self.getOffset(self.num_indexed - 1)):
+			self.num_indexed -= 1
+			logger.warning("ArchiveReader(): Index entry %d is past the end of the archive, ignoring it" % self.num_indexed)
+
+		if self.num_indexed:
+			offset = self.getRecordEnd(self.getOffset(self.num_indexed - 1))
+		else:
+			offset = len(archive_magic)
+
+		while offset < len(self.data):
+			if not self.isComplete(offset):
+				logger.warning("ArchiveReader(): Archive ends in the middle of a record at offset %d" % offset)
+				break
+			self.extra.append(offset)
+			offset = self.getRecordEnd(offset)
+
+		if self.extra:
+			logger.info("ArchiveReader(): %d records weren't in the index" % len(self.extra))
+
+	def getOffset(self, number):
+		"""
+		getOffset(number): Return the offset of a record in the archive
+		"""
+
+		if number < self.num_indexed:
+			return(offset_struct.unpack_from(self.index, len(index_magic) + number * offset_struct.size)[0])
+
+		return(self.extra[number - self.num_indexed])
+
+	def getRecordEnd(self, offset):
+		"""
+		getRecordEnd(offset): Return the offset just past the record at offset
+		"""
+
+		(_, _, server_length, query_length, response_length) = record_struct.unpack_from(self.data, offset)
+
+		return(offset + record_struct.size + server_length + query_length + response_length)
+
+	def isComplete(self, offset):
+		"""
+		isComplete(offset): Return True if all of the record at offset is in the archive
+		"""
+
+		if offset + record_struct.size > len(self.data):
+			return(False)
+
+		return(self.getRecordEnd(offset) <= len(self.data))
+
+	def __len__(self):
+		return(self.num_indexed + len(self.extra))
+
+	def __getitem__(self, number):
+
+		if number < 0:
+			number += len(self)
+
+		if number < 0 or number >= len(self):
+			raise IndexError("No record %d in archive" % number)
+
+		offset = self.getOffset(number)
+		(timestamp, rtt, server_length, query_length, response_length) = record_struct.unpack_from(self.data, offset)
+
+		index = offset + record_struct.size
+		server = str(self.view[index:index + server_length], "utf-8")
+		index += server_length
+		query_message = self.view[index:index + query_length]
+		index += query_length
+		response = self.view[index:index + response_length]
+
+		return(timestamp, server, None if rtt < 0 else rtt, query_message, response)
+
+	def __iter__(self):
+		for number in range(len(self)):
+			yield(self[number])
+
+
+def go(args):
+	"""
+	go(args): Parse and print every response in an archive.
+	"""
+
+	output.flush_every = args.flush_every
+
+	reader = ArchiveReader(args.read_archive)
+
+	count = 0
+	errors = 0
+
+	for (timestamp, server, rtt, query_message, response) in reader:
+
+		if not len(response):
+			continue
+
+		#
+		# The parser needs bytes: it decodes slices of the packet as strings, and the memo
+		# keeps packets around, which would also stop the archive from being unmapped.
+		# A copy of a response costs well under a microsecond, next to over 100 to parse it.
+		#
+		try:
+			parsed = query.parseMessage(args, bytes(response))
+
+		except Exception as e:
+			logger.error("Unable to parse response #%d: %s" % (count + errors, e))
+			errors += 1
+			continue
+
+		parsed["server"] = server
+		output.printResponse(args, parsed)
+		count += 1
+
+	output.flush()
+
+	logger.info("Read %d responses from archive, %d errors" % (count, errors))
+
+
@@ -5,6 +5,11 @@
 import argparse
 import logging
 
+from lib import budget
+from lib import memo
+from lib import projection
+from lib import trace
+
 logger = logging.getLogger()
 
 
@@ -20,30 +25,149 @@ def parseArgs():
 	#parser.add_argument("query", help = "String to query for (e.g. \"google.com\")")
 	parser.add_argument("query", nargs = "?", help = "String to query for (e.g. \"google.com\")")
 	parser.add_argument("server", nargs = "?", default = "8.8.8.8", help = "DNS server (default: 8.8.8.8)")
-	parser.add_argument("--query-type", default = "a", help = "Query type (Supported types: A, AAAA, CNAME, MX, SOA, NS) Defalt: a")
+	parser.add_argument("--query-type", default = "a", help = "Query type (Supported types: A, AAAA, CNAME, MX, SOA, NS, PTR, TXT, SRV, CAA, DS, DNSKEY, RRSIG, AXFR) Defalt: a")
 	parser.add_argument("--request-id", default = "", help = "Hex value for a request ID (default: random)")
 	parser.add_argument("--json", action = "store_true", help = "Output response as JSON")
 	parser.add_argument("--json-pretty-print", action = "store_true", help = "Output response as JSON Pretty-printed")
+	parser.add_argument("--json-backend", default = "stdlib", choices = [ "auto", "stdlib", "orjson" ],
+		help = "JSON encoder to use.  orjson is faster, but its output isn't byte-identical to stdlib's. (default: stdlib)")
+	parser.add_argument("--fields", help = "Comma-separated list of fields to output with --json, e.g. \"question.question,header.rcode,answers[].rddata_text\" (default: all)")
+	parser.add_argument("--output", "-o", help = "Write output to this file instead of stdout")
 	parser.add_argument("--text", action = "store_true", help = "Output response as formatted text")
 	parser.add_argument("--graph", action = "store_true", help = "Output response as ASCII graph of DNS response packet")
-	parser.add_argument("--raw", action = "store_true", help = "Output raw DNS packet and immediately exit")
+	parser.add_argument("--raw", action = "store_true", help = "Output raw DNS packet and immediately exit.  With --batch or --stream, output a stream of packets, each preceded by a 2-byte length")
+	parser.add_argument("--validate", action = "store_true", help = "Only check the response for problems, without fully parsing it, and print any that are found")
+	parser.add_argument("--digest", choices = [ "packet", "result" ],
+		help = "Print the SHA1 of the response instead of the response.  TTLs, the request ID, and record order are normalized first, so the digest is stable across runs.  \"packet\" hashes the normalized packet, \"result\" hashes its parsed JSON")
+	parser.add_argument("--batch", help = "File of queries to make, one per line, with an optional query type after each (\"-\" for stdin)")
+	parser.add_argument("--watch", help = "File of queries to monitor, in the same format as --batch.  Each is re-queried when its TTL expires, and printed only when it changes")
+	parser.add_argument("--watch-min", type = int, default = 30, metavar = "SECONDS", help = "Minimum time between queries for a name in --watch mode (default: 30)")
+	parser.add_argument("--watch-max", type = int, default = 3600, metavar = "SECONDS", help = "Maximum time between queries for a name in --watch mode (default: 3600)")
+	parser.add_argument("--ptr-sweep", metavar = "CIDR", help = "Do reverse (PTR) lookups on every address in a network, e.g. 10.0.0.0/16")
+	parser.add_argument("--concurrency", type = int, metavar = "N", help = "Maximum queries in flight with --batch, --watch, --ptr-sweep, or --replay (default: 100)")
+	parser.add_argument("--rate", type = float, default = 0, metavar = "QPS", help = "Maximum queries per second across all servers with --batch or --ptr-sweep (default: no limit)")
+	parser.add_argument("--servers", metavar = "LIST", help = "Comma-separated pool of servers to spread --batch or --ptr-sweep queries across (default: the server argument)")
+	parser.add_argument("--server-rate", type = float, default = 0, metavar = "QPS", help = "Maximum queries per second to each server with --batch or --ptr-sweep (default: no limit)")
+	parser.add_argument("--server-concurrency", type = int, default = 0, metavar = "N", help = "Maximum queries in flight to each server with --batch or --ptr-sweep (default: no limit)")
+	parser.add_argument("--follow-cnames", action = "store_true", help = "Follow CNAME chains to the records at the end, querying for any names the response doesn't cover, and add the chain to the output")
+	parser.add_argument("--max-cname-depth", type = int, default = 8, metavar = "N", help = "The most CNAMEs to follow in a chain with --follow-cnames (default: 8)")
+	parser.add_argument("--timeout", type = float, default = 3, metavar = "SECONDS", help = "How long to wait for each response with --batch, --watch, --ptr-sweep, or --replay (default: 3)")
+	parser.add_argument("--retries", type = int, default = 1, metavar = "N", help = "How many times to retry a query which timed out or got SERVFAIL or REFUSED, with --batch, --watch, or --ptr-sweep (default: 1)")
+	parser.add_argument("--coordinate", metavar = "WORKERS", help = "Comma-separated list of workers (HOST:PORT) to run --batch across, which were started with --worker")
+	parser.add_argument("--shards", type = int, default = 64, metavar = "N", help = "How many shards to split --batch into with --coordinate (default: 64)")
+	parser.add_argument("--worker-timeout", type = float, default = 600, metavar = "SECONDS", help = "Give up on a worker which sends nothing for this long, and reassign its shards (default: 600)")
+	parser.add_argument("--worker", metavar = "[ADDRESS:]PORT", help = "Run as a worker for --coordinate, listening on PORT (and ADDRESS, default: 127.0.0.1) and querying the server argument")
+	parser.add_argument("--metrics-port", type = int, metavar = "PORT", help = "Serve Prometheus metrics on http://ADDRESS:PORT/metrics (default: off)")
+	parser.add_argument("--metrics-address", default = "127.0.0.1", metavar = "ADDRESS", help = "Address to serve metrics on (default: 127.0.0.1)")
+	parser.add_argument("--flush-every", type = int, default = 1, metavar = "N", help = "In batch and watch modes, write output once every N messages (default: 1)")
+	parser.add_argument("--checkpoint", metavar = "FILE", help = "With --batch or --ptr-sweep and --output, save which queries are done to FILE every so often, for --resume")
+	parser.add_argument("--checkpoint-every", type = float, default = 10, metavar = "SECONDS", help = "How often to save a --checkpoint (default: 10)")
+	parser.add_argument("--resume", action = "store_true", help = "Skip the queries in --checkpoint which are done, and add to --output (after cutting it back to where the checkpoint was saved)")
+	parser.add_argument("--record", metavar = "ARCHIVE", help = "Record each query and response, with timing, into an archive (appending if it exists)")
+	parser.add_argument("--read-archive", metavar = "ARCHIVE", help = "Parse and print every response in an archive made with --record")
+	parser.add_argument("--replay", metavar = "ARCHIVE", help = "Resend the queries in an archive to the server, with their original timing, and compare the responses with the recorded ones")
+	parser.add_argument("--replay-speed", type = float, default = 1, metavar = "FACTOR", help = "Speed up (or slow down) --replay by this factor.  0 means as fast as possible (default: 1)")
+	parser.add_argument("--synthetic", type = int, metavar = "COUNT", help = "Write COUNT synthetic responses to stdout, each preceded by a 2-byte length, and exit")
+	parser.add_argument("--fuzz", action = "store_true", help = "Damage each --synthetic response in the ways a hostile server or fuzzer would, for testing the parser")
+	parser.add_argument("--seed", type = int, help = "Random seed for --synthetic (default: random)")
+	parser.add_argument("--max-pointer-hops", type = int, default = budget.limits["pointer_hops"], metavar = "N",
+		help = "Maximum pointers to follow in a single domain-name before giving up on a packet (default: %d)" % budget.limits["pointer_hops"])
+	parser.add_argument("--max-label-bytes", type = int, default = budget.limits["label_bytes"], metavar = "N",
+		help = "Maximum length of a single domain-name before giving up on a packet (default: %d)" % budget.limits["label_bytes"])
+	parser.add_argument("--max-records", type = int, default = budget.limits["records"], metavar = "N",
+		help = "Maximum records to parse in a single packet before giving up on it (default: %d)" % budget.limits["records"])
+	parser.add_argument("--max-decode-steps", type = int, default = budget.limits["steps"], metavar = "N",
+		help = "Maximum labels, records, and strings to decode in a single packet before giving up on it (default: %d)" % budget.limits["steps"])
+	parser.add_argument("--parse-cache", type = int, default = memo.entries_max, metavar = "N",
+		help = "How many parsed responses to remember, so that repeats (apart from the request ID and TTLs) don't have to be parsed again.  This only pays off when most responses are repeats, such as captures of a few busy names, so it's off by default (default: %d)" % memo.entries_max)
 	parser.add_argument("--stdin", action = "store_true", help = "Instead of making DNS query, read packet from stdin. (works great with --raw!)")
+	parser.add_argument("--stream", action = "store_true", help = "With --stdin, read a stream of packets, each preceded by a 2-byte length (as written by --raw with --batch, or --synthetic)")
 	parser.add_argument("--fake-ttl", action = "store_true", help = "Set a fake TTL, for use in test scripts where hashes are made of the output")
+	parser.add_argument("--mem-report", action = "store_true",
+		help = "Track memory with tracemalloc, and when we exit, print memory and RSS over time, what was retained per message by each stage of parsing and output, and the top allocation sites to stderr.  tracemalloc slows parsing down a lot, so this is for sizing runs rather than production")
 	parser.add_argument("--debug", "-d", action = "store_true", help = "Enable debugging")
+	parser.add_argument("--trace", type = int, default = 0, metavar = "N",
+		help = "Keep the last N parse events (offsets, pointers, decoders, and so on) and write them out as JSON lines when we exit")
+	parser.add_argument("--trace-file", metavar = "FILE", help = "Write the events kept by --trace to FILE instead of stderr")
 	parser.add_argument("--quiet", "-q", action = "store_true", help = "Quiet mode--only log errors")
 	#parser.add_argument("file", nargs="?", help = "JSON file to write (default: output.json)", default = "output.json")
 	#parser.add_argument("--filter", help = "Filename text to filter on")
 
 	args = parser.parse_args()
 
+	#
+	# In batch, watch, sweep, replay, and worker modes, the queries come from a file or network,
+	# so if a positional argument was given, it is really the DNS server.
+	#
+	if args.batch or args.watch or args.ptr_sweep or args.replay or args.worker:
+
+		if args.query:
+			args.server = args.query
+			args.query = None
+
+		if len([ mode for mode in (args.batch, args.watch, args.ptr_sweep, args.replay, args.worker) if mode ]) > 1:
+			parser.error("Only one of --batch, --watch, --ptr-sweep, --replay, or --worker can be used")
+
+		if args.stdin:
+			parser.error("Cannot use --stdin with --batch, --watch, --ptr-sweep, --replay, or --worker")
+
+		if args.raw and not args.batch:
+			parser.error("Cannot use --raw with --watch, --ptr-sweep, --replay, or --worker")
+
+		if args.validate and not (args.batch or args.worker):
+			parser.error("Cannot use --validate with --watch, --ptr-sweep, or --replay")
+
+		if args.digest and not (args.batch or args.worker):
+			parser.error("Cannot use --digest with --watch, --ptr-sweep, or --replay")
+
+		if args.replay and args.record:
+			parser.error("Cannot use --record with --replay")
+
+		if args.replay_speed < 0:
+			parser.error("--replay-speed can't be negative")
+
+		if args.concurrency is not None and (args.concurrency < 1 or args.concurrency > 65536):
+			parser.error("--concurrency must be between 1 and 65536")
+
+		if args.server_concurrency < 0:
+			parser.error("--server-concurrency can't be negative")
+
+		if args.worker:
+			try:
+				port = int(args.worker.rpartition(":")[2])
+			except ValueError:
+				port = 0
+			if port < 1 or port > 65535:
+				parser.error("--worker needs a port between 1 and 65535, as in PORT or ADDRESS:PORT")
+
 	#
 	# Don't require a query when --raw is used.
 	#
-	if not args.stdin:
+	elif not args.stdin and not args.synthetic and not args.read_archive:
 		if not args.query:
 			parser.error("A query is needed when --raw is not being used.")
 			parse.print_help()
 
+	if args.read_archive:
+
+		if args.batch or args.watch or args.ptr_sweep or args.replay or args.worker or args.stdin:
+			parser.error("Cannot use --read-archive with --batch, --watch, --ptr-sweep, --replay, --worker, or --stdin")
+
+		if args.raw:
+			parser.error("Cannot use --read-archive with --raw")
+
+		if args.record:
+			parser.error("Cannot use --read-archive with --record")
+
+	if args.stream and not args.stdin:
+		parser.error("--stream can only be used with --stdin")
+
+	if args.record and args.stdin:
+		parser.error("Cannot use --record with --stdin, as nothing is sent")
+
+	if args.query_type == "axfr" and args.raw:
+		parser.error("Cannot use --raw with AXFR queries")
+
 	#
 	# Can't use --json or any other output formatter with --raw.
 	#
@@ -61,6 +185,111 @@ def parseArgs():
 			parser.error("Cannot use --graph with --raw")
 			parse.print_help()
 
+		if args.validate:
+			parser.error("Cannot use --validate with --raw")
+
+		if args.digest:
+			parser.error("Cannot use --digest with --raw")
+
+	if args.digest and args.validate:
+		parser.error("Cannot use --digest with --validate")
+
+
+	#
+	# --fields only makes sense for JSON, as the text and graph output need everything.
+	#
+	if args.fields:
+
+		if args.text:
+			parser.error("Cannot use --fields with --text")
+
+		if args.graph:
+			parser.error("Cannot use --fields with --graph")
+
+	try:
+		args.fields = projection.parseFields(args.fields)
+
+	except ValueError as e:
+		parser.error(str(e))
+
+	if (args.servers or args.server_rate or args.server_concurrency) and not (args.batch or args.ptr_sweep or args.worker):
+		parser.error("--servers, --server-rate, and --server-concurrency can only be used with --batch, --ptr-sweep, or --worker")
+
+	#
+	# Following a chain means making more queries, so there must be a server to send them to.
+	#
+	if args.follow_cnames:
+
+		if args.stdin or args.read_archive or args.watch or args.replay:
+			parser.error("Cannot use --follow-cnames with --stdin, --read-archive, --watch, or --replay")
+
+		if args.raw or args.validate or args.digest:
+			parser.error("Cannot use --follow-cnames with --raw, --validate, or --digest")
+
+		if args.query_type == "axfr":
+			parser.error("Cannot use --follow-cnames with AXFR queries")
+
+		if args.max_cname_depth < 1:
+			parser.error("--max-cname-depth must be at least 1")
+
+	#
+	# A checkpoint notes how much of --output is done, so there must be one.
+	#
+	if args.checkpoint:
+
+		if not (args.batch or args.ptr_sweep):
+			parser.error("--checkpoint can only be used with --batch or --ptr-sweep")
+
+		if not args.output:
+			parser.error("--checkpoint needs --output, so that output can be resumed")
+
+		if args.raw:
+			parser.error("Cannot use --checkpoint with --raw")
+
+		if args.coordinate:
+			parser.error("Cannot use --checkpoint with --coordinate")
+
+		if args.checkpoint_every <= 0:
+			parser.error("--checkpoint-every must be more than zero")
+
+	if args.resume and not args.checkpoint:
+		parser.error("--resume needs --checkpoint")
+
+	#
+	# With --coordinate, the workers make the queries, and send their output back to us.
+	#
+	if args.coordinate:
+
+		if not args.batch:
+			parser.error("--coordinate can only be used with --batch")
+
+		if args.raw:
+			parser.error("Cannot use --raw with --coordinate")
+
+		if args.record:
+			parser.error("Cannot use --record with --coordinate, use it on the workers instead")
+
+		if args.shards < 1 or args.shards > 1000:
+			parser.error("--shards must be between 1 and 1000")
+
+		args.coordinate = [ worker.strip() for worker in args.coordinate.split(",") if worker.strip() ]
+		if not args.coordinate:
+			parser.error("--coordinate needs at least one worker")
+
+	#
+	# A batch is run one query at a time, unless any of the scheduler's options are used.
+	#
+	if args.servers:
+		args.servers = [ server.strip() for server in args.servers.split(",") if server.strip() ]
+
+	args.scheduled = bool(args.servers or args.rate or args.server_rate or args.server_concurrency
+		or args.concurrency is not None)
+
+	if args.concurrency is None:
+		args.concurrency = 100
+
+	budget.setLimits(args)
+	memo.entries_max = args.parse_cache
 
 	#
 	# Set our debugging level.
@@ -71,6 +300,8 @@ def parseArgs():
 	elif args.quiet:
 		logger.setLevel(logging.ERROR)
 
+	trace.setup(args)
+
 	logger.info("Args: %s" % args)
 
 	return(args)
@@ -0,0 +1,108 @@
+#
+# This module handles AXFR (zone transfer) queries, which are made over TCP.
+#
+# A zone transfer is a stream of DNS messages, each preceded by a 2-byte length.
+# The first and last records of the stream are the SOA of the zone (RFC 5936 2.2).
+# We parse and print each message as it arrives, so memory use doesn't depend on
+# how big the zone is.
+#
+
+
+import logging
+import socket
+
+from lib import create
+from lib import framing
+from lib import metrics
+from lib import output
+from lib import parse_question
+from lib import query
+
+
+logger = logging.getLogger()
+
+
+#
+# The SOA type
+#
+type_soa = create.query_types["soa"]
+
+
+def go(args):
+	"""
+	go(args): Transfer a zone over TCP and print each message as it arrives.
+	"""
+
+	output.flush_every = args.flush_every
+
+	server_address = (args.server, 53)
+	message = create.createQuery(args, args.query, "axfr")
+
+	sock = socket.create_connection(server_address, timeout = 10)
+	metrics.increment("dns_tool_queries_sent_total", server = args.server)
+
+	num_messages = 0
+	num_records = 0
+	num_soa = 0
+
+	#
+	# Servers usually only include the question in the first message of the transfer,
+	# so messages without one get the question we asked.
+	#
+	question = parse_question.parseQuestion(12, message, fields = args.fields)
+
+	try:
+		logger.info("Requesting zone transfer of %s from %s:%s..." % (args.query, args.server, 53))
+
+		fh = sock.makefile("rwb")
+		framing.writeFrame(fh, message)
+		fh.flush()
+
+		for message in framing.readFrames(fh):
+
+			#
+			# A message too short for a header (even an empty one) means the transfer is broken.
+			#
+			if len(message) < 12:
+				logger.error("Zone transfer failed, message #%d is only %d bytes" % (num_messages + 1, len(message)))
+				break
+
+			try:
+				response = query.parseMessage(args, message, question)
+
+			except query.malformed_errors as e:
+				logger.error("Zone transfer failed, malformed message #%d (%d bytes): %s" % (num_messages + 1, len(message), e))
+				break
+
+			num_messages += 1
+			num_records += len(response["answers"])
+
+			rcode = response["header"]["header"]["rcode"]
+			if rcode:
+				logger.error("Zone transfer refused or failed: RCODE %d" % rcode)
+				output.printResponse(args, response)
+				break
+
+			output.printResponse(args, response)
+
+			#
+			# The transfer is done once we've seen the SOA for the second time.
+			#
+			for answer in response["answers"]:
+				if answer["headers"]["type"] == type_soa:
+					num_soa += 1
+
+			if num_soa >= 2:
+				break
+
+		else:
+			if num_soa < 2:
+				logger.warning("Zone transfer ended before the closing SOA record")
+
+	finally:
+		output.flush()
+		sock.close()
+
+	logger.info("Zone transfer complete: %d messages, %d records" % (num_messages, num_records))
+
+
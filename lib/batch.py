@@ -0,0 +1,202 @@
+#
+# This module holds our code for running a batch of queries read from a file.
+#
+
+
+import logging
+import socket
+import sys
+
+from lib import canonical
+from lib import chain
+from lib import checkpoint
+from lib import create
+from lib import framing
+from lib import metrics
+from lib import output
+from lib import query
+from lib import scheduler
+from lib import validate
+
+
+logger = logging.getLogger()
+
+
+def readQueries(args, filename):
+	"""
+	readQueries(args, filename): Read our queries from a file, one per line.
+
+	Each line is a query, optionally followed by a query type (e.g. "gmail.com mx").
+	Blank lines and lines starting with "#" are skipped.  A filename of "-" reads from stdin.
+
+	This is a generator, so that very large lists never have to be held in memory.
+	"""
+
+	if filename == "-":
+		fh = sys.stdin
+	else:
+		fh = open(filename, "r")
+
+	try:
+		for line in fh:
+
+			line = line.strip()
+			if not line or line.startswith("#"):
+				continue
+
+			parts = line.split()
+			query_type = args.query_type
+			if len(parts) > 1:
+				query_type = parts[1].lower()
+
+			yield(parts[0], query_type)
+
+	finally:
+		if fh is not sys.stdin:
+			fh.close()
+
+
+def handleResponse(args, q, query_type, server, request, message, follow_ups = None):
+	"""
+	handleResponse(args, q, query_type, server, request, message, follow_ups = None): Print a
+		response in whichever way we were asked to.
+
+	follow_ups - If given, a list which a query needed to follow a CNAME chain is added to,
+		for the scheduler to make, rather than it being made here.  The response is printed
+		once the chain is finished.
+
+	Returns True if all went well.
+	"""
+
+	#
+	# With --raw, write each response with a 2-byte length in front, for --stdin --stream.
+	#
+	if args.raw:
+		framing.writeFrame(sys.stdout.buffer, query.getRawMessage(args, message))
+		return(True)
+
+	if args.validate:
+		request_id = create.request_id_struct.unpack_from(request)[0]
+		return(validate.go(args, message, "%s/%s" % (q, query_type), request_id))
+
+	if args.digest:
+		try:
+			canonical.go(args, message, "%s/%s" % (q, query_type))
+
+		except Exception as e:
+			logger.error("Unable to digest response for %s/%s: %s" % (q, query_type, e))
+			return(False)
+
+		return(True)
+
+	try:
+		response = query.parseMessage(args, message)
+
+	except Exception as e:
+		logger.error("Unable to parse response for %s/%s: %s" % (q, query_type, e))
+		metrics.increment("dns_tool_parse_errors_total")
+		return(False)
+
+	response["server"] = server
+
+	if args.follow_cnames and follow_ups is not None:
+		follow_up = chain.start(args, response, query_type, lambda: output.printResponse(args, response))
+		if follow_up:
+			follow_ups.append(follow_up)
+		return(True)
+
+	if args.follow_cnames:
+		chain.follow(args, response, query_type, server)
+
+	output.printResponse(args, response)
+
+	return(True)
+
+
+def runScheduled(args, queries):
+	"""
+	runScheduled(args, queries): Run our queries through the scheduler, with many in flight across
+		our server pool.  Responses are printed as they arrive, so they may be out of order.
+
+	Returns a tuple of (responses, errors).
+	"""
+
+	results = { True: 0, False: 0 }
+
+	def countResponse(*response):
+		follow_ups = []
+		results[handleResponse(*response, follow_ups = follow_ups)] += 1
+		if follow_ups:
+			return(follow_ups[0])
+
+	logger.info("Running batch via %s (concurrency: %d, rate: %s/sec, per-server rate: %s/sec, per-server concurrency: %s)" % (
+		", ".join(scheduler.getServers(args)), args.concurrency, args.rate or "unlimited",
+		args.server_rate or "unlimited", args.server_concurrency or "unlimited"))
+
+	(_, num_timeouts) = scheduler.run(args, queries, countResponse,
+		checkpoint.finished if checkpoint.enabled else None)
+
+	return(results[True], results[False] + num_timeouts)
+
+
+def runQueries(args, queries):
+	"""
+	runQueries(args, queries): Make each query, and print each response.
+
+	queries - An iterator of (query, query_type), or of (query, query_type, number) from
+		checkpoint.getQueries() if we're checkpointing
+
+	Queries go through the scheduler if any of its options were given, and are made
+	one at a time otherwise.  Returns a tuple of (responses, errors).
+	"""
+
+	if args.scheduled:
+		return(runScheduled(args, queries))
+
+	count = 0
+	errors = 0
+
+	for entry in queries:
+
+		(q, query_type) = entry[0:2]
+		request = query.getDnsMessage(args, q, query_type)
+
+		try:
+			message = query.sendDnsMessage(args, request)
+
+			if handleResponse(args, q, query_type, args.server, request, message):
+				count += 1
+			else:
+				errors += 1
+
+		except socket.error:
+			errors += 1
+
+		if checkpoint.enabled:
+			checkpoint.finished(entry)
+
+	return(count, errors)
+
+
+def go(args):
+	"""
+	go(args): Query each line of our batch file and print each response.
+	"""
+
+	output.flush_every = args.flush_every
+
+	queries = readQueries(args, args.batch)
+
+	if args.checkpoint:
+		checkpoint.start(args, "batch:%s" % args.batch)
+		queries = checkpoint.getQueries(queries)
+
+	try:
+		(count, errors) = runQueries(args, queries)
+
+	finally:
+		output.flush()
+		sys.stdout.buffer.flush()
+		checkpoint.finish()
+
+	logger.info("Batch complete: %d responses, %d errors" % (count, errors))
@@ -0,0 +1,105 @@
+#
+# This module holds our per-packet work budget.
+#
+# extractDomainName() guards against pointer loops, but a hostile packet can still
+# make us do a lot of work: long chains of pointers, hundreds of records which each
+# point into the same long name, and so on.  So we keep count of how much work we
+# have done on the current packet, and bail out of it once we've done too much.
+#
+# The parser is single-threaded, so the counters are module-level and are reset
+# by start() at the beginning of each packet.
+#
+
+
+import logging
+
+
+logger = logging.getLogger()
+
+
+#
+# Our limits.  These can be changed from the command line.
+#
+# pointer_hops - Pointers followed while extracting a single domain-name
+# label_bytes - Bytes of labels in a single domain-name (RFC 1035 2.3.4 allows 255)
+# records - Resource Records in a single packet
+# steps - Labels, records, and character-strings decoded in a single packet
+#
+limits = {
+	"pointer_hops": 16,
+	"label_bytes": 255,
+	"records": 4096,
+	"steps": 100000,
+	}
+
+#
+# How many steps we have taken on the current packet.
+#
+steps = 0
+
+
+class BudgetExceeded(Exception):
+	"""
+	BudgetExceeded: Raised when a packet takes more work to parse than we allow.
+	"""
+
+
+def setLimits(args):
+	"""
+	setLimits(args): Set our limits from the command line.
+	"""
+
+	limits["pointer_hops"] = args.max_pointer_hops
+	limits["label_bytes"] = args.max_label_bytes
+	limits["records"] = args.max_records
+	limits["steps"] = args.max_decode_steps
+
+
+def start():
+	"""
+	start(): Reset our counters before parsing a new packet.
+	"""
+
+	global steps
+	steps = 0
+
+
+def spend(count = 1):
+	"""
+	spend(count = 1): Count some decode steps, and raise BudgetExceeded if we're over budget.
+	"""
+
+	global steps
+	steps += count
+
+	if steps > limits["steps"]:
+		raise BudgetExceeded("More than %d decode steps" % limits["steps"])
+
+
+def checkPointerHops(hops):
+	"""
+	checkPointerHops(hops): Raise BudgetExceeded if a domain-name has followed too many pointers.
+	"""
+
+	if hops > limits["pointer_hops"]:
+		raise BudgetExceeded("More than %d pointers in a domain-name" % limits["pointer_hops"])
+
+
+def checkLabelBytes(length):
+	"""
+	checkLabelBytes(length): Raise BudgetExceeded if a domain-name is too long.
+	"""
+
+	if length > limits["label_bytes"]:
+		raise BudgetExceeded("More than %d bytes of labels in a domain-name" % limits["label_bytes"])
+
+
+def checkRecords(count):
+	"""
+	checkRecords(count): Raise BudgetExceeded if a packet has too many records.
+	"""
+
+	if count > limits["records"]:
+		raise BudgetExceeded("More than %d records in a packet" % limits["records"])
+
+
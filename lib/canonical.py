@@ -0,0 +1,159 @@
+#
+# This module puts packets into a canonical form, so that two responses which
+# differ only in their request ID, TTLs, or the order of their records look the same.
+#
+# All of the rewriting is done in place, in a single bytearray, and --digest
+# hashes the result so that regression runs don't need a subprocess per hash.
+#
+
+
+import logging
+import struct
+
+from lib import budget
+from lib import offsets
+from lib import output
+from lib import output_json
+from lib import parse_question
+from lib import query
+
+
+logger = logging.getLogger()
+
+
+#
+# Our precompiled struct layouts
+#
+header_struct = struct.Struct(">HHHHHH")
+short_struct = struct.Struct(">H")
+ttl_struct = struct.Struct(">i")
+
+#
+# The TYPEs whose RDATA contains domain-names, and the offsets of those names in the RDATA.
+# The second name in an SOA starts right after the first one, which is marked with None.
+#
+rdata_names = {
+	2: (0,),		# NS
+	5: (0,),		# CNAME
+	6: (0, None),	# SOA
+	12: (0,),		# PTR
+	15: (2,),		# MX
+	33: (6,),		# SRV
+	}
+
+
+def isMovable(data, records, first):
+	"""
+	isMovable(data, records, first): Can the records from offset first onwards be reordered?
+
+	Moving a record breaks any pointer to it, so we only reorder if no domain-name
+	in the packet points at or past first.
+	"""
+
+	for (start, ttl_index, end) in records:
+
+		names = [ start ]
+
+		rr_type = short_struct.unpack_from(data, ttl_index - 4)[0]
+		rdata_index = ttl_index + 6
+		for offset in rdata_names.get(rr_type, ()):
+			if offset is None:
+				try:
+					offset = parse_question.getDomainNameLength(rdata_index, data)
+				except IndexError:
+					return(False)
+			names.append(rdata_index + offset)
+
+		for name_index in names:
+			for target in offsets.getPointerTargets(data, name_index):
+				if target >= first:
+					return(False)
+
+	return(True)
+
+
+def canonicalize(message):
+	"""
+	canonicalize(message): Return the canonical form of a packet.
+
+	The request ID and every TTL (apart from OPT's) are set to zero, and the records in each section are
+	sorted by their bytes.  If reordering would break compression pointers, the records
+	are left in the order they arrived.
+	"""
+
+	retval = bytearray(message)
+
+	if len(retval) < header_struct.size:
+		return(bytes(retval))
+
+	short_struct.pack_into(retval, 0, 0)
+
+	budget.start()
+
+	try:
+		question_length = offsets.getQuestionLength(retval)
+
+	except IndexError:
+		return(bytes(retval))
+
+	records = offsets.getRecords(retval, question_length)
+
+	#
+	# An OPT pseudo-record's TTL is its extended RCODE, version, and DO bit, so leave it be.
+	#
+	for (start, ttl_index, end) in records:
+		if short_struct.unpack_from(retval, ttl_index - 4)[0] != offsets.opt_type:
+			ttl_struct.pack_into(retval, ttl_index, 0)
+
+	if records and isMovable(retval, records, records[0][0]):
+
+		(_, _, _, num_answers, num_authority, num_additional) = header_struct.unpack_from(retval)
+
+		#
+		# Sort each section separately.  Anything past what the counts in the header
+		# cover is treated as one more section.
+		#
+		i = 0
+		for count in (num_answers, num_authority, num_additional, len(records)):
+
+			section = records[i:i + count]
+			i += len(section)
+
+			if len(section) < 2:
+				continue
+
+			first = section[0][0]
+			last = section[-1][2]
+			retval[first:last] = b"".join(sorted(bytes(retval[start:end]) for (start, _, end) in section))
+
+	return(bytes(retval))
+
+
+def digest(args, message):
+	"""
+	digest(args, message): Return the SHA1 of a packet in canonical form, or of its parsed result.
+
+	For the parsed result, the canonical packet is parsed and encoded as sorted JSON,
+	so the digest doesn't depend on the request ID, TTLs, record order, or the time of day.
+	"""
+
+	import hashlib
+
+	message = canonicalize(message)
+
+	if args.digest == "result":
+		response = query.parseMessage(args, message)
+		message = output_json.encodeStdlib(response).encode("utf-8")
+
+	return(hashlib.sha1(message).hexdigest())
+
+
+def go(args, message, source):
+	"""
+	go(args, message, source): Print the digest of a packet, in the same format as sha1sum.
+	"""
+
+	output.pending.append("%s  %s\n" % (digest(args, message), source))
+	output.endMessage()
+
+
@@ -0,0 +1,334 @@
+#
+# This module holds our code for --follow-cnames, which follows a chain of CNAMEs
+# to the records at the end of it.
+#
+# Resolvers usually send the whole chain in one response, so we follow it through
+# the answers we already have first.  Only when the chain leads to a name which isn't
+# in the response do we query for that name, and so on until we find records of the
+# type we asked for, find a loop, or pass --max-cname-depth.  In --batch and --ptr-sweep,
+# those queries go through the scheduler alongside the rest (see start()), so they
+# don't hold anything up and follow its limits; otherwise they're made one at a time.
+#
+# Many names share the same CNAME targets (CDNs especially), so how each target
+# resolved is kept in a cache for the rest of the run, until its lowest TTL is up.
+# A chain which reaches a cached target is finished from the cache, without any
+# more queries.
+#
+# The result is added to the response as "cname_chain":
+#
+#	status - "resolved", "no_records" (the chain ends at a name without any), "loop",
+#		"too_deep", or "error" (a query for the next name failed)
+#	hops - Each CNAME, as { name, target, ttl, source }, where source is "response",
+#		"query", or "cache"
+#	final_name - The name at the end of the chain
+#	answers - The text of each record of our query type at final_name
+#	queries - How many more queries were made
+#
+
+
+import collections
+import logging
+import time
+
+from lib import create
+from lib import metrics
+from lib import query
+
+
+logger = logging.getLogger()
+
+
+#
+# Our cache of how CNAME targets resolved, in least recently used order.  Keys are
+# (name, query type) and values are (expires, hops, final name, answers).
+#
+cache = collections.OrderedDict()
+entries_max = 10000
+
+#
+# The TYPE of a CNAME record.
+#
+cname_type = create.query_types["cname"]
+
+
+def findRecords(response, name, rr_type):
+	"""
+	findRecords(response, name, rr_type): Look for records owned by a name in a response.
+
+	Returns a tuple of (CNAME target, CNAME TTL, records of rr_type).  The target is None
+	if there's no CNAME.
+	"""
+
+	target = None
+	ttl = None
+	records = []
+
+	name = name.lower()
+
+	for answer in response["answers"]:
+
+		if answer["rddata"].get("question_text", "").lower() != name:
+			continue
+
+		if answer["headers"]["type"] == rr_type:
+			records.append(answer)
+
+		elif answer["headers"]["type"] == cname_type and target is None:
+			target = answer["rddata_text"]
+			ttl = answer["headers"]["ttl"]
+
+	return(target, ttl, records)
+
+
+def getCached(name, query_type, now):
+	"""
+	getCached(name, query_type, now): Return how a name resolved, if we have it and it hasn't expired.
+	"""
+
+	key = (name.lower(), query_type)
+
+	if key not in cache:
+		return(None)
+
+	if cache[key][0] < now:
+		del cache[key]
+		return(None)
+
+	cache.move_to_end(key)
+	metrics.increment("dns_tool_cache_hits_total", cache = "cname")
+
+	return(cache[key])
+
+
+def putCached(name, query_type, hops, final_name, answers, ttls, now):
+	"""
+	putCached(name, query_type, hops, final_name, answers, ttls, now): Remember how a name resolved,
+		until the lowest of ttls is up.
+
+	TTLs below zero (from --fake-ttl) don't expire.
+	"""
+
+	ttls = [ ttl for ttl in ttls if ttl >= 0 ]
+	expires = now + min(ttls) if ttls else float("inf")
+
+	if len(cache) >= entries_max:
+		cache.popitem(last = False)
+
+	cache[(name.lower(), query_type)] = (expires, hops, final_name, answers)
+
+
+class Chain():
+	"""
+	Chain: The CNAME chain in a response, which is followed one response at a time, so that
+		the queries it needs can be made however suits the caller.
+
+	on_done - If given, called once the chain is finished and the result is in the response.
+	"""
+
+	def __init__(self, args, response, query_type, on_done = None):
+		self.args = args
+		self.response = response
+		self.query_type = query_type
+		self.rr_type = create.query_types[query_type]
+		self.on_done = on_done
+		self.now = time.time()
+
+		self.name = response["question"]["question"]
+		self.seen = set([ self.name.lower() ])
+		self.source = "response"
+
+		self.hops = []
+		self.records = []
+		self.queries = 0
+		self.status = None
+
+		#
+		# Where in hops the chain left a response or a cached entry, so we know which names
+		# we learned about ourselves and can cache.
+		#
+		self.cached_from = None
+		self.cached = None
+
+	def follow(self, current):
+		"""
+		follow(current): Follow our chain through a response.
+
+		Returns the next name to query for, or None once the chain is finished.
+		"""
+
+		while self.status is None:
+
+			#
+			# Follow the chain through whatever response we have.
+			#
+			(target, ttl, self.records) = findRecords(current, self.name, self.rr_type)
+
+			if self.records:
+				self.status = "resolved"
+				break
+
+			if target is not None:
+
+				self.hops.append({ "name": self.name, "target": target, "ttl": ttl, "source": self.source })
+				self.name = target
+
+				if target.lower() in self.seen:
+					self.status = "loop"
+				elif len(self.hops) > self.args.max_cname_depth:
+					self.status = "too_deep"
+
+				self.seen.add(target.lower())
+				continue
+
+			#
+			# If we asked about this name and got nothing, that's the end of the chain.
+			#
+			if current["question"]["question"].lower() == self.name.lower():
+				self.status = "no_records"
+				break
+
+			self.cached = getCached(self.name, self.query_type, self.now)
+			if self.cached:
+				(_, cached_hops, final_name, _) = self.cached
+				self.cached_from = len(self.hops)
+
+				for hop in cached_hops:
+					hop = dict(hop, source = "cache")
+					self.hops.append(hop)
+
+					if hop["target"].lower() in self.seen:
+						self.status = "loop"
+					elif len(self.hops) > self.args.max_cname_depth:
+						self.status = "too_deep"
+					self.seen.add(hop["target"].lower())
+
+				self.name = final_name
+				if self.status is None:
+					self.status = "resolved" if self.cached[3] else "no_records"
+				break
+
+			self.queries += 1
+			self.source = "query"
+
+			return(self.name)
+
+		self.finish()
+
+		return(None)
+
+	def failed(self, reason):
+		"""
+		failed(reason): Note that a query for the next name in our chain failed, which ends it.
+		"""
+
+		logger.error("Unable to follow CNAME chain from %s to %s: %s" % (self.response["question"]["question"], self.name, reason))
+		self.status = "error"
+		self.records = []
+		self.finish()
+
+	def finish(self):
+		"""
+		finish(): Cache what we learned, and add the chain to our response.
+		"""
+
+		if self.cached:
+			answers = self.cached[3]
+		else:
+			answers = [ record["rddata_text"] for record in self.records ]
+
+		#
+		# Remember how each target we followed ended up, so that other chains through it don't have to ask.
+		#
+		if self.status in ("resolved", "no_records"):
+
+			hops = self.hops
+			end = len(hops) if self.cached_from is None else self.cached_from
+			ttls = [ record["headers"]["ttl"] for record in self.records ]
+			if self.cached:
+				ttls.append(self.cached[0] - self.now)
+
+			for i in range(end - 1, -1, -1):
+				putCached(hops[i]["target"], self.query_type, hops[i + 1:], self.name, answers,
+					ttls + [ later["ttl"] for later in hops[i + 1:end] ], self.now)
+
+		self.response["cname_chain"] = {
+			"status": self.status,
+			"hops": self.hops,
+			"final_name": self.name,
+			"answers": answers,
+			"queries": self.queries,
+			}
+
+		if self.on_done:
+			self.on_done()
+
+	def getFollowUp(self, name):
+		"""
+		getFollowUp(name): Return a follow-up query for the scheduler, or None if there's no name to query.
+		"""
+
+		if name is None:
+			return(None)
+
+		return((name, self.query_type, self.onResponse))
+
+	def onResponse(self, args, name, query_type, server, request, message):
+		"""
+		onResponse(args, name, query_type, server, request, message): Handle the scheduler's response
+			to one of our queries, which is None if it timed out.
+
+		Returns a follow-up with our next query, or None if the chain is finished.
+		"""
+
+		if message is None:
+			self.failed("Timed out")
+			return(None)
+
+		try:
+			current = query.parseMessage(args, message)
+
+		except Exception as e:
+			self.failed(e)
+			return(None)
+
+		return(self.getFollowUp(self.follow(current)))
+
+
+def follow(args, response, query_type, server):
+	"""
+	follow(args, response, query_type, server): Follow the CNAME chain in a response, querying
+		server for any names the response doesn't cover, one at a time, and add the result to the response.
+	"""
+
+	chain = Chain(args, response, query_type)
+	name = chain.follow(response)
+
+	while name is not None:
+
+		request = create.createQuery(args, name, query_type)
+
+		try:
+			message = query.sendDnsMessage(args, request, server)
+			name = chain.follow(query.parseMessage(args, message))
+
+		except Exception as e:
+			chain.failed(e)
+			name = None
+
+
+def start(args, response, query_type, on_done):
+	"""
+	start(args, response, query_type, on_done): Start following the CNAME chain in a response, for
+		scheduler.run(), which makes any queries the chain needs alongside the rest.
+
+	on_done - Called once the chain is finished and the result is in the response
+
+	Returns a follow-up for the scheduler if the response doesn't cover the whole chain, or None if
+	it does (in which case on_done has already been called).
+	"""
+
+	chain = Chain(args, response, query_type, on_done)
+
+	return(chain.getFollowUp(chain.follow(response)))
+
+
@@ -0,0 +1,249 @@
+#
+# This module holds our code for --checkpoint and --resume, so that a long --batch or
+# --ptr-sweep which dies partway through can pick up where it left off.
+#
+# Each query is numbered by its place in the batch file or network.  We keep a
+# watermark (every query before it is done) and a set of the queries after it which
+# are done, which stays small because queries finish roughly in order.  Queries which
+# timed out or couldn't be parsed count as done.
+#
+# Every --checkpoint-every seconds, our output is flushed and fsync()ed, and then a line
+# with the watermark, the set, and the size of the output file is appended to the
+# checkpoint file and fsync()ed.  So a checkpoint never mentions output which isn't on
+# disk.  With --resume, the output file is cut back to the size in the last checkpoint
+# (dropping anything written after it, which will be written again), and the queries
+# in the checkpoint are skipped.
+#
+
+
+import json
+import logging
+import os
+import time
+
+from lib import output
+
+
+logger = logging.getLogger()
+
+
+#
+# Are we checkpointing?
+#
+enabled = False
+
+#
+# Our checkpoint file, and what we're running, so that a checkpoint isn't used for something else.
+#
+filename = None
+fh = None
+job = None
+
+#
+# Every query before the watermark is done, as is every query in done.
+#
+watermark = 0
+done = set()
+
+#
+# How often to save, in seconds, and when we next will.  The clock is only checked
+# every check_every queries.
+#
+save_every = 10
+next_save = 0
+check_every = 100
+completed = 0
+completed_saved = 0
+
+#
+# Once the checkpoint file has this many lines, it is rewritten with just the latest.
+#
+lines = 0
+lines_max = 1000
+
+
+def load(path):
+	"""
+	load(path): Return the last checkpoint in a checkpoint file, or None if it has none.
+
+	If we died while writing a line, that line is ignored.
+	"""
+
+	retval = None
+
+	with open(path, "r") as fh:
+		for line in fh:
+			try:
+				retval = json.loads(line)
+
+			except ValueError:
+				logger.warning("Ignoring a partly-written line in checkpoint %s" % path)
+
+	return(retval)
+
+
+def start(args, job_name):
+	"""
+	start(args, job_name): Start checkpointing, and if we're resuming, cut our output back to
+		the last checkpoint and note which queries are done.
+
+	job_name - What we're running, such as "batch:names.txt", which must match on --resume.
+	"""
+
+	global enabled
+	global filename
+	global job
+	global watermark
+	global done
+	global save_every
+	global next_save
+
+	filename = args.checkpoint
+	job = job_name
+	save_every = args.checkpoint_every
+	offset = 0
+
+	if args.resume:
+
+		state = None
+		if os.path.exists(filename):
+			state = load(filename)
+
+		if state is None:
+			logger.warning("No checkpoint in %s, starting from the beginning" % filename)
+
+		elif state["job"] != job:
+			raise Exception("Checkpoint %s is for %s, not %s" % (filename, state["job"], job))
+
+		else:
+			watermark = state["watermark"]
+			done = set(state["done"])
+			offset = state["offset"]
+			logger.info("Resuming from checkpoint %s: %d queries done, output cut back to %d bytes" % (
+				filename, watermark + len(done), offset))
+
+		output.stream.truncate(offset)
+
+	enabled = True
+	next_save = time.time() + save_every
+
+	#
+	# Start the file over with where we are now.
+	#
+	compact()
+
+
+def getQueries(queries, start = 0):
+	"""
+	getQueries(queries, start = 0): Number each of our queries, and skip the ones which are done.
+
+	queries - An iterator of (query, query_type), the first of which is query number start.
+
+	Yields (query, query_type, number).
+	"""
+
+	for (index, (q, query_type)) in enumerate(queries, start):
+		if index < watermark or index in done:
+			continue
+		yield(q, query_type, index)
+
+
+def finished(entry):
+	"""
+	finished(entry): Note that a query from getQueries() is done, and save a checkpoint if it's time.
+	"""
+
+	global watermark
+	global completed
+
+	done.add(entry[2])
+	while watermark in done:
+		done.remove(watermark)
+		watermark += 1
+
+	completed += 1
+	if not completed % check_every and time.time() >= next_save:
+		save()
+
+
+def getLine():
+	"""
+	getLine(): Flush our output to disk, and return a checkpoint line for where we are now.
+	"""
+
+	output.flush()
+	output.stream.flush()
+	os.fsync(output.stream.fileno())
+
+	return(json.dumps({ "job": job, "watermark": watermark, "done": sorted(done),
+		"offset": os.fstat(output.stream.fileno()).st_size, "time": int(time.time()) }) + "\n")
+
+
+def save():
+	"""
+	save(): Append a checkpoint to our checkpoint file.
+	"""
+
+	global lines
+	global next_save
+	global completed_saved
+
+	if lines >= lines_max:
+		compact()
+		return
+
+	fh.write(getLine())
+	fh.flush()
+	os.fsync(fh.fileno())
+
+	lines += 1
+	next_save = time.time() + save_every
+	completed_saved = completed
+
+
+def compact():
+	"""
+	compact(): Replace our checkpoint file with one holding just a checkpoint for where we are now.
+	"""
+
+	global fh
+	global lines
+	global next_save
+	global completed_saved
+
+	if fh:
+		fh.close()
+
+	tmp = filename + ".tmp"
+	with open(tmp, "w") as tmp_fh:
+		tmp_fh.write(getLine())
+		tmp_fh.flush()
+		os.fsync(tmp_fh.fileno())
+
+	os.replace(tmp, filename)
+
+	fh = open(filename, "a")
+	lines = 1
+	next_save = time.time() + save_every
+	completed_saved = completed
+
+
+def finish():
+	"""
+	finish(): Save a last checkpoint, for when we're done or have been stopped.
+	"""
+
+	global enabled
+
+	if not enabled:
+		return
+
+	if completed != completed_saved:
+		save()
+
+	fh.close()
+	enabled = False
+
+	logger.info("Checkpoint saved to %s: %d queries done" % (filename, watermark + len(done)))
+
+
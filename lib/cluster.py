@@ -0,0 +1,515 @@
+#
+# This module holds our code for running a batch across many worker processes, on
+# this host or on others.
+#
+# The coordinator (--batch FILE --coordinate HOST:PORT,...) splits the queries into
+# --shards shards by a hash of each name, and assigns the shards to workers with a
+# consistent hash ring, so that when a worker fails, only its shards move (to the
+# next workers on the ring).  Workers (--worker [ADDRESS:]PORT) make the queries with
+# the same code as --batch, and stream their output back.  The coordinator writes out
+# each shard's output once the whole shard is done, so that a shard which has to be
+# reassigned partway through never has any of its output written twice.
+#
+# The protocol is JSON, with each message preceded by a 2-byte length, as in framing.py:
+#
+# Coordinator to worker:
+#	{"type": "shard", "shard": N, "options": {...}} - Start a shard, with our output options
+#	{"type": "queries", "queries": [[query, query_type], ...]} - Some of the shard's queries
+#	{"type": "end"} - That was all of the shard's queries
+#
+# Worker to coordinator:
+#	{"type": "output", "text": "..."} - Some of the shard's output
+#	{"type": "done", "responses": N, "errors": N} - The shard is finished
+#
+# A worker which can't be connected to, hangs up, or doesn't send anything for
+# --worker-timeout seconds is given up on, and its shards are reassigned.
+#
+# Neither end holds a whole shard in memory: workers run queries as they arrive, and
+# the coordinator spools each shard's output to a file until the shard is done.
+#
+
+
+import bisect
+import copy
+import hashlib
+import json
+import logging
+import os
+import queue
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+
+from lib import batch
+from lib import framing
+from lib import memo
+from lib import output
+
+
+logger = logging.getLogger()
+
+
+#
+# The options which are sent to workers with each shard, so that every shard's
+# output is in the same format.
+#
+options = ("query_type", "json", "json_pretty_print", "json_backend", "fields", "text", "graph", "fake_ttl", "validate", "digest",
+	"follow_cnames", "max_cname_depth")
+
+#
+# How many points each worker gets on the hash ring.  More points spread shards more evenly.
+#
+virtual_nodes = 100
+
+#
+# Frames are at most 64K, so queries and output are sent in pieces.  Output is
+# counted in characters, which JSON can turn into up to 6 bytes each.
+#
+queries_per_frame = 100
+text_per_frame = 10000
+
+
+def hashText(text):
+	"""
+	hashText(text): Return a hash of some text which is the same on every host and every run.
+
+	CRC32 would be quicker, but it puts names like host1, host2, ... into only a few shards.
+	"""
+
+	return(int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size = 8).digest(), "big"))
+
+
+def getShard(q, num_shards):
+	"""
+	getShard(q, num_shards): Return which shard a query belongs in.
+	"""
+
+	return(hashText(q.lower().rstrip(".")) % num_shards)
+
+
+def parseAddress(text, default_address):
+	"""
+	parseAddress(text, default_address): Turn "ADDRESS:PORT" or "PORT" into a tuple of (address, port).
+	"""
+
+	(address, _, port) = text.rpartition(":")
+
+	return(address.strip("[]") or default_address, int(port))
+
+
+def getOptions(args):
+	"""
+	getOptions(args): Return our output options, in a form which can be sent as JSON.
+	"""
+
+	retval = { key: getattr(args, key) for key in options }
+
+	if retval["fields"] is not None:
+		retval["fields"] = sorted(retval["fields"])
+
+	return(retval)
+
+
+def setOptions(args, shard_options):
+	"""
+	setOptions(args, shard_options): Return a copy of args, with the options a coordinator sent us.
+	"""
+
+	retval = copy.copy(args)
+
+	for key in options:
+		if key in shard_options:
+			setattr(retval, key, shard_options[key])
+
+	if retval.fields is not None:
+		retval.fields = frozenset(retval.fields)
+
+	return(retval)
+
+
+def sendMessage(fh, message):
+	"""
+	sendMessage(fh, message): Send a message to the other end, and make sure it goes out.
+	"""
+
+	framing.writeFrame(fh, json.dumps(message).encode("utf-8"))
+	fh.flush()
+
+
+def readMessages(fh):
+	"""
+	readMessages(fh): Read messages from the other end, one at a time.
+	"""
+
+	for frame in framing.readFrames(fh):
+		yield(json.loads(frame))
+
+
+class HashRing():
+	"""
+	HashRing: A consistent hash ring of workers.
+
+	Each worker is placed on the ring at virtual_nodes points, and a shard belongs to
+	the first worker at or after its own point.  Removing a worker only moves the
+	shards which belonged to it.
+	"""
+
+	def __init__(self, workers):
+		self.points = sorted((hashText("%s#%d" % (worker, i)), worker) for worker in workers for i in range(virtual_nodes))
+
+	def remove(self, worker):
+		self.points = [ point for point in self.points if point[1] != worker ]
+
+	def getWorker(self, shard):
+		"""
+		getWorker(shard): Return the worker a shard belongs to, or None if there are no workers left.
+		"""
+
+		if not self.points:
+			return(None)
+
+		index = bisect.bisect_left(self.points, (hashText("shard-%d" % shard), ""))
+
+		return(self.points[index % len(self.points)][1])
+
+
+class WorkerConnection(threading.Thread):
+	"""
+	WorkerConnection: Our connection to a single worker, which runs in its own thread.
+
+	Shards to run are put in self.shards, and None tells us to stop.  Each finished
+	shard (with the name of the file its output was spooled to), or the worker failing,
+	is reported in the events queue.
+	"""
+
+	def __init__(self, args, worker, directory, events):
+		threading.Thread.__init__(self, daemon = True)
+		self.args = args
+		self.worker = worker
+		self.directory = directory
+		self.events = events
+		self.shards = queue.Queue()
+		self.current = None
+
+	def run(self):
+
+		sock = None
+
+		try:
+			sock = socket.create_connection(parseAddress(self.worker, "127.0.0.1"), timeout = self.args.worker_timeout)
+			rfile = sock.makefile("rb")
+			wfile = sock.makefile("wb")
+
+			while True:
+
+				shard = self.shards.get()
+				if shard is None:
+					break
+
+				self.current = shard
+				(spool, responses, errors) = self.runShard(shard, rfile, wfile)
+				self.current = None
+
+				self.events.put(("done", self.worker, shard, spool, responses, errors))
+
+		except (OSError, ValueError) as e:
+			self.events.put(("failed", self.worker, self.current, str(e) or type(e).__name__))
+
+		finally:
+			if sock:
+				sock.close()
+
+	def runShard(self, shard, rfile, wfile):
+		"""
+		runShard(shard, rfile, wfile): Send a shard to our worker, and return a tuple of
+			(spool file, responses, errors) once it's done.
+
+		The worker starts sending output before it has all of the queries, so they're sent
+		from another thread.  Otherwise we could both block, each waiting for the other to read.
+		"""
+
+		sender = threading.Thread(target = self.sendShard, args = (shard, wfile), daemon = True)
+		sender.start()
+
+		spool = os.path.join(self.directory, "%d.out" % shard)
+
+		with open(spool, "w") as fh:
+			for message in readMessages(rfile):
+
+				if message["type"] == "output":
+					fh.write(message["text"])
+
+				elif message["type"] == "done":
+					sender.join()
+					return(spool, message["responses"], message["errors"])
+
+		raise ValueError("Worker hung up partway through shard %d" % shard)
+
+	def sendShard(self, shard, wfile):
+		"""
+		sendShard(shard, wfile): Send a shard's options and queries to our worker.
+
+		If the worker goes away, runShard() finds out when reading from it.
+		"""
+
+		try:
+			sendMessage(wfile, { "type": "shard", "shard": shard, "options": getOptions(self.args) })
+
+			queries = []
+			for entry in readShard(self.directory, shard):
+				queries.append(entry)
+				if len(queries) >= queries_per_frame:
+					sendMessage(wfile, { "type": "queries", "queries": queries })
+					queries = []
+
+			if queries:
+				sendMessage(wfile, { "type": "queries", "queries": queries })
+
+			sendMessage(wfile, { "type": "end" })
+
+		except (OSError, ValueError) as e:
+			logger.debug("Unable to send shard %d to %s: %s", shard, self.worker, e)
+
+
+def splitShards(args, directory):
+	"""
+	splitShards(args, directory): Write our queries into a file for each shard, so that a shard
+		can be read again if it has to be reassigned.
+
+	Returns a list of how many queries are in each shard.
+	"""
+
+	retval = [ 0 ] * args.shards
+	files = {}
+
+	try:
+		for (q, query_type) in batch.readQueries(args, args.batch):
+
+			shard = getShard(q, args.shards)
+
+			if shard not in files:
+				files[shard] = open(os.path.join(directory, "%d" % shard), "w")
+
+			files[shard].write("%s %s\n" % (q, query_type))
+			retval[shard] += 1
+
+	finally:
+		for fh in files.values():
+			fh.close()
+
+	return(retval)
+
+
+def readShard(directory, shard):
+	"""
+	readShard(directory, shard): Read the queries in a shard, one at a time, as [ query, query_type ].
+	"""
+
+	with open(os.path.join(directory, "%d" % shard), "r") as fh:
+		for line in fh:
+			yield(line.split())
+
+
+def writeSpool(spool):
+	"""
+	writeSpool(spool): Write out a finished shard's output from its spool file, a piece at a time.
+	"""
+
+	output.flush()
+	out = output.stream or sys.stdout
+
+	with open(spool, "r") as fh:
+		shutil.copyfileobj(fh, out)
+
+	out.flush()
+	os.remove(spool)
+
+
+def coordinate(args):
+	"""
+	coordinate(args): Run our batch across our workers, and print each shard's output as it finishes.
+	"""
+
+	output.flush_every = args.flush_every
+
+	count = 0
+	errors = 0
+
+	with tempfile.TemporaryDirectory(prefix = "dns-tool-") as directory:
+
+		shards = [ shard for (shard, num) in enumerate(splitShards(args, directory)) if num ]
+
+		ring = HashRing(args.coordinate)
+		events = queue.Queue()
+		connections = { worker: WorkerConnection(args, worker, directory, events) for worker in args.coordinate }
+
+		for shard in shards:
+			connections[ring.getWorker(shard)].shards.put(shard)
+
+		logger.info("Running %d shards across %d workers" % (len(shards), len(connections)))
+
+		for connection in connections.values():
+			connection.start()
+
+		remaining = set(shards)
+
+		while remaining:
+
+			event = events.get()
+
+			if event[0] == "done":
+				(_, worker, shard, spool, responses, shard_errors) = event
+				logger.info("Shard %d done on %s: %d responses, %d errors" % (shard, worker, responses, shard_errors))
+
+				writeSpool(spool)
+
+				count += responses
+				errors += shard_errors
+				remaining.discard(shard)
+				continue
+
+			#
+			# A worker failed, so take it off the ring, and give its shards to whichever workers are next.
+			#
+			(_, worker, shard, reason) = event
+			logger.warning("Worker %s failed: %s" % (worker, reason))
+			ring.remove(worker)
+
+			lost = [ shard ] if shard is not None else []
+			while True:
+				try:
+					lost.append(connections[worker].shards.get_nowait())
+				except queue.Empty:
+					break
+
+			for shard in lost:
+
+				new_worker = ring.getWorker(shard)
+				if new_worker is None:
+					raise Exception("All workers have failed, %d shards were not finished" % len(remaining))
+
+				logger.info("Reassigning shard %d from %s to %s" % (shard, worker, new_worker))
+				connections[new_worker].shards.put(shard)
+
+		for connection in connections.values():
+			connection.shards.put(None)
+
+	logger.info("Batch complete: %d responses, %d errors" % (count, errors))
+
+
+class ShardWriter():
+	"""
+	ShardWriter: Stands in for our output file while a worker runs a shard, and sends
+		everything written to it back to the coordinator.
+	"""
+
+	def __init__(self, fh):
+		self.fh = fh
+
+	def write(self, text):
+		for i in range(0, len(text), text_per_frame):
+			sendMessage(self.fh, { "type": "output", "text": text[i:i + text_per_frame] })
+
+	def flush(self):
+		self.fh.flush()
+
+
+def readQueries(messages, shard):
+	"""
+	readQueries(messages, shard): Read a shard's queries from our coordinator as they arrive,
+		one at a time, as (query, query_type).
+	"""
+
+	for message in messages:
+
+		if message["type"] == "end":
+			return
+
+		for (q, query_type) in message["queries"]:
+			yield(q, query_type)
+
+	raise ValueError("Coordinator hung up partway through shard %d" % shard)
+
+
+def runShards(args, sock):
+	"""
+	runShards(args, sock): Run each shard a coordinator sends us, until it hangs up.
+	"""
+
+	rfile = sock.makefile("rb")
+	wfile = sock.makefile("wb")
+	messages = readMessages(rfile)
+	last_options = None
+
+	for message in messages:
+
+		if message["type"] != "shard":
+			raise ValueError("Expected the start of a shard, got %s" % message["type"])
+
+		shard = message["shard"]
+		shard_args = setOptions(args, message["options"])
+		logger.info("Running shard %d" % shard)
+
+		#
+		# Our memo holds responses parsed with the last shard's options (which fields,
+		# fake TTLs, and so on), so it can't be used with different ones.
+		#
+		if message["options"] != last_options:
+			memo.entries.clear()
+			last_options = message["options"]
+
+		stream = output.stream
+		output.stream = ShardWriter(wfile)
+
+		try:
+			(responses, errors) = batch.runQueries(shard_args, readQueries(messages, shard))
+			output.flush()
+
+		finally:
+			output.stream = stream
+
+		logger.info("Shard %d done: %d responses, %d errors" % (shard, responses, errors))
+		sendMessage(wfile, { "type": "done", "responses": responses, "errors": errors })
+
+
+def serve(args):
+	"""
+	serve(args): Run as a worker, taking shards from one coordinator at a time.
+	"""
+
+	output.flush_every = args.flush_every
+
+	address = parseAddress(args.worker, "127.0.0.1")
+	listener = socket.create_server(address)
+
+	logger.info("Worker listening on %s:%d, querying %s" % (address[0], address[1], args.server))
+
+	try:
+		while True:
+
+			(sock, peer) = listener.accept()
+			logger.info("Coordinator connected from %s" % peer[0])
+
+			try:
+				runShards(args, sock)
+
+			except (OSError, ValueError) as e:
+				logger.warning("Lost our coordinator: %s" % e)
+
+			except Exception as e:
+				logger.error("Unable to run shard for our coordinator: %s" % e)
+
+			finally:
+				sock.close()
+
+			logger.info("Coordinator disconnected")
+
+	except KeyboardInterrupt:
+		logger.info("Interrupted, stopping.")
+
+	finally:
+		listener.close()
+
+
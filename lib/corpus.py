@@ -0,0 +1,292 @@
+#
+# This module generates corpora of synthetic DNS responses, for benchmarking
+# and stress-testing the parser without needing to capture real traffic.
+#
+
+
+import base64
+import logging
+import random
+import struct
+import sys
+
+from lib import create
+from lib import create_response
+from lib import framing
+
+
+logger = logging.getLogger()
+
+
+#
+# Building blocks for our synthetic domain-names.
+#
+labels = [
+	"www", "mail", "api", "cdn", "static", "images", "login", "shop", "blog", "dev",
+	"staging", "edge", "us-east-1", "eu-west-2", "a", "b", "c", "ns", "smtp", "mx",
+	"google", "gmail", "github", "example", "dmuth", "amazonaws", "cloudfront", "akamaiedge",
+	"fastly", "verisign-grs", "awsdns-31", "root-servers", "test", "internal", "corp",
+	]
+tlds = [ "com", "net", "org", "io", "co.uk", "de", "invalid" ]
+
+#
+# The types of question we ask, weighted roughly by how often they occur in the wild.
+#
+question_types = [ "a", "a", "a", "a", "aaaa", "aaaa", "cname", "mx", "ns", "soa", "txt" ]
+
+
+def randomBytes(rand, length):
+	"""
+	randomBytes(rand, length): Create a string of random bytes.
+
+	This is what Random.randbytes() does, but that's only in Python 3.9 and later.
+	"""
+
+	return(rand.getrandbits(length * 8).to_bytes(length, "little"))
+
+
+def randomName(rand, min_labels = 1, max_labels = 3):
+	"""
+	randomName(rand, min_labels = 1, max_labels = 3): Create a random domain-name
+	"""
+
+	parts = [ rand.choice(labels) for i in range(rand.randint(min_labels, max_labels)) ]
+	parts.append(rand.choice(tlds))
+
+	return(".".join(parts))
+
+
+def randomRdata(rand, record_type, q):
+	"""
+	randomRdata(rand, record_type, q): Create random RDATA for a record of a specific type.
+
+	Names are usually built from the question so that there is plenty to compress.
+	"""
+
+	if record_type == "a":
+		return({"ip": "%d.%d.%d.%d" % (rand.randint(1, 223), rand.randint(0, 255),
+			rand.randint(0, 255), rand.randint(1, 254))})
+
+	elif record_type == "aaaa":
+		return({"ip": ":".join("%x" % rand.randint(0, 0xffff) for i in range(8))})
+
+	elif record_type in ("ns", "cname"):
+		return({"text": "%s.%s" % (rand.choice(labels), q)})
+
+	elif record_type == "mx":
+		return({"preference": rand.choice([ 1, 5, 10, 20, 30 ]),
+			"exchange": "%s.%s" % (rand.choice(labels), q)})
+
+	elif record_type == "soa":
+		return({"mname": "ns-%d.%s" % (rand.randint(1, 2048), randomName(rand, 1, 1)),
+			"rname": "hostmaster.%s" % q,
+			"serial": rand.randint(1, 2**32 - 1),
+			"refresh": 7200, "retry": 900, "expire": 1209600, "minimum": 86400})
+
+	elif record_type == "txt":
+		return({"text": "v=spf1 include:%s ~all" % randomName(rand)})
+
+	raise Exception("Unable to create RDATA for type: %s" % record_type)
+
+
+def randomRrsig(rand, record_type, name, ttl):
+	"""
+	randomRrsig(rand, record_type, name, ttl): Create random RDATA for an RRSIG record which
+		signs the records of a type owned by name.
+	"""
+
+	inception = rand.randint(1500000000, 1800000000)
+
+	return({"type_covered": create.query_types[record_type], "algorithm": rand.choice([ 8, 13, 15 ]),
+		"labels": len(name.split(".")), "original_ttl": ttl,
+		"expiration": inception + 14 * 86400, "inception": inception, "key_tag": rand.randint(0, 65535),
+		"signer": name.split(".", 1)[-1],
+		"signature": base64.b64encode(randomBytes(rand, rand.choice([ 64, 96, 256 ]))).decode("ascii")})
+
+
+def randomOpt(rand):
+	"""
+	randomOpt(rand): Create a random OPT pseudo-record, sometimes with a DNS cookie (RFC 7873).
+	"""
+
+	options = []
+	if rand.random() < 0.5:
+		options.append({"code": 10, "data": randomBytes(rand, 16).hex()})
+
+	#
+	# The class is the UDP payload size, and the TTL holds the DO bit.
+	#
+	return({"name": "", "type": "opt", "class": rand.choice([ 512, 1232, 4096 ]),
+		"ttl": rand.choice([ 0, 0x8000 ]), "rdata": {"options": options}})
+
+
+def randomResponse(rand):
+	"""
+	randomResponse(rand): Create a single random response packet
+
+	Most responses are answers to the question (sometimes after a CNAME), some
+	have authority and glue records, and some are NXDOMAIN with an SOA in the authority section.
+	Some answers are signed (RRSIG), and most responses have an OPT pseudo-record, as with EDNS.
+	"""
+
+	q = randomName(rand)
+	query_type = rand.choice(question_types)
+	request_id = rand.randint(0, 65535)
+	ttl = rand.choice([ 30, 60, 300, 3600, 86400 ])
+
+	answers = []
+	authority = []
+	additional = []
+	flags = create_response.default_flags
+
+	if rand.random() < 0.1:
+		#
+		# NXDOMAIN, with the SOA for the zone in the authority section.
+		#
+		flags |= 3
+		zone = q.split(".", 1)[-1]
+		authority.append({"name": zone, "type": "soa", "ttl": ttl,
+			"rdata": randomRdata(rand, "soa", zone)})
+
+	else:
+		name = q
+
+		if query_type != "cname" and rand.random() < 0.2:
+			target = "%s.%s" % (rand.choice(labels), randomName(rand, 1, 2))
+			answers.append({"name": name, "type": "cname", "ttl": ttl, "rdata": {"text": target}})
+			name = target
+
+		for i in range(rand.randint(1, 6 if query_type in ("a", "aaaa", "mx", "ns") else 1)):
+			answers.append({"name": name, "type": query_type, "ttl": ttl,
+				"rdata": randomRdata(rand, query_type, name)})
+
+		if rand.random() < 0.2:
+			answers.append({"name": name, "type": "rrsig", "ttl": ttl,
+				"rdata": randomRrsig(rand, query_type, name, ttl)})
+
+		if rand.random() < 0.3:
+			for i in range(rand.randint(1, 4)):
+				ns = "ns%d.%s" % (i + 1, q)
+				authority.append({"name": q, "type": "ns", "ttl": 172800, "rdata": {"text": ns}})
+				additional.append({"name": ns, "type": "a", "ttl": 172800,
+					"rdata": randomRdata(rand, "a", ns)})
+
+	if rand.random() < 0.7:
+		additional.append(randomOpt(rand))
+
+	retval = create_response.createResponse(request_id, q, query_type,
+		answers, authority, additional, flags = flags)
+
+	return(retval)
+
+
+def pointerChain(rand, packet):
+	"""
+	pointerChain(rand, packet): Append a chain of domain-names to our packet, each of which
+		is a label followed by a pointer to the one before it, and then records that point
+		at the end of the chain.
+
+	The chain is hidden in the RDATA of a record of an unknown type, so that it parses cleanly.
+	Without a limit, every record after it makes the parser walk the whole chain.
+	"""
+
+	packet = bytearray(packet)
+
+	rr_index = len(packet)
+	packet += struct.pack(">HHHIH", 0xc00c, 65280, 1, 60, 0)
+
+	packet += b"\x01a\x00"
+	end = len(packet) - 3
+
+	for i in range(rand.randint(50, 3000)):
+		if len(packet) > 0x3fff:
+			break
+		previous = end
+		end = len(packet)
+		packet += b"\x01a" + struct.pack(">H", 0xc000 | previous)
+
+	struct.pack_into(">H", packet, rr_index + 10, len(packet) - rr_index - 12)
+
+	for i in range(rand.randint(1, 2000)):
+		packet += struct.pack(">HHHIHH", 0xc000 | end, 2, 1, 60, 2, 0xc000 | end)
+
+	return(bytes(packet[0:65535]))
+
+
+def mutateResponse(rand, packet):
+	"""
+	mutateResponse(rand, packet): Damage a response in one of the ways that hostile or broken
+		servers (and fuzzers) do.
+	"""
+
+	mutation = rand.choice([ "flip", "flip", "truncate", "counts", "pointer", "chain", "repeat" ])
+	packet = bytearray(packet)
+
+	if mutation == "flip":
+		for i in range(rand.randint(1, 8)):
+			index = rand.randrange(len(packet))
+			packet[index] ^= 1 << rand.randrange(8)
+
+	elif mutation == "truncate":
+		packet = packet[0:rand.randint(12, len(packet))]
+
+	elif mutation == "counts":
+		struct.pack_into(">HHH", packet, 6, rand.randint(0, 65535), rand.randint(0, 65535), rand.randint(0, 65535))
+
+	elif mutation == "pointer":
+		#
+		# Point somewhere random, which includes pointing at itself.
+		#
+		index = rand.randrange(12, len(packet) - 1)
+		struct.pack_into(">H", packet, index, 0xc000 | rand.randrange(len(packet)))
+
+	elif mutation == "chain":
+		packet = pointerChain(rand, packet)
+
+	elif mutation == "repeat":
+		#
+		# Repeat the tail of the packet, which is usually one or more records, many times over.
+		#
+		tail = packet[rand.randrange(12, len(packet)):]
+		if tail:
+			packet += tail * (rand.randint(1, 60000) // len(tail))
+		packet = packet[0:65535]
+
+	return(bytes(packet))
+
+
+def generateCorpus(count, seed = None, fuzz = False):
+	"""
+	generateCorpus(count, seed = None, fuzz = False): Generate count random responses.
+
+	This is a generator, so arbitrarily large corpora can be created without
+	holding them in memory.  The same seed always produces the same corpus.
+
+	If fuzz is True, each response is damaged with mutateResponse().
+	"""
+
+	rand = random.Random(seed)
+
+	for i in range(count):
+		packet = randomResponse(rand)
+		if fuzz:
+			packet = mutateResponse(rand, packet)
+		yield(packet)
+
+
+def writeCorpus(args):
+	"""
+	writeCorpus(args): Write a synthetic corpus to stdout, with each packet
+		preceded by a 2-byte length.
+	"""
+
+	out = sys.stdout.buffer
+
+	for packet in generateCorpus(args.synthetic, args.seed, fuzz = args.fuzz):
+		framing.writeFrame(out, packet)
+
+	out.flush()
+
+	logger.info("Wrote %d synthetic responses" % args.synthetic)
+
+
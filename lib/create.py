@@ -7,6 +7,7 @@ import math
 import random
 import struct
 
+from lib import metrics
 
 logger = logging.getLogger()
 
@@ -32,21 +33,44 @@ query_types = {
 	"mx": 15,
 	"txt": 16,
 	"aaaa": 28,
+	"srv": 33,
+	"ds": 43,
+	"rrsig": 46,
+	"dnskey": 48,
 	"axfr": 252,
 	"mailb": 253,
 	"maila": 254,
 	"*": 255,
+	"caa": 257,
 	}
 
 
-def createHeader(args):
-	"""createHeader(args): Create a header for our question
+#
+# Our precompiled struct layouts
+#
+header_struct = struct.Struct(">HHHHHH")
+question_tail_struct = struct.Struct(">HH")
+request_id_struct = struct.Struct(">H")
 
-	An array of bytes is returned.
+#
+# Default header flags: a standard query (opcode 0) with RD (Recursion Desired) set.
+#
+default_flags = 0x0100
+
+#
+# Our cache of precompiled query templates, keyed by (query, query_type, flags).
+# Each template is a complete query with a request ID of zero.
+#
+query_templates = {}
+query_templates_max = 10000
 
-	"""
 
-	retval = bytes()
+def getRequestId(args):
+	"""getRequestId(args): Return the request ID to use for our query
+
+	If --request-id was specified, that hex value is used, otherwise a random ID is returned.
+
+	"""
 
 	if args.request_id:
 		#
@@ -60,90 +84,132 @@ def createHeader(args):
 	else:
 		request_id = random.randint(0, 65535)
 
+	return(request_id)
 
-	#
-	# The request ID is two bytes, so grab each byte, turn it into a char/string,
-	# and append it to the retval.
-	#
-	request_id1 = request_id >> 8
-	request_id2 = request_id & 0xff
-	retval += struct.pack("B", request_id1) + struct.pack("B", request_id2)
 
-	# Flags
-	flags = [0, 0]
+def createHeader(args, flags = default_flags):
+	"""createHeader(args, flags = default_flags): Create a header for our question
 
-	#
-	# Opcode: 0 = standard query, 1 = inverse query, 2 = server status request
-	#
-	opcode = 0
+	An array of bytes is returned.
+
+	"""
+
+	request_id = getRequestId(args)
 
+	#
+	# Flags: opcode 0 (standard query) and RD are set by default.
 	#
 	# TODO:
-	# - Add support for setting opcode in flags[0]
-	# - Add support for TC in flags[0]
+	# - Add support for setting opcode in the flags
+	# - Add support for TC in the flags
 	# 
 
-	# Recursion desired?
-	rd = 1
-	flags[0] |= rd
-
 	#
-	# Add in our header
+	# QDCOUNT is 1, and ANCOUNT, NSCOUNT, and ARCOUNT are all zero.
 	#
-	retval += struct.pack("B", flags[0]) + struct.pack("B", flags[1])
-
-
-	# QDCOUNT - Number of questions
-	qdcount = 1
-	retval += struct.pack(">H", qdcount)
-
-	# ANCOUNT - Number of answer
-	retval += struct.pack(">H", 0)
-
-	# NSCOUNT - Number of authority records
-	retval += struct.pack(">H", 0)
-
-	# ARCOUNT - Number of additional records
-	retval += struct.pack(">H", 0)
+	retval = header_struct.pack(request_id, flags, 1, 0, 0, 0)
 
 	return(retval)
 
 
-def createQuestion(q, query_type):
-	"""createQuestion(q, query_type): Create the question part of our query
+def encodeDomainName(q):
+	"""encodeDomainName(q): Turn a domain-name into a series of length-prefixed labels, terminated with a zero.
 
 	An array of bytes is returned.
 
 	"""
 
-	retval = bytes()
+	retval = bytearray()
 
 	#
 	# Split up our query, go through each part of it, 
 	# and add the len and characters onto the question.
 	#
-	parts = q.split(".")
-
-	for part in parts:
-		retval += struct.pack("B", len(part))
-		retval += struct.pack("%ds" % len(part), bytes(part, "utf-8"))
+	for part in q.split("."):
+		part = bytes(part, "utf-8")
+		retval.append(len(part))
+		retval += part
 
 	#
-	# End the question with a zero.
+	# End the domain-name with a zero.
 	#
-	retval += struct.pack("B", 0)
+	retval.append(0)
+
+	return(bytes(retval))
+
+
+def createQuestion(q, query_type):
+	"""createQuestion(q, query_type): Create the question part of our query
+
+	An array of bytes is returned.
+
+	"""
 
 	if query_type in query_types:
 		qtype = query_types[query_type]
 	else:
 		raise Exception("Unknown query_type: %s" % query_type)
 
-	retval += struct.pack(">H", qtype)
-
 	# QCLASS - 1 is IN
 	qclass = 1
-	retval += struct.pack(">H", qclass)
+
+	retval = encodeDomainName(q) + question_tail_struct.pack(qtype, qclass)
 
 	return(retval)
 
 
+def getQueryTemplate(q, query_type, flags = default_flags):
+	"""getQueryTemplate(q, query_type, flags = default_flags): Get a precompiled query for this question.
+
+	The header and question are only encoded the first time we see a (query, query_type, flags)
+	combination.  After that, the cached template is returned, and the caller need only patch
+	in the request ID.
+
+	"""
+
+	key = (q, query_type, flags)
+
+	if key in query_templates:
+		metrics.increment("dns_tool_cache_hits_total", cache = "query_template")
+		return(query_templates[key])
+
+	retval = header_struct.pack(0, flags, 1, 0, 0, 0) + createQuestion(q, query_type)
+
+	#
+	# Keep the cache bounded for very long batch runs.  Dicts are ordered,
+	# so the first key is the oldest template.
+	#
+	if len(query_templates) >= query_templates_max:
+		del query_templates[next(iter(query_templates))]
+
+	query_templates[key] = retval
+
+	return(retval)
+
+
+def createQuery(args, q = None, query_type = None, flags = default_flags, request_id = None):
+	"""createQuery(args, q = None, query_type = None, flags = default_flags, request_id = None): Create a complete query
+
+	The query, query type, and request ID default to what was specified on the command line.
+	Only the 2-byte request ID is written on each call; the rest of the packet
+	comes from the template cache.
+
+	An array of bytes is returned.
+
+	"""
+
+	if q is None:
+		q = args.query
+
+	if query_type is None:
+		query_type = args.query_type
+
+	if request_id is None:
+		request_id = getRequestId(args)
+
+	retval = bytearray(getQueryTemplate(q, query_type, flags))
+	request_id_struct.pack_into(retval, 0, request_id)
+
+	return(bytes(retval))
+
+
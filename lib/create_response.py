@@ -0,0 +1,280 @@
+#
+# This module holds functions which are used to create complete DNS responses,
+# with answer, authority, and additional sections.
+#
+# Domain-names are compressed as described in RFC 1035 4.1.4.
+#
+
+import base64
+import ipaddress
+import logging
+import struct
+
+from lib import create
+
+
+logger = logging.getLogger()
+
+
+#
+# Our precompiled struct layouts
+#
+rr_struct = struct.Struct(">HHIH")
+short_struct = struct.Struct(">H")
+soa_struct = struct.Struct(">LLLLL")
+srv_struct = struct.Struct(">HHH")
+ds_struct = struct.Struct(">HBB")
+rrsig_struct = struct.Struct(">HBBLLLH")
+option_struct = struct.Struct(">HH")
+
+#
+# The types of record we can create.  That's everything which can be queried,
+# and OPT, which is a pseudo-record that can't be.
+#
+record_types = dict(create.query_types, opt = 41)
+
+#
+# Default header flags for a response: QR, RD, and RA are set.
+#
+default_flags = 0x8180
+
+#
+# Pointers only have 14 bits for the offset, so anything past this can't be pointed to.
+#
+max_pointer_offset = 0x3fff
+
+
+def encodeDomainName(packet, name, suffixes):
+	"""
+	encodeDomainName(packet, name, suffixes): Append a domain-name to our packet, compressing it.
+
+	packet - A bytearray of the message so far
+	name - The domain-name to append
+	suffixes - A dictionary of previously written suffixes (lowercase) and their offsets
+
+	As each label is written, the suffix starting with that label is added to the suffix
+	table.  If we come across a suffix which was already written, we write a pointer
+	to it and stop.
+	"""
+
+	#
+	# A fully qualified name ends in a dot, but the root label is written by us either way.
+	#
+	if name.endswith("."):
+		name = name[:-1]
+
+	if not name:
+		packet.append(0)
+		return
+
+	labels = name.split(".")
+
+	for i in range(len(labels)):
+
+		suffix = ".".join(labels[i:]).lower()
+
+		if suffix in suffixes:
+			packet += short_struct.pack(0xc000 | suffixes[suffix])
+			return
+
+		if len(packet) <= max_pointer_offset:
+			suffixes[suffix] = len(packet)
+
+		label = bytes(labels[i], "utf-8")
+		packet.append(len(label))
+		packet += label
+
+	packet.append(0)
+
+
+def encodeRdataA(packet, rdata, suffixes):
+	"""
+	encodeRdataA(packet, rdata, suffixes): Append the address for an A record
+	"""
+	packet += ipaddress.IPv4Address(rdata["ip"]).packed
+
+
+def encodeRdataAAAA(packet, rdata, suffixes):
+	"""
+	encodeRdataAAAA(packet, rdata, suffixes): Append the address for an AAAA record
+	"""
+	packet += ipaddress.IPv6Address(rdata["ip"]).packed
+
+
+def encodeRdataName(packet, rdata, suffixes):
+	"""
+	encodeRdataName(packet, rdata, suffixes): Append the domain-name for an NS, CNAME, or PTR record
+	"""
+	encodeDomainName(packet, rdata["text"], suffixes)
+
+
+def encodeRdataSoa(packet, rdata, suffixes):
+	"""
+	encodeRdataSoa(packet, rdata, suffixes): Append the body of an SOA record
+	"""
+	encodeDomainName(packet, rdata["mname"], suffixes)
+	encodeDomainName(packet, rdata["rname"], suffixes)
+	packet += soa_struct.pack(rdata["serial"], rdata["refresh"], rdata["retry"],
+		rdata["expire"], rdata["minimum"])
+
+
+def encodeRdataMx(packet, rdata, suffixes):
+	"""
+	encodeRdataMx(packet, rdata, suffixes): Append the preference and exchange of an MX record
+	"""
+	packet += short_struct.pack(rdata["preference"])
+	encodeDomainName(packet, rdata["exchange"], suffixes)
+
+
+def encodeRdataTxt(packet, rdata, suffixes):
+	"""
+	encodeRdataTxt(packet, rdata, suffixes): Append a single character-string for a TXT record
+	"""
+	text = bytes(rdata["text"], "utf-8")[0:255]
+	packet.append(len(text))
+	packet += text
+
+
+def encodeRdataSrv(packet, rdata, suffixes):
+	"""
+	encodeRdataSrv(packet, rdata, suffixes): Append the body of an SRV record
+
+	The target is never compressed (RFC 2782).
+	"""
+	packet += srv_struct.pack(rdata["priority"], rdata["weight"], rdata["port"])
+	encodeDomainName(packet, rdata["target"], {})
+
+
+def encodeRdataCaa(packet, rdata, suffixes):
+	"""
+	encodeRdataCaa(packet, rdata, suffixes): Append the flags, tag, and value of a CAA record
+	"""
+	tag = bytes(rdata["tag"], "utf-8")
+	packet.append(rdata["flags"])
+	packet.append(len(tag))
+	packet += tag
+	packet += bytes(rdata["value"], "utf-8")
+
+
+def encodeRdataDs(packet, rdata, suffixes):
+	"""
+	encodeRdataDs(packet, rdata, suffixes): Append the body of a DS record
+	"""
+	packet += ds_struct.pack(rdata["key_tag"], rdata["algorithm"], rdata["digest_type"])
+	packet += bytes.fromhex(rdata["digest"])
+
+
+def encodeRdataDnskey(packet, rdata, suffixes):
+	"""
+	encodeRdataDnskey(packet, rdata, suffixes): Append the body of a DNSKEY record
+	"""
+	packet += ds_struct.pack(rdata["flags"], rdata["protocol"], rdata["algorithm"])
+	packet += base64.b64decode(rdata["public_key"])
+
+
+def encodeRdataRrsig(packet, rdata, suffixes):
+	"""
+	encodeRdataRrsig(packet, rdata, suffixes): Append the body of an RRSIG record
+
+	The signer's name is never compressed (RFC 4034 3.1.7).
+	"""
+	packet += rrsig_struct.pack(rdata["type_covered"], rdata["algorithm"], rdata["labels"],
+		rdata["original_ttl"], rdata["expiration"], rdata["inception"], rdata["key_tag"])
+	encodeDomainName(packet, rdata["signer"], {})
+	packet += base64.b64decode(rdata["signature"])
+
+
+def encodeRdataOpt(packet, rdata, suffixes):
+	"""
+	encodeRdataOpt(packet, rdata, suffixes): Append the options of an OPT pseudo-record
+
+	The record's name should be the root (""), its "class" the UDP payload size, and its
+	"ttl" the extended RCODE and flags (RFC 6891 6.1.2).
+	"""
+	for option in rdata["options"]:
+		value = bytes.fromhex(option["data"])
+		packet += option_struct.pack(option["code"], len(value))
+		packet += value
+
+
+#
+# A lookup table of encoders for each type of record we can create.
+#
+rdata_encoders = {
+	"a": encodeRdataA,
+	"ns": encodeRdataName,
+	"cname": encodeRdataName,
+	"ptr": encodeRdataName,
+	"soa": encodeRdataSoa,
+	"mx": encodeRdataMx,
+	"txt": encodeRdataTxt,
+	"aaaa": encodeRdataAAAA,
+	"srv": encodeRdataSrv,
+	"opt": encodeRdataOpt,
+	"ds": encodeRdataDs,
+	"rrsig": encodeRdataRrsig,
+	"dnskey": encodeRdataDnskey,
+	"caa": encodeRdataCaa,
+	}
+
+
+def encodeRecord(packet, record, suffixes):
+	"""
+	encodeRecord(packet, record, suffixes): Append a Resource Record to our packet
+
+	record - A dictionary with the keys "name", "type", "ttl", "rdata", and optionally "class".
+		The contents of "rdata" are in the same format that parse_answer_body returns.
+	"""
+
+	record_type = record["type"]
+
+	if record_type not in rdata_encoders:
+		raise Exception("Unable to encode record of type: %s" % record_type)
+
+	encodeDomainName(packet, record["name"], suffixes)
+
+	#
+	# We don't know RDLENGTH until the RDATA has been written (compression can
+	# shrink it), so write a placeholder and patch it afterwards.
+	#
+	rr_index = len(packet)
+	packet += rr_struct.pack(record_types[record_type], record.get("class", 1), record["ttl"], 0)
+
+	rdata_index = len(packet)
+	rdata_encoders[record_type](packet, record["rdata"], suffixes)
+
+	short_struct.pack_into(packet, rr_index + 8, len(packet) - rdata_index)
+
+
+def createResponse(request_id, q, query_type, answers = [], authority = [], additional = [],
+	flags = default_flags):
+	"""
+	createResponse(request_id, q, query_type, answers = [], authority = [], additional = [], flags = default_flags):
+		Create a complete response to a question.
+
+	Each section is a list of records in the format that encodeRecord() takes.
+	If q is None, the message has no question section, as in the later messages of a zone transfer.
+
+	An array of bytes is returned.
+	"""
+
+	packet = bytearray(create.header_struct.pack(request_id, flags, 0 if q is None else 1,
+		len(answers), len(authority), len(additional)))
+
+	suffixes = {}
+	if q is not None:
+		encodeDomainName(packet, q, suffixes)
+		packet += create.question_tail_struct.pack(create.query_types[query_type], 1)
+
+	for record in answers:
+		encodeRecord(packet, record, suffixes)
+
+	for record in authority:
+		encodeRecord(packet, record, suffixes)
+
+	for record in additional:
+		encodeRecord(packet, record, suffixes)
+
+	return(bytes(packet))
+
+
@@ -0,0 +1,131 @@
+#
+# This module handles streams of DNS messages, each preceded by a 2-byte length.
+# This is the framing that DNS over TCP uses (RFC 1035 4.2.2).
+#
+
+
+import logging
+import struct
+import sys
+
+
+logger = logging.getLogger()
+
+
+frame_struct = struct.Struct(">H")
+
+
+def writeFrame(fh, message):
+	"""
+	writeFrame(fh, message): Write a message to a binary file handle, preceded by its length.
+	"""
+
+	fh.write(frame_struct.pack(len(message)))
+	fh.write(message)
+
+
+def readExactly(fh, length):
+	"""
+	readExactly(fh, length): Read exactly length bytes from a file handle.
+
+	None is returned if the stream ends first.  Sockets and pipes can return less
+	than we asked for, so we keep reading until we have it all.
+	"""
+
+	retval = fh.read(length)
+	if retval is None or len(retval) == length:
+		return(retval)
+
+	retval = bytearray(retval)
+	while len(retval) < length:
+		data = fh.read(length - len(retval))
+		if not data:
+			return(None)
+		retval += data
+
+	return(bytes(retval))
+
+
+def openStdin():
+	"""
+	openStdin(): Return a binary file handle for stdin with a large buffer, so that
+		reading lots of small frames doesn't mean lots of small reads.
+	"""
+
+	return(open(sys.stdin.fileno(), "rb", buffering = 1024 * 1024, closefd = False))
+
+
+def readFrames(fh):
+	"""
+	readFrames(fh): Read messages from a binary file handle, one at a time.
+
+	This is a generator, so only one message is held in memory at a time.
+	"""
+
+	while True:
+
+		header = readExactly(fh, 2)
+		if not header:
+			break
+
+		length = frame_struct.unpack(header)[0]
+		message = readExactly(fh, length)
+
+		if message is None:
+			logger.warning("readFrames(): Stream ended in the middle of a %d byte message" % length)
+			break
+
+		yield(message)
+
+
+def readIntoExactly(fh, view):
+	"""
+	readIntoExactly(fh, view): Fill a memoryview from a file handle.
+
+	False is returned if the stream ends first.
+	"""
+
+	count = 0
+
+	while count < len(view):
+		data = fh.readinto(view[count:])
+		if not data:
+			return(False)
+		count += data
+
+	return(True)
+
+
+def readFrameViews(fh):
+	"""
+	readFrameViews(fh): Like readFrames(), but without copying each message into a new bytes object.
+
+	Each message is a memoryview of a buffer which is reused for the next one, so it
+	must be used (or copied with bytes()) before the next one is read.
+	"""
+
+	buffer = memoryview(bytearray(2 + 65535))
+	header = buffer[0:2]
+
+	#
+	# A buffered file handle almost always fills what we asked for in one call, so only
+	# fall back to readIntoExactly() when it doesn't.
+	#
+	readinto = fh.readinto
+	unpack = frame_struct.unpack
+
+	while True:
+
+		count = readinto(header)
+		if count != 2 and not readIntoExactly(fh, header[count:]):
+			break
+
+		(length,) = unpack(header)
+		message = buffer[2:2 + length]
+
+		count = readinto(message)
+		if count != length and not readIntoExactly(fh, message[count:]):
+			logger.warning("readFrameViews(): Stream ended in the middle of a %d byte message" % length)
+			break
+
+		yield(message)
@@ -0,0 +1,93 @@
+#
+# This module holds our intern tables, so that names, labels, and text descriptions
+# which show up over and over again in a batch share a single string object
+# instead of each parsed message getting its own copy.
+#
+# Unlike sys.intern(), our tables are bounded, so a long run over lots of
+# unique names doesn't grow without limit.
+#
+
+
+import logging
+
+
+logger = logging.getLogger()
+
+
+#
+# Our intern tables.  Labels are keyed by their raw bytes, so that a label we've
+# seen before doesn't even need to be decoded.
+#
+strings = {}
+labels = {}
+entries = {}
+max_entries = 100000
+
+#
+# The entry which ends every domain-name in our metadata.
+#
+end_entry = {"length": 0}
+
+
+def internString(string):
+	"""
+	internString(string): Return the shared copy of a string, adding it to our table if it's new.
+	"""
+
+	retval = strings.get(string)
+	if retval is not None:
+		return(retval)
+
+	if len(strings) >= max_entries:
+		del strings[next(iter(strings))]
+
+	strings[string] = string
+
+	return(string)
+
+
+def decodeLabel(data):
+	"""
+	decodeLabel(data): Decode the bytes of a label into a shared string.
+
+	UnicodeDecodeError is raised for labels which aren't valid UTF-8, as before.
+	"""
+
+	retval = labels.get(data)
+	if retval is not None:
+		return(retval)
+
+	retval = internString(data.decode("utf-8"))
+
+	if len(labels) >= max_entries:
+		del labels[next(iter(labels))]
+
+	labels[bytes(data)] = retval
+
+	return(retval)
+
+
+def internEntry(key, value):
+	"""
+	internEntry(key, value): Return the shared dictionary of {key: value[0], ...} for a label or pointer
+		in our domain-name metadata, such as {"length": 3, "string": "www"}.
+
+	key - A tuple of the dictionary's keys
+	value - A tuple of the dictionary's values
+
+	The dictionary that is returned is shared, and must not be changed.
+	"""
+
+	retval = entries.get((key, value))
+	if retval is not None:
+		return(retval)
+
+	if len(entries) >= max_entries:
+		del entries[next(iter(entries))]
+
+	retval = dict(zip(key, value))
+	entries[(key, value)] = retval
+
+	return(retval)
+
+
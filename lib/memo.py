@@ -0,0 +1,146 @@
+#
+# This module holds our memo of parsed responses.
+#
+# Real captures and batch runs have lots of responses which are byte-for-byte the
+# same apart from their request ID and TTLs.  So we mask those out, and if we've
+# parsed the same packet before, reuse the question, answers, and sanity results
+# from last time, patching in only the TTLs.
+#
+
+
+import collections
+import logging
+import struct
+
+from lib import budget
+from lib import metrics
+from lib import offsets
+from lib import output
+from lib import parse_answer
+
+
+logger = logging.getLogger()
+
+
+#
+# Our memo, in least recently used order.  Keys are packets with the request ID and TTLs
+# zeroed out, and values are (question, answers, sanity for each answer).
+#
+# It's off unless --parse-cache is given, since making a key costs about as much as
+# a parse saves, and it only pays for itself when most packets are repeats.
+#
+entries = collections.OrderedDict()
+entries_max = 0
+
+ttl_struct = struct.Struct(">I")
+count_struct = struct.Struct(">HHHH")
+
+
+def getKey(message):
+	"""
+	getKey(message): Return our key for a packet, and a list of (TTL, offset of the TTL in the record)
+		for each of its records.
+
+	None is returned for the key if the packet is too broken to mask.  That includes
+	packets whose counts don't match what's in them, since the parser doesn't trust
+	those counts, and if we did we could mask bytes which aren't TTLs at all.
+	"""
+
+	data = bytearray(message)
+	ttls = []
+
+	try:
+		(num_questions, num_answers, num_authority_records, num_additional_records) = count_struct.unpack_from(data, 4)
+		if num_questions != 1:
+			return(None, ttls)
+
+		records = offsets.getRecords(data, offsets.getQuestionLength(data))
+
+	except (IndexError, struct.error, budget.BudgetExceeded):
+		return(None, ttls)
+
+	if len(records) != num_answers + num_authority_records + num_additional_records:
+		return(None, ttls)
+
+	if records and records[-1][2] != len(data):
+		return(None, ttls)
+
+	offsets.short_struct.pack_into(data, 0, 0)
+
+	for (start, ttl_index, end) in records:
+		ttls.append((ttl_struct.unpack_from(data, ttl_index)[0], ttl_index - start))
+
+		#
+		# The TTL of an OPT pseudo-record holds the extended RCODE and flags, which
+		# are decoded, so it stays in the key.
+		#
+		if offsets.short_struct.unpack_from(data, ttl_index - 4)[0] != offsets.opt_type:
+			ttl_struct.pack_into(data, ttl_index, 0)
+
+	return(bytes(data), ttls)
+
+
+def get(args, key, ttls):
+	"""
+	get(args, key, ttls): Look up a packet in our memo.
+
+	If it is there, return (question, answers, sanity for each answer) with the TTLs patched in.
+	Otherwise, return None.
+	"""
+
+	if key is None or not key in entries:
+		return(None)
+
+	entries.move_to_end(key)
+	metrics.increment("dns_tool_cache_hits_total", cache = "parse")
+
+	(question, answers, sanity_answers) = entries[key]
+
+	retval = []
+
+	for (answer, (ttl, ttl_offset)) in zip(answers, ttls):
+
+		if args.fake_ttl:
+			ttl = -1
+
+		#
+		# Most of the time the TTL hasn't changed, and the answer can be reused as is.
+		# Otherwise, copy just the parts that we need to change.
+		#
+		if answer["headers"]["ttl"] != ttl:
+			answer = dict(answer)
+			answer["headers"] = dict(answer["headers"])
+			answer["headers"]["ttl"] = ttl
+			if "ttl_text" in answer["headers"]:
+				answer["headers"]["ttl_text"] = parse_answer.getTtlText(ttl)
+
+			#
+			# The hex dump is of the whole record, TTL included.
+			#
+			if "rddata_hex" in answer:
+				i = ttl_offset * 3
+				answer["rddata_hex"] = (answer["rddata_hex"][0:i]
+					+ output.formatHex(ttl_struct.pack(ttl)) + answer["rddata_hex"][i + 11:])
+
+		retval.append(answer)
+
+	return(question, retval, sanity_answers)
+
+
+def put(key, ttls, question, answers, sanity_answers):
+	"""
+	put(key, ttls, question, answers, sanity_answers): Add a parsed packet to our memo.
+
+	The parsed results are shared with everything that gets them from our memo, so
+	they must not be changed after this.
+	"""
+
+	if key is None or len(ttls) != len(answers):
+		return
+
+	if len(entries) >= entries_max:
+		entries.popitem(last = False)
+
+	entries[key] = (question, answers, sanity_answers)
+
+
@@ -0,0 +1,248 @@
+#
+# This module holds our code for --mem-report, which tracks how much memory we use
+# while parsing lots of messages, so that workers can be sized without guessing.
+#
+# tracemalloc is started with a single frame per allocation, which is enough to tell
+# which of our modules made it and keeps the overhead down.  While we run, samples of
+# traced memory and RSS are taken every so often.  When we exit, a snapshot is compared
+# with the one taken at the start, and what was retained is broken down by stage.
+#
+# Nothing is recorded unless start() has been called, so the cost when --mem-report
+# is off is a single check per message.
+#
+
+
+import atexit
+import logging
+import os
+import resource
+import sys
+import time
+
+
+logger = logging.getLogger()
+
+
+#
+# Are we tracking memory?
+#
+enabled = False
+
+#
+# Which stage each of our modules belongs to.  Anything else is "other".
+#
+stages = {
+	"parse.py": "parse.parseHeader",
+	"parse_question.py": "parse_question",
+	"parse_answer.py": "parse_answer",
+	"parse_answer_body.py": "parse_answer_body",
+	"output.py": "output",
+	"output_json.py": "output",
+	"output_text.py": "output",
+	"projection.py": "output",
+	"interning.py": "caches (interning, memo)",
+	"memo.py": "caches (interning, memo)",
+	}
+
+#
+# How many messages we have parsed, and when we started.
+#
+messages = 0
+start_time = None
+baseline = None
+
+#
+# Our samples of (seconds, messages, traced bytes, peak traced bytes, RSS, peak RSS).
+# Once we have samples_max of them, every other one is dropped and the interval is
+# doubled, so long runs are covered end to end without the list growing forever.
+#
+samples = []
+samples_max = 256
+sample_interval = 1.0
+next_sample = 0
+
+#
+# Only check the clock every this many messages.
+#
+check_every = 100
+
+sample_template = "   %8.1fs %10d msgs   traced %10s (peak %10s)   RSS %10s (peak %10s)\n"
+stage_header_template = "   %-26s %12s %10s %14s\n"
+stage_template = "   %-26s %12s %10d %14s\n"
+site_template = "   %12s %10d   %s\n"
+
+
+def formatBytes(num_bytes):
+	"""
+	formatBytes(num_bytes): Return a number of bytes as text, such as "1.5 MB"
+	"""
+
+	if num_bytes is None:
+		return("-")
+
+	for unit in ("bytes", "KB", "MB"):
+		if abs(num_bytes) < 1024:
+			if unit == "bytes":
+				return("%d %s" % (num_bytes, unit))
+			return("%.1f %s" % (num_bytes, unit))
+		num_bytes /= 1024
+
+	return("%.1f GB" % num_bytes)
+
+
+def getRss():
+	"""
+	getRss(): Return a tuple of (current RSS, peak RSS) in bytes.
+
+	Current RSS comes from /proc, so it is None where that isn't available.
+	"""
+
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+	#
+	# ru_maxrss is in bytes on Macs, and in kilobytes everywhere else.
+	#
+	if sys.platform != "darwin":
+		peak *= 1024
+
+	current = None
+	try:
+		with open("/proc/self/statm") as fh:
+			current = int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+	except (OSError, ValueError, IndexError):
+		pass
+
+	return(current, peak)
+
+
+def start():
+	"""
+	start(): Start tracking memory, and write out a report when we exit.
+	"""
+
+	global enabled
+	global start_time
+	global baseline
+
+	import tracemalloc
+
+	tracemalloc.start(1)
+
+	enabled = True
+	start_time = time.time()
+	baseline = tracemalloc.take_snapshot()
+
+	sample()
+	atexit.register(report)
+
+
+def sample():
+	"""
+	sample(): Record how much memory we're using right now.
+	"""
+
+	global sample_interval
+	global samples
+	global next_sample
+
+	import tracemalloc
+
+	now = time.time()
+	(traced, traced_peak) = tracemalloc.get_traced_memory()
+	(rss, rss_peak) = getRss()
+
+	samples.append((now - start_time, messages, traced, traced_peak, rss, rss_peak))
+
+	if len(samples) >= samples_max:
+		samples = samples[::2]
+		sample_interval *= 2
+
+	next_sample = now + sample_interval
+
+
+def countMessage():
+	"""
+	countMessage(): Note that we parsed a message, and take a sample if it's time.
+	"""
+
+	global messages
+	messages += 1
+
+	if not messages % check_every and time.time() >= next_sample:
+		sample()
+
+
+def getStage(filename):
+	"""
+	getStage(filename): Return which stage a source file belongs to.
+	"""
+
+	name = filename.replace("\\", "/").rsplit("/", 1)[-1]
+
+	if "/lib/" in filename.replace("\\", "/") and name in stages:
+		return(stages[name])
+
+	return("other")
+
+
+def report():
+	"""
+	report(): Write our report to stderr.
+	"""
+
+	global enabled
+
+	if not enabled:
+		return
+
+	import tracemalloc
+
+	sample()
+
+	snapshot = tracemalloc.take_snapshot()
+	tracemalloc.stop()
+	enabled = False
+
+	snapshot = snapshot.filter_traces((
+		tracemalloc.Filter(False, tracemalloc.__file__),
+		tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+		tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+		))
+
+	buf = []
+	buf.append("\nMemory report: %d messages in %.1f seconds\n\n" % (messages, samples[-1][0]))
+
+	buf.append("Memory over time:\n")
+	for entry in samples:
+		buf.append(sample_template % (entry[0], entry[1], formatBytes(entry[2]), formatBytes(entry[3]),
+			formatBytes(entry[4]), formatBytes(entry[5])))
+
+	#
+	# What each stage is holding on to now, compared to when we started.
+	#
+	retained = {}
+	for diff in snapshot.compare_to(baseline, "filename"):
+		stage = getStage(diff.traceback[0].filename)
+		(size, count) = retained.get(stage, (0, 0))
+		retained[stage] = (size + diff.size_diff, count + diff.count_diff)
+
+	buf.append("\nRetained by stage:\n")
+	buf.append(stage_header_template % ("Stage", "Bytes", "Blocks", "Bytes/message"))
+	total = 0
+	for (stage, (size, count)) in sorted(retained.items(), key = lambda item: -item[1][0]):
+		total += size
+		buf.append(stage_template % (stage, formatBytes(size), count,
+			formatBytes(size / messages) if messages else "-"))
+	buf.append(stage_template % ("total", formatBytes(total), sum(count for (_, count) in retained.values()),
+		formatBytes(total / messages) if messages else "-"))
+
+	buf.append("\nTop allocation sites still held:\n")
+	for diff in snapshot.compare_to(baseline, "lineno")[:10]:
+		frame = diff.traceback[0]
+		buf.append(site_template % (formatBytes(diff.size_diff), diff.count_diff,
+			"%s:%d (%s)" % (frame.filename, frame.lineno, getStage(frame.filename))))
+
+	sys.stderr.write("".join(buf))
+
+
@@ -0,0 +1,194 @@
+#
+# This module keeps counters and histograms for our long-running modes (batch and watch),
+# and serves them over HTTP in the Prometheus text exposition format.
+#
+# Nothing is recorded unless start() has been called, so the cost when metrics
+# are off is a single check per call.
+#
+
+
+import logging
+import threading
+
+
+logger = logging.getLogger()
+
+
+#
+# Are we collecting metrics?
+#
+enabled = False
+
+#
+# Every metric we know about: (type, help text).
+#
+definitions = {
+	"dns_tool_queries_sent_total": ("counter", "DNS queries sent"),
+	"dns_tool_responses_total": ("counter", "DNS responses received, by RCODE"),
+	"dns_tool_timeouts_total": ("counter", "DNS queries which timed out"),
+	"dns_tool_errors_total": ("counter", "DNS queries which failed with a socket error other than a timeout"),
+	"dns_tool_retries_total": ("counter", "DNS queries which were retried"),
+	"dns_tool_backoffs_total": ("counter", "Times we backed off from a server after a timeout, SERVFAIL, or REFUSED"),
+	"dns_tool_parse_errors_total": ("counter", "Responses which could not be parsed"),
+	"dns_tool_sanity_warnings_total": ("counter", "Sanity check warnings, by type"),
+	"dns_tool_cache_hits_total": ("counter", "Cache hits, by cache"),
+	"dns_tool_in_flight_queries": ("gauge", "DNS queries which have been sent and not yet answered"),
+	"dns_tool_rtt_seconds": ("histogram", "Round trip time of DNS queries"),
+	}
+
+#
+# Upper bounds of our histogram buckets, in seconds.
+#
+buckets = [ 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5 ]
+
+#
+# Our values, keyed by (name, labels), where labels is a tuple of (key, value) pairs.
+# Histogram values are a list of bucket counts, followed by the sum and the count.
+#
+values = {}
+lock = threading.Lock()
+
+
+def getKey(name, labels):
+	"""
+	getKey(name, labels): Turn a metric name and dictionary of labels into a key for our values.
+	"""
+	return((name, tuple(sorted(labels.items()))))
+
+
+def increment(name, value = 1, **labels):
+	"""
+	increment(name, value = 1, **labels): Add to a counter or gauge.
+	"""
+
+	if not enabled:
+		return
+
+	key = getKey(name, labels)
+
+	with lock:
+		values[key] = values.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+	"""
+	observe(name, value, **labels): Record a value in a histogram.
+	"""
+
+	if not enabled:
+		return
+
+	key = getKey(name, labels)
+
+	with lock:
+
+		if key not in values:
+			values[key] = [ 0 ] * (len(buckets) + 2)
+
+		histogram = values[key]
+
+		for i in range(len(buckets)):
+			if value <= buckets[i]:
+				histogram[i] += 1
+
+		histogram[-2] += value
+		histogram[-1] += 1
+
+
+def formatLabels(labels, extra = ()):
+	"""
+	formatLabels(labels, extra = ()): Format labels as {key="value",...}
+	"""
+
+	labels = tuple(labels) + tuple(extra)
+	if not labels:
+		return("")
+
+	retval = ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+		for (key, value) in labels)
+
+	return("{" + retval + "}")
+
+
+def render():
+	"""
+	render(): Return all of our metrics in the Prometheus text exposition format.
+	"""
+
+	lines = []
+
+	with lock:
+		snapshot = dict((key, list(value) if isinstance(value, list) else value)
+			for (key, value) in values.items())
+
+	for name in sorted(definitions):
+
+		(metric_type, text) = definitions[name]
+		lines.append("# HELP %s %s" % (name, text))
+		lines.append("# TYPE %s %s" % (name, metric_type))
+
+		for (key, value) in sorted(snapshot.items()):
+
+			if key[0] != name:
+				continue
+
+			labels = key[1]
+
+			if metric_type == "histogram":
+				for i in range(len(buckets)):
+					lines.append("%s_bucket%s %d" % (name, formatLabels(labels, [("le", buckets[i])]), value[i]))
+				lines.append("%s_bucket%s %d" % (name, formatLabels(labels, [("le", "+Inf")]), value[-1]))
+				lines.append("%s_sum%s %f" % (name, formatLabels(labels), value[-2]))
+				lines.append("%s_count%s %d" % (name, formatLabels(labels), value[-1]))
+
+			else:
+				lines.append("%s%s %s" % (name, formatLabels(labels), value))
+
+	return("\n".join(lines) + "\n")
+
+
+def start(address, port):
+	"""
+	start(address, port): Start collecting metrics and serve them over HTTP in a background thread.
+	"""
+
+	global enabled
+
+	enabled = True
+
+	#
+	# http.server takes a while to import, and most runs never serve metrics, so it's imported here.
+	#
+	import http.server
+
+	class MetricsHandler(http.server.BaseHTTPRequestHandler):
+		"""
+		MetricsHandler: Serve our metrics on /metrics
+		"""
+
+		def do_GET(self):
+
+			if self.path != "/metrics":
+				self.send_error(404)
+				return
+
+			body = render().encode("utf-8")
+
+			self.send_response(200)
+			self.send_header("Content-Type", "text/plain; version=0.0.4")
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			logger.debug("Metrics request: " + format, *args)
+
+	server = http.server.ThreadingHTTPServer((address, port), MetricsHandler)
+	thread = threading.Thread(target = server.serve_forever, daemon = True)
+	thread.start()
+
+	logger.info("Serving metrics on http://%s:%d/metrics" % (address, port))
+
+	return(server)
+
+
@@ -0,0 +1,138 @@
+#
+# This module finds the question and records in a packet by their offsets, without
+# decoding them.  canonical, memo, replay, the scheduler, and --fake-ttl all need
+# this, and it only depends on budget and parse_question so that any of them can import it.
+#
+
+
+import struct
+
+from lib import budget
+from lib import parse_question
+
+
+#
+# Our precompiled struct layouts
+#
+short_struct = struct.Struct(">H")
+ttl_struct = struct.Struct(">i")
+
+#
+# The TYPE of the OPT pseudo-record, whose TTL holds the extended RCODE and flags rather than a TTL.
+#
+opt_type = 41
+
+
+def getQuestionLength(data):
+	"""
+	getQuestionLength(data): Return how many bytes the question section takes up.
+	"""
+
+	(num_questions,) = short_struct.unpack_from(data, 4)
+
+	if not num_questions:
+		return(0)
+
+	return(parse_question.getDomainNameLength(12, data) + 4)
+
+
+def getRecords(data, question_length):
+	"""
+	getRecords(data, question_length): Return a list of (start, ttl_index, end) for each record.
+
+	Like parseAnswers(), this keeps going until the end of the packet rather than trusting
+	the counts in the header.  If a record runs past the end of the packet, we stop there.
+	"""
+
+	retval = []
+
+	index = 12 + question_length
+	length = len(data)
+
+	while index < length:
+
+		try:
+			name_length = parse_question.getDomainNameLength(index, data)
+
+		except IndexError:
+			break
+
+		rdlength_index = index + name_length + 8
+
+		if rdlength_index + 2 > length:
+			break
+
+		(rdlength,) = short_struct.unpack_from(data, rdlength_index)
+		end = rdlength_index + 2 + rdlength
+
+		retval.append((index, index + name_length + 4, end))
+		index = end
+
+	return(retval)
+
+
+def setTtls(data, ttl, question_length):
+	"""
+	setTtls(data, ttl, question_length): Overwrite the TTL of every record, and return the new packet.
+
+	This is what --fake-ttl uses.  Only one copy of the packet is made, no matter how many records it has.
+	"""
+
+	retval = bytearray(data)
+
+	for (start, ttl_index, end) in getRecords(retval, question_length):
+		ttl_struct.pack_into(retval, ttl_index, ttl)
+
+	return(bytes(retval))
+
+
+def getPointerTargets(data, index):
+	"""
+	getPointerTargets(data, index): Return the offsets of every pointer followed in the domain-name at index.
+	"""
+
+	retval = []
+
+	while index < len(data):
+
+		length = data[index]
+
+		if length == 0:
+			break
+
+		if length & 0b11000000:
+			if index + 1 >= len(data) or len(retval) >= budget.limits["pointer_hops"]:
+				break
+			index = ((length & 0b00111111) << 8) | data[index + 1]
+			retval.append(index)
+			continue
+
+		index += 1 + length
+
+	return(retval)
+
+
+def getQuestion(message):
+	"""
+	getQuestion(message): Return the question section of a message, with the name in lowercase,
+		so that a response can be matched with the query it's for.
+
+	None is returned if the message has no question, or it can't be read.
+	"""
+
+	budget.start()
+
+	try:
+		length = getQuestionLength(message)
+
+	except (IndexError, struct.error, budget.BudgetExceeded):
+		return(None)
+
+	if not length:
+		return(None)
+
+	section = message[12:12 + length]
+
+	return(section[:-4].lower() + section[-4:])
+
+
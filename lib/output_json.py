@@ -0,0 +1,112 @@
+#
+# This module holds our JSON encoders.
+#
+# The stdlib encoder is always available, and its output is byte-for-byte what
+# json.dumps(..., sort_keys = True) gives us, so hashes of our output stay the same.
+# If orjson is installed, it can be used instead for speed.  Keys are still sorted
+# the same way, but orjson doesn't put spaces after separators, and writes
+# non-ASCII characters as UTF-8 rather than escaping them.
+#
+
+
+import json
+import logging
+
+
+#
+# orjson is only imported if it's asked for (or "auto" picks it), so that
+# the stdlib backend doesn't pay for loading it.
+#
+orjson = None
+orjson_tried = False
+
+
+logger = logging.getLogger()
+
+
+#
+# Creating an encoder is a good part of the cost of json.dumps() on small objects,
+# so we create ours once and reuse them.
+#
+stdlib_encoder = json.JSONEncoder(sort_keys = True, check_circular = False)
+stdlib_encoder_pretty = json.JSONEncoder(indent = 2, sort_keys = True, check_circular = False)
+
+
+def encodeStdlib(data):
+	"""
+	encodeStdlib(data): Encode data as a single line of JSON with the stdlib encoder
+	"""
+	return(stdlib_encoder.encode(data))
+
+
+def encodeStdlibPretty(data):
+	"""
+	encodeStdlibPretty(data): Encode data as pretty-printed JSON with the stdlib encoder
+	"""
+	return(stdlib_encoder_pretty.encode(data))
+
+
+def encodeOrjson(data):
+	"""
+	encodeOrjson(data): Encode data as a single line of JSON with orjson
+	"""
+	return(orjson.dumps(data, option = orjson.OPT_SORT_KEYS).decode("utf-8"))
+
+
+def encodeOrjsonPretty(data):
+	"""
+	encodeOrjsonPretty(data): Encode data as pretty-printed JSON with orjson
+	"""
+	return(orjson.dumps(data, option = orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2).decode("utf-8"))
+
+
+#
+# A lookup table of our backends.  Each one has an encoder for single lines and
+# an encoder for pretty-printing.
+#
+backends = {
+	"stdlib": (encodeStdlib, encodeStdlibPretty),
+	"orjson": (encodeOrjson, encodeOrjsonPretty),
+	}
+
+
+def loadOrjson():
+	"""
+	loadOrjson(): Import orjson the first time we're called.  Returns None if it isn't installed.
+	"""
+
+	global orjson
+	global orjson_tried
+
+	if not orjson_tried:
+		orjson_tried = True
+		try:
+			import orjson
+		except ImportError:
+			pass
+
+	return(orjson)
+
+
+def getBackend(name):
+	"""
+	getBackend(name): Return a tuple of (encoder, pretty_encoder) for the named backend.
+
+	"auto" returns the fastest backend that is installed.
+	"""
+
+	if name in ("auto", "orjson"):
+		loadOrjson()
+
+	if name == "auto":
+		name = "orjson" if orjson else "stdlib"
+
+	if name not in backends:
+		raise Exception("Unknown JSON backend: %s" % name)
+
+	if name == "orjson" and not orjson:
+		raise Exception("JSON backend 'orjson' was requested, but orjson is not installed")
+
+	return(backends[name])
+
+
@@ -0,0 +1,341 @@
+#
+# This module holds our code for printing out our responses as text and graphs.
+#
+# It is only imported when --text or --graph is used, so that JSON output
+# doesn't pay for loading it.
+#
+
+
+import logging
+
+from lib import output
+from lib import output_json
+
+
+logger = logging.getLogger()
+
+#
+# Precompiled templates for our text and graph output.
+#
+graph_ruler = (
+	"                                1  1  1  1  1  1\n"
+	"     0  1  2  3  4  5  6  7  8  9  0  1  2  3  4  5\n"
+	)
+graph_border = "   +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+\n"
+graph_border_wide = "   +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+------------+\n"
+
+question_text_template = (
+	"\n"
+	"   Question: %s (len: %s)\n"
+	"   Type:     %d (%s)\n"
+	"   Class:    %d (%s)\n"
+	"   Server:   %s\n"
+	)
+question_graph_name_template = "\n" + graph_ruler + graph_border_wide + "   |  QNAME: %-40s        |\n"
+question_graph_row_template = "   |    len: %2d value: %-37s |\n"
+question_graph_type_template = (graph_border_wide
+	+ "   |  QTYPE:  %3d - %-37s    |\n"
+	+ graph_border_wide
+	+ "   | QCLASS: %3d - %-38s    |\n"
+	+ graph_border_wide
+	)
+
+header_text_template = (
+	"\n"
+	"   Request ID:         %s\n"
+	"   Questions:          %d\n"
+	"   Answers:            %d\n"
+	"   Authority records:  %d\n"
+	"   Additional records: %d\n"
+	"   QR:      %s\n"
+	"   AA:      %s\n"
+	"   TC:      %s\n"
+	"   RD:      %s\n"
+	"   RA:      %s\n"
+	"   OPCODE:  %d - %s\n"
+	"   RCODE:   %d - %s\n"
+	)
+header_graph_template = ("\n" + graph_ruler + graph_border
+	+ "   |             Request ID: %s                  |\n"
+	+ graph_border
+	+ "   |%s| Opcode: %d |%s|%s|%s|%s|  Z: %d  | RCODE: %d  |\n"
+	+ graph_border
+	+ "   |          Question Count: %d                    |\n"
+	+ graph_border
+	+ "   |          Answer Count: %d                      |\n"
+	+ graph_border
+	+ "   |          Authority/Nameserver Count: %d        |\n"
+	+ graph_border
+	+ "   |          Additional Records Count: %d          |\n"
+	+ graph_border
+	)
+header_warning_template = "   WARNING: %s\n"
+
+answer_text_template = (
+	"   Answer #%d:   %s\n"
+	"   CLASS:       %s (%s)\n"
+	"   TYPE:        %s (%s)\n"
+	"   TTL:         %s (%s)\n"
+	)
+answer_text_pointer_template = "      Pointer to offset %d, points to '%s'\n"
+answer_text_rddata_template = (
+	"   Raw RRDATA:  %s (len %s)\n"
+	"   Full RRDATA: %s\n"
+	)
+answer_text_warning_template = "   WARNING:     %s\n"
+
+chain_hop_template = "   %s -> %s (TTL: %s, from %s)\n"
+chain_text_template = (
+	"   Final name:  %s\n"
+	"   Records:     %s\n"
+	"   Status:      %s (%d more queries)\n"
+	)
+
+answer_graph_name_template = graph_ruler + graph_border_wide + "   |  NAME     : %-40s    |\n"
+answer_graph_len_template = "   |        len: %3d  value: %-30s  |\n"
+answer_graph_pointer_template = "   |    pointer: %3d target: %-30s  |\n"
+answer_graph_headers_template = (graph_border_wide
+	+ "   |  TYPE:  %3d - %-38s    |\n"
+	+ graph_border_wide
+	+ "   | CLASS: %3d - %-39s    |\n"
+	+ graph_border_wide
+	+ "   |   TTL: %10d - %-33s   |\n"
+	+ graph_border_wide
+	+ "   |   RDLENGTH: %3d                                         |\n"
+	+ graph_border_wide
+	+ "   |     RDDATA: %-40s    |\n"
+	)
+
+
+def printResponseText(args, response):
+	"""
+	printResponseText(response): Print up our response as text.
+	"""
+
+	if args.text or args.graph:
+
+		sanity = response["sanity"]
+
+		question = response["question"]
+
+		buf = output.pending
+
+		printQuestion(args, question, response, buf)
+	
+		buf.append("\n")
+
+		printHeader(args, response["header"], sanity["header"], buf)
+	
+		buf.append("\n")
+
+		printAnswers(args, response["answers"], sanity["answers"], buf)
+
+		buf.append("\n")
+
+		if args.text and "cname_chain" in response:
+			printChain(response["cname_chain"], buf)
+			buf.append("\n")
+
+
+def printQuestion(args, question, response, buf):
+	"""
+	printQuestion(args, question, response, buf): Render our text and/or graph of our quesiton into buf.
+	"""
+
+	buf.append("Question\n========\n")
+
+	if args.text:
+		buf.append(question_text_template % (
+			question["question"], question["question_length"],
+			question["qtype"], question["qtype_text"],
+			question["qclass"], question["qclass_text"],
+			response["server"]))
+
+	if args.graph:
+		buf.append(question_graph_name_template % question["question"])
+		for row in question["meta"]["data_decoded"]:
+			length = row["length"]
+			string = "(nil)"
+			if length:
+				string = row["string"]
+			buf.append(question_graph_row_template % (row["length"], string))
+
+		buf.append(question_graph_type_template % (
+			question["qtype"], question["qtype_text"],
+			question["qclass"], question["qclass_text"]))
+
+
+def printHeader(args, header, sanity, buf):
+	"""
+	printHeader(args, header, sanity, buf): Render our headers into buf
+	"""
+
+	text = header["header_text"]
+	flags = header["header"]
+
+	buf.append("Header\n======\n")
+
+	if args.text:
+		buf.append(header_text_template % (
+			header["request_id"],
+			int(header["num_questions"]),
+			int(header["num_answers"]),
+			int(header["num_authority_records"]),
+			int(header["num_additional_records"]),
+			text["qr"], text["aa"], text["tc"], text["rd"], text["ra"],
+			flags["opcode"], text["opcode_text"],
+			flags["rcode"], text["rcode_text"],
+			))
+
+	#
+	# Print a graph right out of RFC 1035, section 4.1.1
+	#
+	if args.graph:
+		buf.append(header_graph_template % (
+			header["request_id"],
+			"QR" if flags["qr"] else "  ",
+			flags["opcode"],
+			"AA" if flags["aa"] else "  ",
+			"TC" if flags["tc"] else "  ",
+			"RD" if flags["rd"] else "  ",
+			"RA" if flags["ra"] else "  ",
+			flags["z"],
+			flags["rcode"],
+			int(header["num_questions"]),
+			int(header["num_answers"]),
+			int(header["num_authority_records"]),
+			int(header["num_additional_records"]),
+			))
+
+	for warning in sanity:
+		buf.append(header_warning_template % warning)
+
+
+def printAnswers(args, answers, sanity, buf):
+	"""
+	printAnswers(args, answers, sanity, buf): Render each of our answers into buf
+	"""
+
+	buf.append("Answers\n=======\n")
+
+	index = 0
+	for answer in answers:
+
+		headers = answer["headers"]
+		meta = {}
+		if "meta" in answer["rddata"]:
+			meta = answer["rddata"]["meta"]
+		sanity_answer = sanity[index]
+
+		if args.text:
+			buf.append("\n")
+			printAnswerText(answer, index, headers, meta, sanity_answer, buf)
+
+		if args.graph:
+			buf.append("\n")
+			printAnswerGraph(answer, headers, meta, buf)
+
+		index += 1
+
+
+def printChain(chain, buf):
+	"""
+	printChain(chain, buf): Render the CNAME chain we followed into buf
+	"""
+
+	buf.append("CNAME Chain\n===========\n\n")
+
+	for hop in chain["hops"]:
+		buf.append(chain_hop_template % (hop["name"], hop["target"], hop["ttl"], hop["source"]))
+
+	buf.append(chain_text_template % (chain["final_name"], ", ".join(chain["answers"]) or "(none)",
+		chain["status"], chain["queries"]))
+
+
+def printAnswerText(answer, index, headers, meta, sanity_answer, buf):
+	"""
+	printAnswerText(answer, index, headers, meta, sanity_answer, buf): Render text of our answer into buf
+	"""
+
+	buf.append(answer_text_template % (
+		index, answer["rddata_text"],
+		headers["class"], headers["class_text"],
+		headers["type"], headers["type_text"],
+		headers["ttl"], headers["ttl_text"]))
+
+	if "pointers" in meta and len(meta["pointers"]):
+		buf.append("   Pointers:\n")
+		for pointer in meta["pointers"]:
+			buf.append(answer_text_pointer_template % (pointer["pointer"], pointer["target"]))
+
+	buf.append(answer_text_rddata_template % (
+		answer["rddata_hex"], headers["rdlength"],
+		output_json.encodeStdlib(answer["rddata"])))
+
+	for warning in sanity_answer:
+		buf.append(answer_text_warning_template % warning)
+
+
+def printDomainNameGraph(rows, buf, unknown_template):
+	"""
+	printDomainNameGraph(rows, buf, unknown_template): Render the decoded labels and pointers of a domain-name into buf
+	"""
+
+	for row in rows:
+
+		if "length" in row:
+
+			key = row["length"]
+			value = "(nil)"
+			if row["length"]:
+				value = row["string"]
+			buf.append(answer_graph_len_template % (key, value))
+
+		elif "pointer" in row:
+			buf.append(answer_graph_pointer_template % (row["pointer"], row["target"]))
+
+		else:
+
+			buf.append(unknown_template % (row,))
+
+
+def printAnswerGraph(answer, headers, meta, buf):
+	"""
+	printAnswerGraph(answer, headers, meta, buf): Render a graph of our answer into buf
+	"""
+
+	rddata = answer["rddata"]
+
+	buf.append(answer_graph_name_template % (rddata["question_text"]))
+	printDomainNameGraph(rddata["question_meta"]["data_decoded"], buf, "   |    UNKNOWN: %25s |\n")
+
+	#
+	# If the header was set to a negative very (or a very high positive value!)
+	# for debugging, ensure the number is negative and the text indicates that
+	# debugging is happening.
+	#
+	# headers may be shared with our memo and other responses, so it must not be changed.
+	#
+	ttl = headers["ttl"]
+	ttl_text = headers["ttl_text"]
+
+	if ttl >= 4294967293:
+		logger.debug("TTL is over 2**32-3, so subtract 2**32")
+		ttl -= pow(2,32)
+
+	if ttl < 0:
+		ttl_text = "DEBUGGING"
+
+	buf.append(answer_graph_headers_template % (
+		headers["type"], headers["type_text"],
+		headers["class"], headers["class_text"],
+		ttl, ttl_text,
+		headers["rdlength"],
+		answer["rddata_text"]))
+
+	if "meta" in rddata:
+		printDomainNameGraph(rddata["meta"]["data_decoded"], buf, "   |    UNKNOWN: %35s |\n")
+
+	buf.append(graph_border_wide)
+
+
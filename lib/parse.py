@@ -8,15 +8,32 @@ import logging
 import struct
 
 import lib.parse_answer
+from lib import projection
+from lib import trace
 
 logger = logging.getLogger()
 
 
+#
+# Text descriptions we've already created, keyed by the header fields they describe.
+# There are only a handful of combinations seen in practice, so every message with
+# the same flags shares the same dictionary.
+#
+header_texts = {}
+header_texts_max = 1000
+
+
 def parseHeaderText(header):
 	"""
 	parseHeaderText(): Go through our parsed headers, and create text descriptions based on them.
+
+	The dictionary that is returned is shared, and must not be changed.
 	"""
 
+	key = (header["qr"], header["opcode"], header["aa"], header["tc"], header["rd"], header["ra"], header["rcode"])
+	if key in header_texts:
+		return(header_texts[key])
+
 	retval = {}
 
 	if header["qr"] == 0:
@@ -78,6 +95,11 @@ def parseHeaderText(header):
 	else:
 		retval["rcode_text"] = "Error code %s" % header["rcode"]
 
+	if len(header_texts) >= header_texts_max:
+		del header_texts[next(iter(header_texts))]
+
+	header_texts[key] = retval
+
 	return(retval)
 
 
@@ -89,9 +111,11 @@ def getRequestId(data):
 	return(retval)
 
 
-def parseHeader(data):
+def parseHeader(data, fields = None):
 	"""
-	parseHeader(): Extracts the various fields of our header
+	parseHeader(data, fields = None): Extracts the various fields of our header
+
+	If fields is specified, text descriptions are only created if they were asked for.
 	
 	Returns a dictionary.
 	"""
@@ -114,7 +138,8 @@ def parseHeader(data):
 	# 12-15 - RCODE: Result Code.  0 for no errors.
 	#
 	header = data[2:4]
-	logger.debug("Header Flags: %s: %s %s" % (binascii.hexlify(header), data[2], data[3]))
+	if trace.active:
+		trace.event("header", "Header Flags: %(flags)04x", flags = (data[2] << 8) | data[3])
 
 	retval["header"] = {}
 	
@@ -130,7 +155,8 @@ def parseHeader(data):
 	#
 	# Create text versions of our header fields
 	#
-	retval["header_text"] = parseHeaderText(retval["header"])
+	if projection.wants(fields, "header.header_text"):
+		retval["header_text"] = parseHeaderText(retval["header"])
 
 	retval["num_questions"] = struct.unpack(">H", data[4:6])[0]
 	retval["num_answers"] = struct.unpack(">H", data[6:8])[0]
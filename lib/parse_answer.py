@@ -1,18 +1,27 @@
 
 
-import datetime
 import logging
 import struct
 
-import humanize
-
+from lib import budget
+from lib import interning
+from lib import offsets
 from lib import output
 from lib import parse_answer_body
 from lib import parse_question
+from lib import projection
+from lib import trace
 
 
 logger = logging.getLogger()
 
+#
+# humanize (and datetime) are only used for ttl_text, and take a while to import,
+# so getTtlText() imports them the first time it is called.
+#
+humanize = None
+datetime = None
+
 
 def parseAnswerHeaders(args, data):
 	"""
@@ -32,14 +41,6 @@ def parseAnswerHeaders(args, data):
 	# 12+: RDDATA (The answer!)
 	#
 
-	#
-	# Set our offsets for the different parts of the Answer Header.
-	#
-	offset_type = 2
-	offset_class = 4
-	offset_ttl = 6
-	offset_rdlength = 10
-
 	#
 	# This is going to be the angriest comment of my entire career.
 	# Remember the part above where I saw the first two bytes are the offset
@@ -54,17 +55,24 @@ def parseAnswerHeaders(args, data):
 	# 
 	# /rant
 	#
-	if data[0] == 0:
-		offset_type -= 1
-		offset_class -= 1
-		offset_ttl -= 1
-		offset_rdlength -= 1
+	# And it gets better: in a zone transfer, the name can be a full domain-name,
+	# or some labels followed by a pointer.  So measure the name, and set our offsets
+	# for the different parts of the Answer Header from there.
+	#
+	name_length = parse_question.getDomainNameLength(0, data)
+	offset_type = name_length
+	offset_class = name_length + 2
+	offset_ttl = name_length + 4
+	offset_rdlength = name_length + 8
 
 	retval["type"] = (256 * data[offset_type]) + data[offset_type + 1]
 	retval["class"] = (256 * data[offset_class]) + data[offset_class + 1]
 
-	retval["type_text"] = parse_question.parseQtype(retval["type"])
-	retval["class_text"] = parse_question.parseQclass(retval["class"])
+	if projection.wants(args.fields, "answers.headers.type_text"):
+		retval["type_text"] = parse_question.parseQtype(retval["type"])
+
+	if projection.wants(args.fields, "answers.headers.class_text"):
+		retval["class_text"] = parse_question.parseQclass(retval["class"])
 
 	#data = data[0:6] + struct.pack("B", 48) + data[7:] # Debugging - Make the TTL 25+ years
 	if args.fake_ttl:
@@ -74,62 +82,42 @@ def parseAnswerHeaders(args, data):
 	else:
 		retval["ttl"] = ( 16777216 * data[offset_ttl] ) + ( 65536 * data[offset_ttl + 1] ) + ( 256 * data[offset_ttl + 2] ) + data[offset_ttl + 3] 
 
-	retval["ttl_text"] = humanize.naturaltime(datetime.datetime.now() + datetime.timedelta(seconds = retval["ttl"]))
+	#
+	# Humanizing the TTL is one of the most expensive things we do per record, so skip it if we can.
+	#
+	if projection.wants(args.fields, "answers.headers.ttl_text"):
+		retval["ttl_text"] = getTtlText(retval["ttl"])
+
 	retval["rdlength"] = (256 * data[offset_rdlength]) + data[offset_rdlength + 1]
 
 	return(retval)
 
 
-def parseAnswersFakeTtl(args, data, question_length):
+def getTtlText(ttl):
 	"""
-	parseAnswersFakeTtl(args, data, question_length): A clone of parseAnswers, but all this function does
-		is set the TTL to 0xdeadbeef in answers and returned the altered message.  
-		This is used when --fake-ttl is specified with --raw, and is useful for testing purposes.
+	getTtlText(ttl): Return a human-readable version of a TTL, such as "an hour from now"
 	"""
 
-	#
-	# Skip the headers and question
-	#
-	index = 12 + question_length
-	logger.debug("question_length=%d total_length=%d" % (question_length, len(data)))
+	global humanize
+	global datetime
 
-	if index >= len(data):
-		logger.debug("parseAnswer(): index %d >= data length(%d), so no answers were received. Aborting." % (
-			index, len(data)))
-		return(data)
+	if humanize is None:
+		import datetime
+		import humanize
 
-	#
-	# Now loop through our answers.
-	#
-	while True:
+	return(interning.internString(humanize.naturaltime(datetime.datetime.now() + datetime.timedelta(seconds = ttl))))
 
-		answer = {}
-		logger.debug("parseAnswersFakeTtl(): Index is currently %d" % index)
-	
-		#
-		# If we're doing a fake TTL, we also have to fudge the response header and overwrite
-		# the original TTL.  In this case, we're doing to overwrite it with -3 (4294967293).
-		# That is a number (hopefully) unlikely to occur in nature.
-		#
-		ttl_index = index + 6
-		logger.debug("parseAnswersFakeTtl(): --fake-ttl set, forcing TTL to be -3")
-		data = data[0:ttl_index] + struct.pack(">i", -3) + data[ttl_index + 4:]
 
-		#
-		# Advance our index to the start of the next answer
-		#
-		index_old = index
-		answer["headers"] = parseAnswerHeaders(args, data[index:])
-		index = index + 12 + answer["headers"]["rdlength"]
+def parseAnswersFakeTtl(args, data, question_length):
+	"""
+	parseAnswersFakeTtl(args, data, question_length): Set the TTL to -3 (4294967293) in every answer
+		and return the altered message.
+		This is used when --fake-ttl is specified with --raw, and is useful for testing purposes.
+	"""
 
-		#
-		# If we've run off the end of the packet, then break out of this loop
-		#
-		if index >= len(data):
-			logger.debug("parseAnswer(): index %d >= data length (%d), stopping loop!" % (index, len(data)))
-			break
+	logger.debug("parseAnswersFakeTtl(): --fake-ttl set, forcing TTLs to be -3")
 
-	return(data)
+	return(offsets.setTtls(data, -3, question_length))
 
 
 def parseAnswers(args, data, question_length = 0):
@@ -139,43 +127,42 @@ def parseAnswers(args, data, question_length = 0):
 
 	retval = []
 
+	want_hex = projection.wants(args.fields, "answers.rddata_hex")
+
 	#
 	# Skip the headers and question
 	#
 	index = 12 + question_length
-	logger.debug("question_length=%d total_length=%d" % (question_length, len(data)))
+	if trace.active:
+		trace.event("answers", "parseAnswers(): question_length=%(question_length)d total_length=%(length)d",
+			question_length = question_length, length = len(data))
 
 	if index >= len(data):
-		logger.debug("parseAnswers(): index %d >= data length(%d), so no answers were received. Aborting." % (
-			index, len(data)))
+		if trace.active:
+			trace.event("no_answers", "parseAnswers(): index %(index)d >= data length (%(length)d), so no answers were received. Aborting.",
+				index = index, length = len(data))
 		return(retval)
 
+	#
+	# If we're doing a fake TTL, we also have to fudge the raw answers and overwrite
+	# the original TTLs.  In this case, we're going to overwrite them with -2, so that
+	# it will be obvious upon inspection that they were human-made.
+	#
+	if args.fake_ttl:
+		logger.debug("parseAnswers(): --fake-ttl specified, forcing TTLs to be -2")
+		data = offsets.setTtls(data, -2, question_length)
+
 	#
 	# Now loop through our answers.
 	#
 	while True:
 
 		answer = {}
-		logger.debug("parseAnswers(): Index is currently %d" % index)
+
+		budget.checkRecords(len(retval) + 1)
+		budget.spend()
 	
-		#
-		# If we're doing a fake TTL, we also have to fudge the response header and overwrite
-		# the original TTL.  In this case, we're doing to overwrite it with the 4 byte string
-		# of 0xDEADBEEF, so that it will be obvious upon inspection that this string was human-made.
-		#
-		if args.fake_ttl:
-			ttl_index = index + 6
-			#
-			# If the leading byte of the Answer Headers is zero (the question), then
-			# the question was for a bad TLD, and the "pointer" is really just a single
-			# byte, so go forward one byte less.
-			#
-			if data[index] == 0:
-				ttl_index -= 1
-			data_new = bytes()
-			logger.debug("parseAnswers(): --fake-ttl specified, forcing TTL to be -2")
-			data_new = data[0:ttl_index] + struct.pack(">i", -2) + data[ttl_index + 4:]
-			data = data_new
+		name_length = parse_question.getDomainNameLength(index, data)
 
 		answer["headers"] = parseAnswerHeaders(args, data[index:])
 
@@ -184,11 +171,17 @@ def parseAnswers(args, data, question_length = 0):
 		# answer into answer["rddata_raw"]
 		#
 		index_old = index
-		index_next = index + 12 + answer["headers"]["rdlength"]
+		answer["rdata_offset"] = name_length + 10
+		index_next = index + answer["rdata_offset"] + answer["headers"]["rdlength"]
 		answer["rddata_raw"] = data[index:index_next]
 
+		if trace.active:
+			trace.event("record", "parseAnswers(): Record at %(index)d, type %(type)d, rdlength %(rdlength)d",
+				index = index, name_length = name_length, type = answer["headers"]["type"], rdlength = answer["headers"]["rdlength"])
+
 		(answer["rddata"], answer["rddata_text"]) = parse_answer_body.parseAnswerBody(answer, index, data)
 		index = index_next
+		del answer["rdata_offset"]
 
 		#
 		# This is a bit of hack, but we want to grab the sanity data from the rddata 
@@ -203,10 +196,9 @@ def parseAnswers(args, data, question_length = 0):
 		#
 		# Deleting the raw data because it will choke when convered to JSON
 		#
-		answer["rddata_hex"] = {}
-		if "rddata_hex" in answer:
+		if want_hex:
 			answer["rddata_hex"] = output.formatHex(answer["rddata_raw"])
-			del answer["rddata_raw"]
+		del answer["rddata_raw"]
 
 		retval.append(answer)
 
@@ -214,7 +206,6 @@ def parseAnswers(args, data, question_length = 0):
 		# If we've run off the end of the packet, then break out of this loop
 		#
 		if index >= len(data):
-			logger.debug("parseAnswer(): index %d >= data length (%d), stopping loop!" % (index, len(data)))
 			break
 
 	return(retval)
@@ -3,12 +3,28 @@
 #
 
 
-import struct
+import base64
 import logging
+import socket
+import struct
 logger = logging
 
+from lib import budget
 from lib import output
 from lib import parse_question
+from lib import trace
+
+
+#
+# Our precompiled struct layouts
+#
+short_struct = struct.Struct(">H")
+soa_struct = struct.Struct(">LLLLL")
+srv_struct = struct.Struct(">HHH")
+ds_struct = struct.Struct(">HBB")
+dnskey_struct = struct.Struct(">HBB")
+rrsig_struct = struct.Struct(">HBBLLLH")
+option_struct = struct.Struct(">HH")
 
 
 def parseAnswerBody(answer, index, data):
@@ -18,53 +34,21 @@ def parseAnswerBody(answer, index, data):
 	answer - The data that corresponds to the specific answer
 	index - Offset of where we are in the DNS response
 	data - The data for the entire answer packet, which is used if there is compression/pointers
+
+	The parser for each TYPE is looked up in our decoders table, and is given the RDATA,
+	the offset of the RDATA in the DNS response, and the entire response.
 	"""
 
-	retval = {}
-	retval_text = ""
-
-	if answer["headers"]["type"] == 1:
-		(retval, retval_text) = parseAnswerA(answer["rddata_raw"][12:], index, data)
-
-	elif answer["headers"]["type"] == 2:
-		#
-		# SOA - RFC 1035 3.3.11
-		#
-		(retval, retval_text) = parseAnswerNs(answer["rddata_raw"][12:], index, data)
-
-	elif answer["headers"]["type"] == 5:
-		#
-		# SOA - RFC 1035 3.3.1
-		#
-		(retval, retval_text) = parseAnswerCname(answer["rddata_raw"][12:], index, data)
-
-	elif answer["headers"]["type"] == 6:
-		#
-		# SOA - RFC 1035 3.3.13
-		#
-		(retval, retval_text) = parseAnswerSoa(answer["rddata_raw"][12:], index, data)
-
-	elif answer["headers"]["type"] == 15:
-		#
-		# MX - RFC 1035 3.3.9
-		#
-		(retval, retval_text) = parseAnswerMx(answer["rddata_raw"][12:], index, data)
-
-	elif answer["headers"]["type"] == 16:
-		#
-		# MX - RFC 1035 3.3.14
-		#
-		(retval, retval_text) = parseAnswerTxt(answer["rddata_raw"][12:], index, data)
-
-	elif answer["headers"]["type"] == 28:
-		#
-		# AAAA - RFC 3596 2.2
-		#
-		(retval, retval_text) = parseAnswerAAAA(answer["rddata_raw"][12:], index, data)
-
-	else:
-		retval["sanity"] = []
-		logger.warn("Unknown answer QTYPE: %s" % answer["headers"]["type"])
+	rdata_index = index + answer["rdata_offset"]
+	rdata = answer["rddata_raw"][answer["rdata_offset"]:]
+
+	decoder = decoders.get(answer["headers"]["type"], parseAnswerUnknown)
+	if decoder is parseAnswerUnknown:
+		logger.debug("No decoder for TYPE %d at %d, using the generic format", answer["headers"]["type"], rdata_index)
+	if trace.active:
+		trace.event("rdata", "parseAnswerBody(): Decoding RDATA at %(index)d with %(decoder)s()",
+			index = rdata_index, decoder = decoder.__name__)
+	(retval, retval_text) = decoder(rdata, rdata_index, data)
 
 	#
 	# Extract the domain name of the question that this answer points to.
@@ -75,6 +59,34 @@ def parseAnswerBody(answer, index, data):
 	return(retval, retval_text)
 
 
+def registerDecoder(rr_type, decoder):
+	"""
+	registerDecoder(rr_type, decoder): Add (or replace) the parser for a TYPE.
+
+	decoder - A function which takes (answer, index, data) and returns a tuple of (dictionary, text),
+		like the parsers below.  The dictionary must contain a "sanity" list.
+	"""
+
+	decoders[rr_type] = decoder
+
+
+def parseAnswerUnknown(answer, index, data):
+	"""
+	parseAnswerUnknown(answer, index, data): Handle a TYPE we don't have a parser for.
+
+	The text is in the generic format from RFC 3597 section 5.  parseAnswerBody() logs
+	each of these at debug level.
+	"""
+
+	retval = {}
+	retval["data"] = answer.hex()
+	retval["sanity"] = []
+
+	text = "\\# %d %s" % (len(answer), output.formatHex(answer, delimiter = ""))
+
+	return(retval, text)
+
+
 def parseAnswerA(answer, index, data):
 	"""
 	parseAnswerA(data): Grab our IP address from an answer to an A query
@@ -82,8 +94,7 @@ def parseAnswerA(answer, index, data):
 
 	retval = {}
 
-	text = (str(answer[0]) + "." + str(answer[1]) 
-		+ "." + str(answer[2]) + "." + str(answer[3]))
+	text = socket.inet_ntop(socket.AF_INET, answer[0:4])
 
 	retval["ip"] = text
 	#
@@ -101,7 +112,11 @@ def parseAnswerAAAA(answer, index, data):
 
 	retval = {}
 
-	text = output.formatHex(answer, delimiter = ":", group_size = 4)
+	#
+	# Every group is written out in full, rather than in the shortened form
+	# that inet_ntop() would give us.
+	#
+	text = answer[0:16].hex(":", 2)
 
 	retval["ip"] = text
 	retval["sanity"] = []
@@ -120,7 +135,6 @@ def parseAnswerNs(answer, index, data):
 
 	retval = {}
 
-	index += 12
 	(text, retval["sanity"], retval["meta"]) = parse_question.extractDomainName(index, data)
 
 	return(retval, text)
@@ -136,7 +150,24 @@ def parseAnswerCname(answer, index, data):
 
 	retval = {}
 
-	index += 12
+	(text, retval["sanity"], retval["meta"]) = parse_question.extractDomainName(index, data)
+
+	retval["text"] = text
+
+	return(retval, text)
+
+
+def parseAnswerPtr(answer, index, data):
+	"""
+	parseAnswerPtr(answer, data): Parse a PTR answer.
+	
+	answer - The answer body (no headers)
+	data - The entire response packet
+	
+	"""
+
+	retval = {}
+
 	(text, retval["sanity"], retval["meta"]) = parse_question.extractDomainName(index, data)
 
 	retval["text"] = text
@@ -146,24 +177,33 @@ def parseAnswerCname(answer, index, data):
 
 def parseAnswerTxt(answer, index, data):
 	"""
-	parseAnswerCname(answer, data): Parse a Cname answer.
+	parseAnswerTxt(answer, data): Parse a TXT answer.
 	
 	answer - The answer body (no headers)
 	data - The entire response packet
+
+	The RDATA is one or more character-strings, each of which is a length byte
+	followed by that many bytes.  Long records (such as SPF) are split across
+	several strings, which are meant to be joined back together.
 	
 	"""
 
 	retval = {}
 	retval["sanity"] = []
+	retval["strings"] = []
 
-	#
-	# First byte is the character count, but we already have the exact answer
-	# thanks to rdlength, so we can skip that.
-	#
-	answer = answer[1:]
+	i = 0
+	while i < len(answer):
+		budget.spend()
+		length = answer[i]
+		retval["strings"].append(answer[i + 1:i + 1 + length].decode("utf-8", errors = "replace"))
+		i += 1 + length
+
+	if i > len(answer):
+		retval["sanity"].append("TXT character-string runs past the end of RDATA")
 
-	text = answer
-	retval["text"] = answer
+	text = "".join(retval["strings"])
+	retval["text"] = text
 
 	return(retval, text)
 
@@ -179,10 +219,9 @@ def parseAnswerMx(answer, index, data):
 
 	retval = {}
 
-	preference = struct.unpack(">H", answer[0:2])[0]
-	answer = answer[2:]
+	preference = short_struct.unpack_from(answer)[0]
 
-	index += 12 + 2
+	index += 2
 	(exchange, retval["sanity"], retval["meta"]) = parse_question.extractDomainName(index, data)
 
 	retval["preference"] = preference
@@ -198,26 +237,20 @@ def parseAnswerSoa(answer, index, data):
 	parseAnswerSoa(answer, index, data): Parse an SOA answer. This usually happens when no record is found.
 	
 	answer - A string containing just the answer
-	index - Offset of where we are within the DNS response
+	index - Offset of the answer within the DNS response
 	data - The entire packet
 	"""
 
 	retval = {}
 
 	#
-	# Skip the header
-	#
-	# Note that if the leading byte is a zero, this is probably a SOA for a non-existant
-	# TLD, in which the question "pointer" really isn't a two byte pointer at all, but
-	# is instead a single byte, so I gotta plan accordingly.
+	# The mname can be compressed too, in which case we pick up right after its
+	# first pointer.  (See the explanation for the rname below)
 	#
-	if data[index] == 0:
-		index += 11
-	else:
-		index += 12
-
 	(mname, sanity_mname, meta_mname) = parse_question.extractDomainName(index, data)
 	index += len(mname) + 2
+	if "index_after_first_pointer" in meta_mname:
+		index = meta_mname["index_after_first_pointer"]
 
 	#
 	# Pull out the domain-name of the mailbox of the person resonsible.
@@ -241,7 +274,7 @@ def parseAnswerSoa(answer, index, data):
 
 	#
 	# In this case, we're dropping the contents of meta_mname because
-	# it should never have a pointer in it.
+	# its pointers (if any) are rarely interesting.
 	#
 	retval["meta"] = meta_rname
 	retval["sanity"] = sanity_mname + sanity_rname
@@ -249,13 +282,8 @@ def parseAnswerSoa(answer, index, data):
 	#
 	# Now point to the start of our serial number and go from there.
 	#
-	serial = data[index:]
-
-	retval["serial"] = struct.unpack(">L", serial[0:4])[0]
-	retval["refresh"] = struct.unpack(">L", serial[4:8])[0]
-	retval["retry"] = struct.unpack(">L", serial[8:12])[0]
-	retval["expire"] = struct.unpack(">L", serial[12:16])[0]
-	retval["minimum"] = struct.unpack(">L", serial[16:20])[0]
+	(retval["serial"], retval["refresh"], retval["retry"], retval["expire"],
+		retval["minimum"]) = soa_struct.unpack_from(data, index)
 
 	text = "%s %s %d %d %d %d %d" % (mname, rname,
 		retval["serial"], retval["refresh"], retval["retry"], retval["expire"], 
@@ -263,3 +291,150 @@ def parseAnswerSoa(answer, index, data):
 
 	return(retval, text)
 
+
+def parseAnswerSrv(answer, index, data):
+	"""
+	parseAnswerSrv(answer, index, data): Parse an SRV answer (RFC 2782).
+	"""
+
+	retval = {}
+
+	(retval["priority"], retval["weight"], retval["port"]) = srv_struct.unpack_from(answer)
+
+	(target, retval["sanity"], retval["meta"]) = parse_question.extractDomainName(index + 6, data)
+	retval["target"] = target
+
+	text = "%d %d %d %s" % (retval["priority"], retval["weight"], retval["port"], target)
+
+	return(retval, text)
+
+
+def parseAnswerCaa(answer, index, data):
+	"""
+	parseAnswerCaa(answer, index, data): Parse a CAA answer (RFC 8659).
+	"""
+
+	retval = {}
+	retval["sanity"] = []
+
+	retval["flags"] = answer[0]
+	tag_length = answer[1]
+	retval["tag"] = answer[2:2 + tag_length].decode("utf-8", errors = "replace")
+	retval["value"] = answer[2 + tag_length:].decode("utf-8", errors = "replace")
+
+	text = '%d %s "%s"' % (retval["flags"], retval["tag"], retval["value"])
+
+	return(retval, text)
+
+
+def parseAnswerDs(answer, index, data):
+	"""
+	parseAnswerDs(answer, index, data): Parse a DS answer (RFC 4034 5.1).
+	"""
+
+	retval = {}
+	retval["sanity"] = []
+
+	(retval["key_tag"], retval["algorithm"], retval["digest_type"]) = ds_struct.unpack_from(answer)
+	retval["digest"] = answer[4:].hex()
+
+	text = "%d %d %d %s" % (retval["key_tag"], retval["algorithm"], retval["digest_type"],
+		retval["digest"].upper())
+
+	return(retval, text)
+
+
+def parseAnswerDnskey(answer, index, data):
+	"""
+	parseAnswerDnskey(answer, index, data): Parse a DNSKEY answer (RFC 4034 2.1).
+	"""
+
+	retval = {}
+	retval["sanity"] = []
+
+	(retval["flags"], retval["protocol"], retval["algorithm"]) = dnskey_struct.unpack_from(answer)
+	retval["public_key"] = base64.b64encode(answer[4:]).decode("ascii")
+
+	if retval["protocol"] != 3:
+		retval["sanity"].append("DNSKEY protocol is not 3 (%d)" % retval["protocol"])
+
+	text = "%d %d %d %s" % (retval["flags"], retval["protocol"], retval["algorithm"], retval["public_key"])
+
+	return(retval, text)
+
+
+def parseAnswerRrsig(answer, index, data):
+	"""
+	parseAnswerRrsig(answer, index, data): Parse an RRSIG answer (RFC 4034 3.1).
+
+	The signer's name is never compressed, so the signature starts right after it.
+	"""
+
+	retval = {}
+
+	(retval["type_covered"], retval["algorithm"], retval["labels"], retval["original_ttl"],
+		retval["expiration"], retval["inception"], retval["key_tag"]) = rrsig_struct.unpack_from(answer)
+
+	signer_index = index + rrsig_struct.size
+	(signer, retval["sanity"], retval["meta"]) = parse_question.extractDomainName(signer_index, data)
+	retval["signer"] = signer
+
+	signer_length = parse_question.getDomainNameLength(signer_index, data)
+	retval["signature"] = base64.b64encode(answer[rrsig_struct.size + signer_length:]).decode("ascii")
+
+	text = "%s %d %d %d %d %d %d %s %s" % (
+		parse_question.qtypes.get(retval["type_covered"], str(retval["type_covered"])).split(" ")[0],
+		retval["algorithm"], retval["labels"], retval["original_ttl"],
+		retval["expiration"], retval["inception"], retval["key_tag"],
+		signer, retval["signature"])
+
+	return(retval, text)
+
+
+def parseAnswerOpt(answer, index, data):
+	"""
+	parseAnswerOpt(answer, index, data): Parse the options of an OPT pseudo-record (RFC 6891 6.1.2).
+
+	The UDP payload size and extended RCODE live in the CLASS and TTL of the record headers.
+	"""
+
+	retval = {}
+	retval["sanity"] = []
+	retval["options"] = []
+
+	i = 0
+	while i + option_struct.size <= len(answer):
+		budget.spend()
+		(code, length) = option_struct.unpack_from(answer, i)
+		retval["options"].append({"code": code, "data": answer[i + 4:i + 4 + length].hex()})
+		i += 4 + length
+
+	if i != len(answer):
+		retval["sanity"].append("EDNS option runs past the end of RDATA")
+
+	text = " ".join("%d:%s" % (option["code"], option["data"]) for option in retval["options"])
+
+	return(retval, text)
+
+
+#
+# Our table of parsers for each TYPE.  Other modules can add to this with registerDecoder().
+#
+decoders = {
+	1: parseAnswerA,		# A - RFC 1035 3.4.1
+	2: parseAnswerNs,		# NS - RFC 1035 3.3.11
+	5: parseAnswerCname,	# CNAME - RFC 1035 3.3.1
+	6: parseAnswerSoa,		# SOA - RFC 1035 3.3.13
+	12: parseAnswerPtr,		# PTR - RFC 1035 3.3.12
+	15: parseAnswerMx,		# MX - RFC 1035 3.3.9
+	16: parseAnswerTxt,		# TXT - RFC 1035 3.3.14
+	28: parseAnswerAAAA,	# AAAA - RFC 3596 2.2
+	33: parseAnswerSrv,		# SRV - RFC 2782
+	41: parseAnswerOpt,		# OPT - RFC 6891
+	43: parseAnswerDs,		# DS - RFC 4034
+	46: parseAnswerRrsig,	# RRSIG - RFC 4034
+	48: parseAnswerDnskey,	# DNSKEY - RFC 4034
+	257: parseAnswerCaa,	# CAA - RFC 8659
+	}
+
+
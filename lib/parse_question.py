@@ -3,7 +3,10 @@
 import logging
 import struct
 
-from lib import output
+from lib import budget
+from lib import interning
+from lib import projection
+from lib import trace
 
 logger = logging.getLogger()
 
@@ -26,10 +29,16 @@ qtypes = {
 	15: "MX (Mail Exchange)",
 	16: "TXT (Text string)",
 	28: "AAAA (Ipv6 Address)",
+	33: "SRV (Service locator)",
+	41: "OPT (EDNS pseudo-record)",
+	43: "DS (Delegation signer)",
+	46: "RRSIG (DNSSEC signature)",
+	48: "DNSKEY (DNSSEC public key)",
 	252: "AXFR (Request for zone transfer)",
 	253: "MAILB (Request for mailbox-related records)",
 	254: "MAILA (Request for mail agent RRs - obseleted by MX)",
 	255: "* (A request for all records)",
+	257: "CAA (Certification Authority Authorization)",
 	}
 
 
@@ -42,13 +51,13 @@ def parseQtype(qtype, question = False):
 		retval = qtypes[qtype]
 
 	else:
-		retval = "Unknown! (%s)" % qtype
+		retval = interning.internString("Unknown! (%s)" % qtype)
 
 	#
-	# Sanity check: types of >= 252 are only acceptable for questions, not answers.
+	# Sanity check: types of 252-255 are only acceptable for questions, not answers.
 	#
-	if qtype >= 252 and (not question):
-		retval = "Got TYPE >= 252 for non-question. (%s)" % qtype
+	if qtype >= 252 and qtype <= 255 and (not question):
+		retval = interning.internString("Got TYPE >= 252 for non-question. (%s)" % qtype)
 
 	return(retval)
 
@@ -61,14 +70,16 @@ def parseQclass(qclass):
 	if qclass == 1:
 		retval = "IN"
 	else:
-		retval = "Unknown! (%s)" % qclass
+		retval = interning.internString("Unknown! (%s)" % qclass)
 
 	return(retval)
 
 
-def parseQuestion(index, data):
+def parseQuestion(index, data, fields = None):
 	"""
-	parseQuestion(): Parse the question part of the data
+	parseQuestion(index, data, fields = None): Parse the question part of the data
+
+	If fields is specified, text descriptions are only created if they were asked for.
 	"""
 
 	retval = {}
@@ -95,8 +106,11 @@ def parseQuestion(index, data):
 	retval["qclass"] = (256 * data[2]) + data[3]
 	data = data[4:]
 
-	retval["qtype_text"] = parseQtype(retval["qtype"], question = True)
-	retval["qclass_text"] = parseQclass(retval["qclass"])
+	if projection.wants(fields, "question.qtype_text"):
+		retval["qtype_text"] = parseQtype(retval["qtype"], question = True)
+
+	if projection.wants(fields, "question.qclass_text"):
+		retval["qclass_text"] = parseQclass(retval["qclass"])
 
 	index += 4
 
@@ -105,6 +119,13 @@ def parseQuestion(index, data):
 	return(retval)
 
 
+#
+# The keys of the entries for each label and pointer in our domain-name metadata.
+#
+label_keys = ("length", "string")
+pointer_keys = ("pointer", "target")
+
+
 def extractDomainName(index, data, debug_bad_pointer = False):
 	"""
 	extractDomainName(answer, data) - Extract a domain-name as defined in RFC 1035 3.3
@@ -131,8 +152,12 @@ def extractDomainName(index, data, debug_bad_pointer = False):
 	beenhere = {}
 	#beenhere[21] = True # Debugging
 
+	label_bytes = 0
+
 	while True:
 
+		budget.spend()
+
 		length = data[index]
 		if debug_bad_pointer:
 			length = 0b01000000 # Debugging
@@ -143,23 +168,29 @@ def extractDomainName(index, data, debug_bad_pointer = False):
 		elif length & 0b11000000:
 
 			#
-			# Make sure both of the first bits are set
+			# Make sure both of the first bits are set.  The other 6 bits are the
+			# top of the offset, so pointers past the first 256 bytes are fine.
 			#
-			if length != 192:
-				sanity.append("Bad pointer! Expected value of 192, got %d!" % length)
+			if (length & 0b11000000) != 0b11000000:
+				sanity.append("Bad pointer! Expected value of 192 or more, got %d!" % length)
 				break
 
 			pointer = getPointerAddress(data[index:index + 2])
-			logger.debug("Pointer found!  Raw value: %s, interpreted value: %d" % (
-				output.formatHex(data[index:index + 2]), pointer))
+			if trace.active:
+				trace.event("pointer", "extractDomainName(): Pointer at %(index)d to %(pointer)d",
+					index = index, pointer = pointer)
 
 			if pointer in beenhere:
-				logger.warn("extractDomainName(): We were previously at this pointer, bailing out! "
-					+ "pointer=%s, beenhere=%s" % (pointer, beenhere))
+				logger.warning("extractDomainName(): We were previously at this pointer, bailing out! "
+					+ "pointer=%s, beenhere=%s", pointer, list(beenhere))
+				if trace.active:
+					trace.event("pointer_loop", "extractDomainName(): Pointer loop at %(index)d to %(pointer)d",
+						index = index, pointer = pointer)
 				sanity.append("Previously at pointer %s, bailing out! (Beenhere: %s)" % (pointer, beenhere))
 				break
 
 			beenhere[pointer] = True
+			budget.checkPointerHops(len(beenhere))
 
 			length = int(data[pointer])
 
@@ -179,26 +210,18 @@ def extractDomainName(index, data, debug_bad_pointer = False):
 			pointer = 0
 
 		#
-		# Chop off the first byte and get our domain-name
+		# Skip the length byte and get our label
 		#
-		domain_name = data[index + 1:]
-		string = domain_name[0:length].decode("utf-8")
+		string = interning.decodeLabel(data[index + 1:index + 1 + length])
 
 
 		#
 		# If we have a pointer in this iteration, store it and what it points to in our metadata.
 		#
 		if pointer:
-			pointer_data = {
-				"pointer": pointer,
-				"target": string,
-				}
+			pointer_data = interning.internEntry(pointer_keys, (pointer, string))
 			meta["pointers"].append(pointer_data)
-
-			meta["data_decoded"].append({
-				"pointer": pointer,
-				"target": string,
-				})
+			meta["data_decoded"].append(pointer_data)
 
 		else:
 			#
@@ -206,25 +229,49 @@ def extractDomainName(index, data, debug_bad_pointer = False):
 			# copy the payload to our metadata.
 			#
 			if not len(meta["pointers"]):
-				meta["data_decoded"].append({
-					"length": length,
-					"string": string,
-					})
+				meta["data_decoded"].append(interning.internEntry(label_keys, (length, string)))
 
 		if retval:
 			retval += "."
 
 		retval += string
 
+		label_bytes += 1 + length
+		budget.checkLabelBytes(label_bytes)
+
 		index += 1 + length
 
-	meta["data_decoded"].append({
-		"length": 0,
-		})
+	meta["data_decoded"].append(interning.end_entry)
+
+	retval = interning.internString(retval)
 
 	return(retval, sanity, meta)
 
 
+def getDomainNameLength(index, data):
+	"""
+	getDomainNameLength(index, data): Return how many bytes the domain-name at index takes up.
+
+	Pointers aren't followed, as they end the name no matter what they point to.
+	"""
+
+	start = index
+
+	while True:
+
+		budget.spend()
+
+		length = data[index]
+
+		if length == 0:
+			return(index + 1 - start)
+
+		elif length & 0b11000000:
+			return(index + 2 - start)
+
+		index += 1 + length
+
+
 def getPointerAddress(data):
 	"""
 	getPointerAdrress(data): Return the address of a pointer
@@ -0,0 +1,201 @@
+#
+# This module handles --fields, which limits our output to just the fields that were asked for.
+#
+# Fields are dotted paths into the parsed response, such as "question.question",
+# "header.header.rcode", or "answers[].headers.ttl".  The "[]" is optional, and
+# means "every item in this list".  The header's flags can be given as "header.rcode"
+# and so on, for short.  A field which isn't in our schema is an error.
+#
+# The parsers check wants() before computing derived fields (text descriptions,
+# humanized TTLs, hex dumps), so those aren't computed unless they'll be output.
+# The records themselves are always decoded and sanity checked, as --follow-cnames,
+# --watch, our metrics, and our memo all need them.
+#
+
+
+import logging
+
+
+logger = logging.getLogger()
+
+
+#
+# The flags in the header, which live in header.header.
+#
+header_flags = ("qr", "opcode", "aa", "tc", "rd", "ra", "z", "rcode")
+
+#
+# The fields in a parsed response.  None marks a field with nothing beneath it, and
+# "*" one whose contents vary (by record type, for instance), so anything beneath it goes.
+#
+schema = {
+	"server": None,
+	"header": {
+		"request_id": None,
+		"header": { flag: None for flag in header_flags },
+		"header_text": { key: None for key in ("qr", "opcode_text", "aa", "tc", "rd", "ra", "rcode_text") },
+		"num_questions": None,
+		"num_answers": None,
+		"num_authority_records": None,
+		"num_additional_records": None,
+		},
+	"question": {
+		"question": None,
+		"question_length": None,
+		"qtype": None,
+		"qtype_text": None,
+		"qclass": None,
+		"qclass_text": None,
+		"meta": "*",
+		},
+	"answers": {
+		"headers": { key: None for key in ("type", "type_text", "class", "class_text", "ttl", "ttl_text", "rdlength") },
+		"rddata": "*",
+		"rddata_text": None,
+		"rddata_hex": None,
+		"sanity": None,
+		},
+	"sanity": {
+		"header": None,
+		"answers": None,
+		},
+	"cname_chain": {
+		"status": None,
+		"hops": { key: None for key in ("name", "target", "ttl", "source") },
+		"final_name": None,
+		"answers": None,
+		"queries": None,
+		},
+	}
+
+#
+# Memoized results of wants(), keyed by (fields, path).
+#
+wants_cache = {}
+
+
+def checkField(field):
+	"""
+	checkField(field): Return the full path of a field, or raise ValueError if there's no such field.
+	"""
+
+	parts = field.split(".")
+
+	if len(parts) == 2 and parts[0] == "header" and parts[1] in header_flags:
+		parts.insert(1, "header")
+
+	node = schema
+
+	for (i, part) in enumerate(parts):
+
+		if node == "*":
+			break
+
+		if node is None:
+			raise ValueError("Unknown field \"%s\": %s has no fields inside it" % (field, ".".join(parts[0:i])))
+
+		if part not in node:
+			if not i:
+				raise ValueError("Unknown field \"%s\": fields start with one of %s" % (field, ", ".join(sorted(node))))
+			raise ValueError("Unknown field \"%s\": %s has %s" % (field, ".".join(parts[0:i]), ", ".join(sorted(node))))
+
+		node = node[part]
+
+	return(".".join(parts))
+
+
+def parseFields(text):
+	"""
+	parseFields(text): Parse a comma-separated list of fields.
+
+	A frozenset of dotted paths is returned, or None if no fields were given (meaning "everything").
+	ValueError is raised if any of the fields aren't in our schema.
+	"""
+
+	if not text:
+		return(None)
+
+	retval = set()
+	for field in text.split(","):
+		field = field.strip().replace("[]", "")
+		if field:
+			retval.add(checkField(field))
+
+	return(frozenset(retval))
+
+
+def wants(fields, path):
+	"""
+	wants(fields, path): Returns True if anything at or under path is going to be output.
+
+	That's the case if the path itself was asked for, if something inside of it was
+	asked for (e.g. "answers.headers" for "answers.headers.ttl"), or if something
+	containing it was asked for (e.g. "answers.headers.ttl_text" for "answers").
+	"""
+
+	if fields is None:
+		return(True)
+
+	key = (fields, path)
+	if key in wants_cache:
+		return(wants_cache[key])
+
+	retval = False
+	for field in fields:
+		if field == path or field.startswith(path + ".") or path.startswith(field + "."):
+			retval = True
+			break
+
+	wants_cache[key] = retval
+
+	return(retval)
+
+
+def copyPath(src, dst, parts):
+	"""
+	copyPath(src, dst, parts): Copy a single path from one dictionary to another, descending into lists.
+	"""
+
+	key = parts[0]
+	if key not in src:
+		return
+
+	value = src[key]
+
+	if len(parts) == 1:
+		dst[key] = value
+		return
+
+	if isinstance(value, list):
+		if not isinstance(dst.get(key), list):
+			dst[key] = [ {} for item in value ]
+		for (item, dst_item) in zip(value, dst[key]):
+			if isinstance(item, dict):
+				copyPath(item, dst_item, parts[1:])
+
+	elif isinstance(value, dict):
+		if not isinstance(dst.get(key), dict):
+			dst[key] = {}
+		copyPath(value, dst[key], parts[1:])
+
+
+def project(data, fields):
+	"""
+	project(data, fields): Return a copy of data with just the fields we asked for.
+	"""
+
+	if fields is None:
+		return(data)
+
+	retval = {}
+
+	#
+	# Shorter paths go first, so that if both "answers" and "answers.headers" were
+	# asked for, we end up with all of "answers".
+	#
+	for field in sorted(fields, key = len):
+		copyPath(data, retval, field.split("."))
+
+	return(retval)
+
+
@@ -0,0 +1,229 @@
+#
+# This module holds code for building, sending, and parsing a single DNS query.
+#
+
+
+import logging
+import socket
+import struct
+import sys
+import time
+
+from lib import budget
+from lib import create
+from lib import memo
+from lib import memory
+from lib import metrics
+from lib import parse
+from lib import parse_answer
+from lib import parse_question
+from lib import sanity
+from lib import trace
+
+
+logger = logging.getLogger()
+
+#
+# What parseMessage() raises for a malformed packet: IndexError for running off the end,
+# ValueError for labels which aren't UTF-8 and bad address lengths, struct.error for short
+# record data, and BudgetExceeded for packets which take too much work.  Anything else is a bug.
+#
+malformed_errors = (IndexError, ValueError, struct.error, budget.BudgetExceeded)
+
+
+def getDnsMessage(args, q = None, query_type = None):
+	"""
+	getDnsMessage(args, q = None, query_type = None): Construct our DNS message to send
+	"""
+
+	retval = create.createQuery(args, q, query_type)
+
+	#
+	# Parsing our own query just to log it isn't free, so only do it if we're debugging.
+	#
+	if trace.debug:
+		logger.debug(parse.parseHeader(retval[0:12]))
+		logger.debug(parse_question.parseQuestion(12, retval))
+
+	return(retval)
+
+
+def sendDnsMessage(args, message, server = None):
+	"""
+	sendDnsMessage(args, message, server = None): Send our DNS message and then return the result.
+
+	server - Where to send it, if not to args.server
+	"""
+
+	retval = ""
+
+	server = server or args.server
+	server_address = (server, 53)
+
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+	sock.settimeout(3)
+
+	metrics.increment("dns_tool_queries_sent_total", server = server)
+	metrics.increment("dns_tool_in_flight_queries")
+
+	try:
+		logger.info("Sending query to %s:%s..." % server_address)
+		start = time.time()
+		sock.sendto(message, server_address)
+		retval, _ = sock.recvfrom(4096)
+		rtt = time.time() - start
+		metrics.observe("dns_tool_rtt_seconds", rtt, server = server)
+
+		if args.record:
+			from lib import archive
+			archive.writeRecord(server, rtt, message, retval, start)
+
+	except socket.timeout as e:
+		logger.error("Timeout waiting for %s:%s: %s" % (server_address[0], server_address[1], e))
+		metrics.increment("dns_tool_timeouts_total", server = server)
+
+		#
+		# Queries which went unanswered are recorded too, with an empty response.
+		#
+		if args.record:
+			from lib import archive
+			archive.writeRecord(server, None, message, b"", start)
+
+		raise e
+
+	except socket.error as e:
+		logger.error("Error connecting to %s:%s: %s" % (server_address[0], server_address[1], e))
+		metrics.increment("dns_tool_errors_total", server = server)
+		raise e
+
+	finally:
+		metrics.increment("dns_tool_in_flight_queries", -1)
+		sock.close()
+
+	return(retval)
+
+
+def getRawMessage(args, message):
+	"""
+	getRawMessage(args, message): Return our message as it should be written out with --raw.
+	"""
+
+	#
+	# If --fake-ttl was specified, rewrite the TTLs.  We'll make them -3 (4294967293), which
+	# is unlikely to occur in nature.
+	# This is useful for testing.
+	#
+	if args.fake_ttl:
+		budget.start()
+		question = parse_question.parseQuestion(12, message)
+		message = parse_answer.parseAnswersFakeTtl(args, message, question_length = question["question_length"])
+
+	return(message)
+
+
+def parseMessage(args, message, question = None):
+	"""
+	parseMessage(args, message, question = None): Parse our message and return a data structure of that.
+
+	If question is given, it's used for a message which has no question of its own, such as
+	all but the first message of a zone transfer.
+
+	One of malformed_errors is raised if the message can't be parsed.
+	"""
+
+	retval = {}
+
+	if args.raw:
+		# Source: https://stackoverflow.com/a/4849792/196073
+		sys.stdout.buffer.write(getRawMessage(args, message)) # Python 3
+
+		sys.exit(0)
+
+	trace.startPacket(len(message))
+
+	if memory.enabled:
+		memory.countMessage()
+
+	request_id = parse.getRequestId(message)
+
+	retval["server"] = args.server
+	retval["header"] = parse.parseHeader(message[0:12], fields = args.fields)
+
+	budget.start()
+	exceeded = None
+
+	#
+	# If we've parsed this same packet before (apart from the request ID and TTLs), reuse that.
+	#
+	key = None
+	cached = None
+	if memo.entries_max:
+		(key, ttls) = memo.getKey(message)
+		cached = memo.get(args, key, ttls)
+
+	if cached:
+		if trace.active:
+			trace.event("memo_hit", "parseMessage(): Reusing the parse of an identical packet")
+		(retval["question"], retval["answers"], sanity_answers) = cached
+		retval["sanity"] = {
+			"header": sanity.checkHeader(retval["header"], request_id),
+			"answers": sanity_answers,
+			}
+
+	else:
+		#
+		# Making our memo key took some of the budget, and how much shouldn't depend on
+		# whether the memo is in use, so parsing gets a budget of its own.
+		#
+		budget.start()
+
+		try:
+			question_length = 0
+			if question is None or retval["header"]["num_questions"]:
+				retval["question"] = parse_question.parseQuestion(12, message, fields = args.fields)
+				question_length = retval["question"]["question_length"]
+
+			else:
+				retval["question"] = question
+
+			#
+			# Send us past the headers and question and parse the answer(s).
+			#
+			retval["answers"] = parse_answer.parseAnswers(args, message, question_length = question_length)
+
+		except budget.BudgetExceeded as e:
+			#
+			# Without a question there's nothing for us to print, so treat that like any other bad packet.
+			#
+			if not "question" in retval:
+				raise
+
+			exceeded = e
+			retval["answers"] = []
+
+		#
+		# Do a sanity check on the results.
+		#
+		retval["sanity"] = sanity.go(retval["header"], retval["answers"], request_id)
+
+		if key is not None and not exceeded:
+			memo.put(key, ttls, retval["question"], retval["answers"], retval["sanity"]["answers"])
+
+	if exceeded:
+		logger.warning("Parse budget exceeded, skipping answers: %s" % exceeded)
+		if trace.active:
+			trace.event("budget_exceeded", "parseMessage(): %(reason)s", reason = str(exceeded))
+		retval["sanity"]["header"].append("Parse budget exceeded, answers skipped! (%s)" % exceeded)
+
+	if metrics.enabled:
+		metrics.increment("dns_tool_responses_total", rcode = retval["header"]["header"]["rcode"])
+		for warning in retval["sanity"]["header"]:
+			metrics.increment("dns_tool_sanity_warnings_total", type = sanity.getWarningType(warning))
+		for warnings in retval["sanity"]["answers"]:
+			for warning in warnings:
+				metrics.increment("dns_tool_sanity_warnings_total", type = sanity.getWarningType(warning))
+
+	return(retval)
+
+
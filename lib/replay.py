@@ -0,0 +1,276 @@
+#
+# This module holds our code for --replay, which resends the queries in an archive
+# to a server, with the same timing as when they were recorded (or scaled), and
+# compares the responses with the recorded ones.
+#
+# Like --ptr-sweep, queries are sent from a single non-blocking UDP socket, so
+# a slow response doesn't hold up the queries scheduled after it.
+#
+
+
+import logging
+import select
+import socket
+import struct
+import time
+
+from lib import archive
+from lib import canonical
+from lib import create
+from lib import metrics
+from lib import offsets
+from lib import output
+from lib import parse_question
+from lib import query
+from lib import scheduler
+
+
+logger = logging.getLogger()
+
+
+#
+# The names of our query types, keyed by number.
+#
+query_type_names = { value: key for (key, value) in create.query_types.items() }
+
+report_template = (
+	"Replayed %d queries to %s in %.2f seconds (%.1f queries/sec)\n"
+	"Responses: %d, timeouts: %d, mismatches: %d, parse errors: %d\n"
+	"Latency (ms): p50 %s, p90 %s, p99 %s, max %s\n"
+	"Recorded latency (ms): p50 %s, p90 %s, p99 %s, max %s\n"
+	)
+
+
+def getPercentile(values, percentile):
+	"""
+	getPercentile(values, percentile): Return a percentile of a sorted list, in milliseconds, as text.
+	"""
+
+	if not values:
+		return("-")
+
+	index = min(len(values) - 1, int(len(values) * percentile / 100))
+
+	return("%.1f" % (values[index] * 1000))
+
+
+def buildQuery(args, recorded, request_id):
+	"""
+	buildQuery(args, recorded, request_id): Build a new query with the same question and flags as a recorded one.
+
+	None is returned if the recorded query can't be rebuilt.
+	"""
+
+	question = parse_question.parseQuestion(12, recorded)
+
+	query_type = query_type_names.get(question["qtype"])
+	if query_type is None:
+		return(None)
+
+	flags = struct.unpack_from(">H", recorded, 2)[0]
+
+	return(create.createQuery(args, question["question"], query_type, flags = flags, request_id = request_id))
+
+
+def compareResponses(recorded, response):
+	"""
+	compareResponses(recorded, response): Compare a response with the recorded one.
+
+	The request ID, TTLs, and record order are ignored.  Returns None if they match,
+	or a description of how they differ.
+	"""
+
+	if not recorded:
+		return("No response was recorded")
+
+	if (recorded[3] & 0x0f) != (response[3] & 0x0f):
+		return("RCODE was %d, now %d" % (recorded[3] & 0x0f, response[3] & 0x0f))
+
+	if canonical.canonicalize(recorded) != canonical.canonicalize(response):
+		return("Answers differ")
+
+	return(None)
+
+
+def go(args):
+	"""
+	go(args): Replay the queries in args.replay against args.server, and report on how it went.
+	"""
+
+	output.flush_every = args.flush_every
+
+	reader = archive.ArchiveReader(args.replay)
+
+	server_address = socket.getaddrinfo(args.server, 53, type = socket.SOCK_DGRAM)[0][4]
+	family = socket.AF_INET6 if ":" in server_address[0] else socket.AF_INET
+
+	sock = socket.socket(family, socket.SOCK_DGRAM)
+	sock.setblocking(False)
+
+	records = iter(reader)
+	record = next(records, None)
+	first_timestamp = record[0] if record else 0
+
+	#
+	# Our queries in flight, keyed by request ID: [ name/type, deadline, time sent, recorded response, question section ]
+	#
+	in_flight = {}
+
+	latencies = []
+	recorded_latencies = []
+	num_sent = 0
+	num_responses = 0
+	num_timeouts = 0
+	num_mismatches = 0
+	num_parse_errors = 0
+
+	show = args.json or args.json_pretty_print or args.text or args.graph
+
+	logger.info("Replaying %d queries from %s to %s:%s (speed: %s)" % (
+		len(reader), args.replay, args.server, 53, "%sx" % args.replay_speed if args.replay_speed else "as fast as possible"))
+
+	start = time.time()
+
+	try:
+		while True:
+
+			now = time.time()
+
+			#
+			# Send every query which is due, as long as our concurrency allows.
+			#
+			due = now
+			while record and len(in_flight) < args.concurrency:
+
+				(timestamp, _, rtt, recorded_query, recorded_response) = record
+
+				if args.replay_speed:
+					due = start + (timestamp - first_timestamp) / args.replay_speed
+					if due > now:
+						break
+
+				record = next(records, None)
+
+				request_id = scheduler.getFreeRequestId(in_flight)
+				try:
+					message = buildQuery(args, bytes(recorded_query), request_id)
+
+				except Exception as e:
+					logger.warning("Unable to rebuild recorded query: %s" % e)
+					continue
+
+				if message is None:
+					logger.warning("Unable to rebuild recorded query of an unknown type, skipping")
+					continue
+
+				if rtt is not None:
+					recorded_latencies.append(rtt)
+
+				question = parse_question.parseQuestion(12, message)
+				name = "%s/%s" % (question["question"], query_type_names[question["qtype"]])
+
+				sock.sendto(message, server_address)
+				metrics.increment("dns_tool_queries_sent_total", server = args.server)
+				metrics.increment("dns_tool_in_flight_queries")
+				num_sent += 1
+
+				in_flight[request_id] = [ name, now + args.timeout, now, bytes(recorded_response), offsets.getQuestion(message) ]
+
+			if not record and not in_flight:
+				break
+
+			#
+			# Wait for a response, until the next query times out or the next one is due.
+			#
+			timeout = min([ entry[1] for entry in in_flight.values() ] + [ now + 1 ]) - now
+			if record and len(in_flight) < args.concurrency:
+				timeout = min(timeout, due - now)
+
+			(readable, _, _) = select.select([ sock ], [], [], max(0, timeout))
+
+			while readable:
+
+				try:
+					(message, address) = sock.recvfrom(4096)
+
+				except BlockingIOError:
+					break
+
+				if len(message) < 12:
+					continue
+
+				request_id = struct.unpack(">H", message[0:2])[0]
+				if request_id not in in_flight:
+					logger.debug("Got response for unknown request ID %04x from %s, ignoring", request_id, address[0])
+					continue
+
+				#
+				# The request ID is only 16 bits, so to be sure a response is for our query
+				# (and not a stray or spoofed one), it must come from our server and ask our question.
+				#
+				if address[0:2] != server_address[0:2]:
+					logger.debug("Got response for request ID %04x from %s instead of our server, ignoring", request_id, address[0])
+					continue
+
+				if offsets.getQuestion(message) != in_flight[request_id][4]:
+					logger.debug("Got response for request ID %04x with a different question, ignoring", request_id)
+					continue
+
+				(name, _, sent, recorded_response, _) = in_flight.pop(request_id)
+				rtt = time.time() - sent
+				latencies.append(rtt)
+				num_responses += 1
+
+				metrics.increment("dns_tool_in_flight_queries", -1)
+				metrics.observe("dns_tool_rtt_seconds", rtt, server = args.server)
+
+				difference = compareResponses(recorded_response, message)
+				if difference:
+					logger.warning("Mismatch for %s: %s" % (name, difference))
+					num_mismatches += 1
+
+				try:
+					response = query.parseMessage(args, message)
+
+				except Exception as e:
+					logger.error("Unable to parse response for %s: %s" % (name, e))
+					metrics.increment("dns_tool_parse_errors_total")
+					num_parse_errors += 1
+					continue
+
+				if show:
+					output.printResponse(args, response)
+
+			#
+			# Anything which has timed out is given up on.  We don't retry, as that would change the load.
+			#
+			now = time.time()
+			for request_id in [ key for (key, entry) in in_flight.items() if entry[1] <= now ]:
+
+				(name, _, _, _, _) = in_flight.pop(request_id)
+				metrics.increment("dns_tool_in_flight_queries", -1)
+				metrics.increment("dns_tool_timeouts_total", server = args.server)
+				logger.warning("Timed out waiting for %s" % name)
+				num_timeouts += 1
+
+	except KeyboardInterrupt:
+		logger.info("Interrupted, stopping.")
+
+	finally:
+		sock.close()
+
+	elapsed = time.time() - start
+
+	latencies.sort()
+	recorded_latencies.sort()
+
+	output.pending.append(report_template % (
+		num_sent, args.server, elapsed, num_sent / elapsed if elapsed else 0,
+		num_responses, num_timeouts, num_mismatches, num_parse_errors,
+		getPercentile(latencies, 50), getPercentile(latencies, 90), getPercentile(latencies, 99), getPercentile(latencies, 100),
+		getPercentile(recorded_latencies, 50), getPercentile(recorded_latencies, 90),
+		getPercentile(recorded_latencies, 99), getPercentile(recorded_latencies, 100),
+		))
+	output.flush()
+
+
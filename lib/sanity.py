@@ -8,6 +8,30 @@ import logging
 
 logger = logging.getLogger()
 
+#
+# The OPT pseudo-record (RFC 6891), which reuses CLASS for something else.
+#
+type_opt = 41
+
+#
+# A lookup table of the start of each warning we can produce, and a short type
+# for it.  This is used to group warnings when counting them.
+#
+warning_types = [
+	("Content of Z field", "z_nonzero"),
+	("Request ID on answer", "request_id_mismatch"),
+	("OPCODE > 2", "opcode_reserved"),
+	("Invalid RCODE", "rcode_invalid"),
+	("QCLASS in answer is <", "qclass_low"),
+	("QCLASS in answer is >", "qclass_high"),
+	("Bad pointer", "bad_pointer"),
+	("Previously at pointer", "pointer_loop"),
+	("Parse budget exceeded", "budget_exceeded"),
+	("TXT character-string runs past", "txt_overrun"),
+	("EDNS option runs past", "edns_overrun"),
+	("DNSKEY protocol is not 3", "dnskey_protocol"),
+	]
+
 
 def go(header, answers, request_id):
 	"""
@@ -22,6 +46,18 @@ def go(header, answers, request_id):
 	return(retval)
 
 
+def getWarningType(warning):
+	"""
+	getWarningType(warning): Get the short type of a warning, or "other" if we don't recognize it.
+	"""
+
+	for (prefix, warning_type) in warning_types:
+		if warning.startswith(prefix):
+			return(warning_type)
+
+	return("other")
+
+
 def checkHeader(header, request_id):
 	"""
 	checkHeader(header, request_id): Check our header for sanity
@@ -66,6 +102,13 @@ def checkAnswers(answers):
 		sanity = answer["sanity"]
 		headers = answer["headers"]
 
+		#
+		# The CLASS of an OPT pseudo-record is the sender's UDP payload size, so don't check it.
+		#
+		if headers["type"] == type_opt:
+			retval.append(sanity)
+			continue
+
 		#headers["class"] = 0 # Debugging
 		if headers["class"] < 1:
 			warning = "QCLASS in answer is < 1 (%s)" % headers["class"]
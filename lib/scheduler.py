@@ -0,0 +1,483 @@
+#
+# This module holds our scheduler for bulk queries, which keeps many queries in flight
+# across a pool of servers while being polite to each of them.
+#
+# Each server has its own token bucket (--server-rate) and cap on queries in flight
+# (--server-concurrency), and on top of those are a global rate (--rate) and cap
+# (--concurrency).  Each query goes to whichever server can take it and has the fewest
+# queries in flight, so load is spread across the pool.
+#
+# A server which times out or answers with SERVFAIL or REFUSED is backed off: it gets
+# no new queries for a while, and that while doubles each time it happens again, up to
+# backoff_max.  The query is retried (on whichever server is picked next) if it has
+# retries left.  An answer which isn't SERVFAIL or REFUSED resets the backoff.
+#
+
+
+import logging
+import random
+import select
+import socket
+import struct
+import time
+
+from lib import create
+from lib import metrics
+from lib import offsets
+from lib import parse
+
+
+logger = logging.getLogger()
+
+
+#
+# The RCODEs which mean a server wants us to back off: 2 (SERVFAIL) and 5 (REFUSED).
+#
+backoff_rcodes = (2, 5)
+
+#
+# How long to back off from a server the first time, and the longest we'll ever back off, in seconds.
+#
+backoff_min = 1
+backoff_max = 30
+
+
+class TokenBucket():
+	"""
+	TokenBucket: Limit how often something can happen, while allowing short bursts.
+
+	rate - How many tokens are added per second.  Zero means no limit.
+	burst - The most tokens that can be saved up.
+	"""
+
+	def __init__(self, rate, burst = None):
+		self.rate = rate
+		self.burst = burst or max(rate, 1)
+		self.tokens = self.burst
+		self.last = time.time()
+
+	def refill(self, now):
+		self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+		self.last = now
+
+	def take(self, now):
+		"""
+		take(now): Take a token, if one is available.  Returns True if it was.
+		"""
+
+		if not self.rate:
+			return(True)
+
+		self.refill(now)
+		if self.tokens >= 1:
+			self.tokens -= 1
+			return(True)
+
+		return(False)
+
+	def wait(self, now):
+		"""
+		wait(now): How long until the next token is available
+		"""
+
+		if not self.rate:
+			return(0)
+
+		self.refill(now)
+		return(max(0, (1 - self.tokens) / self.rate))
+
+
+class Server():
+	"""
+	Server: One server in our pool, with its own rate limit, cap on queries in flight, and backoff.
+
+	max_in_flight - The most queries this server can have in flight.  Zero means no limit.
+	"""
+
+	def __init__(self, name, rate, max_in_flight):
+		self.name = name
+		self.address = socket.getaddrinfo(name, 53, type = socket.SOCK_DGRAM)[0][4]
+		self.family = socket.AF_INET6 if ":" in self.address[0] else socket.AF_INET
+		self.bucket = TokenBucket(rate)
+		self.max_in_flight = max_in_flight
+		self.in_flight = 0
+		self.backoff = 0
+		self.backoff_until = 0
+
+	def wait(self, now):
+		"""
+		wait(now): How long until this server can take a query, or None if it's full.
+		"""
+
+		if self.max_in_flight and self.in_flight >= self.max_in_flight:
+			return(None)
+
+		return(max(self.backoff_until - now, self.bucket.wait(now)))
+
+	def failed(self, now, reason):
+		"""
+		failed(now, reason): Back off from this server, for twice as long as last time.
+
+		If we're already backing off, nothing changes, so that a burst of failures from
+		queries which were already in flight only counts once.
+		"""
+
+		if now < self.backoff_until:
+			return
+
+		self.backoff = min(backoff_max, self.backoff * 2 if self.backoff else backoff_min)
+
+		#
+		# Some jitter, so that servers which failed together don't come back together.
+		#
+		self.backoff_until = now + self.backoff * random.uniform(0.5, 1)
+
+		logger.warning("Backing off from %s for up to %d seconds: %s" % (self.name, self.backoff, reason))
+		metrics.increment("dns_tool_backoffs_total", server = self.name)
+
+	def succeeded(self):
+		"""
+		succeeded(): Note that this server answered, and stop backing off.
+		"""
+
+		self.backoff = 0
+
+
+class Scheduler():
+	"""
+	Scheduler: Decide which server (if any) the next query can go to.
+	"""
+
+	def __init__(self, args, servers):
+		self.servers = [ Server(name, args.server_rate, args.server_concurrency) for name in servers ]
+		self.bucket = TokenBucket(args.rate)
+		self.max_in_flight = args.concurrency
+		self.in_flight = 0
+		self.next = 0
+
+	def pick(self, now):
+		"""
+		pick(now): Return the server the next query should go to, or None if nothing can be sent yet.
+
+		Of the servers which can take a query, the one with the fewest in flight is picked.
+		Ties go round-robin.  Tokens are taken from the buckets of whichever server is picked.
+		"""
+
+		if self.in_flight >= self.max_in_flight or self.bucket.wait(now):
+			return(None)
+
+		retval = None
+		picked = None
+		count = len(self.servers)
+		start = self.next
+
+		for i in range(count):
+			index = (start + i) % count
+			server = self.servers[index]
+			if server.wait(now) != 0:
+				continue
+			if retval is None or server.in_flight < retval.in_flight:
+				retval = server
+				picked = index
+
+		if retval is None:
+			return(None)
+
+		self.next = (picked + 1) % count
+
+		self.bucket.take(now)
+		retval.bucket.take(now)
+
+		return(retval)
+
+	def wait(self, now):
+		"""
+		wait(now): How long until a query could be sent.  This is at most a second, unless
+			it's our global rate that's holding us up.
+		"""
+
+		if self.in_flight >= self.max_in_flight:
+			return(1)
+
+		retval = 1
+		for server in self.servers:
+			wait = server.wait(now)
+			if wait is not None:
+				retval = min(retval, wait)
+
+		return(max(retval, self.bucket.wait(now)))
+
+	def sent(self, server):
+		server.in_flight += 1
+		self.in_flight += 1
+
+	def finished(self, server):
+		server.in_flight -= 1
+		self.in_flight -= 1
+
+
+class FollowUp(tuple):
+	"""
+	FollowUp: A query which an on_response callback asked for, as (name, query_type, on_response, entry).
+
+	Its own on_response is called with its response (or None if it timed out) in place of
+	run()'s, and can ask for another follow-up in turn.  entry is the query from run()'s
+	queries which it's on behalf of, and which isn't finished until its follow-ups are.
+	"""
+
+
+def getFreeRequestId(in_flight):
+	"""
+	getFreeRequestId(in_flight): Get a random request ID which isn't already in flight.
+	"""
+
+	while True:
+		retval = random.randint(0, 65535)
+		if retval not in in_flight:
+			return(retval)
+
+
+def getServers(args):
+	"""
+	getServers(args): Return the names of the servers in our pool.
+	"""
+
+	if args.servers:
+		return(args.servers)
+
+	return([ args.server ])
+
+
+def run(args, queries, on_response, on_finished = None):
+	"""
+	run(args, queries, on_response, on_finished = None): Send every query, with as many in flight
+		as our limits allow.
+
+	queries - An iterator of (name, query_type), which can have more after those
+	on_response - Called with (args, name, query_type, server, request, response) for each
+		response, as they arrive.  server is the name of the server which answered.  It can
+		return (name, query_type, on_response) for a follow-up query which it needs to finish
+		with the response, such as the next name in a CNAME chain.  See FollowUp.
+	on_finished - If given, called with each entry from queries once it has been answered
+		(along with any follow-ups) or given up on.
+
+	Returns a tuple of (responses, timeouts).
+	"""
+
+	scheduler = Scheduler(args, getServers(args))
+
+	#
+	# The archive is only loaded if we're recording to one.
+	#
+	if args.record:
+		from lib import archive
+
+	#
+	# One socket for each address family in our pool.
+	#
+	sockets = {}
+	for server in scheduler.servers:
+		if server.family not in sockets:
+			sockets[server.family] = socket.socket(server.family, socket.SOCK_DGRAM)
+			sockets[server.family].setblocking(False)
+
+	#
+	# Our queries in flight, keyed by request ID: [ entry from queries, server, deadline, tries, time sent, query ]
+	#
+	in_flight = {}
+	retry = []
+	follow_ups = []
+	upcoming = None
+	done = False
+
+	num_responses = 0
+	num_timeouts = 0
+
+	def finishEntry(entry, follow_up):
+		"""
+		finishEntry(entry, follow_up): Queue a follow-up on behalf of an entry from queries, or
+			if there isn't one, note that the entry is finished.
+		"""
+
+		if follow_up:
+			follow_ups.append(FollowUp(tuple(follow_up) + (entry,)))
+
+		elif on_finished:
+			on_finished(entry)
+
+	try:
+		while True:
+
+			now = time.time()
+
+			#
+			# Send as many queries as our limits allow.  Retries go first, then follow-ups.
+			#
+			while retry or follow_ups or not done:
+
+				if not retry and not follow_ups and upcoming is None:
+					upcoming = next(queries, None)
+					if upcoming is None:
+						done = True
+						break
+
+				server = scheduler.pick(now)
+				if server is None:
+					break
+
+				if retry:
+					(entry, tries) = retry.pop()
+					metrics.increment("dns_tool_retries_total")
+
+				elif follow_ups:
+					entry = follow_ups.pop()
+					tries = 0
+
+				else:
+					entry = upcoming
+					upcoming = None
+					tries = 0
+
+				(name, query_type) = entry[0:2]
+				request_id = getFreeRequestId(in_flight)
+				message = create.createQuery(args, name, query_type, request_id = request_id)
+
+				scheduler.sent(server)
+				metrics.increment("dns_tool_in_flight_queries")
+
+				#
+				# If the query can't even be sent (no route, the network is down, and so on),
+				# treat it like a timeout which happened right away.
+				#
+				try:
+					sockets[server.family].sendto(message, server.address)
+					deadline = now + args.timeout
+
+				except OSError as e:
+					logger.debug("Unable to send query for %s/%s to %s: %s", name, query_type, server.name, e)
+					deadline = now
+
+				else:
+					metrics.increment("dns_tool_queries_sent_total", server = server.name)
+
+				in_flight[request_id] = [ entry, server, deadline, tries + 1, now, message ]
+
+			if done and not in_flight and not retry and not follow_ups:
+				break
+
+			#
+			# Wait for a response, until the next query times out or the next one can be sent.
+			#
+			timeout = min([ entry[2] for entry in in_flight.values() ] + [ now + 1 ]) - now
+			if retry or follow_ups or not done:
+				timeout = min(timeout, scheduler.wait(now))
+
+			(readable, _, _) = select.select(list(sockets.values()), [], [], max(0, timeout))
+
+			for sock in readable:
+				while True:
+
+					try:
+						(message, address) = sock.recvfrom(4096)
+
+					except BlockingIOError:
+						break
+
+					if len(message) < 12:
+						continue
+
+					request_id = struct.unpack(">H", message[0:2])[0]
+					sent_query = in_flight.get(request_id)
+
+					#
+					# Only accept a response from the server we sent the query to.
+					#
+					if sent_query is None or address[0:2] != sent_query[1].address[0:2]:
+						logger.debug("Got response for unknown request ID %04x from %s, ignoring", request_id, address[0])
+						continue
+
+					if offsets.getQuestion(message) != offsets.getQuestion(sent_query[5]):
+						logger.debug("Got response for request ID %04x with a different question, ignoring", request_id)
+						continue
+
+					del in_flight[request_id]
+					(entry, server, _, tries, sent, request) = sent_query
+					(name, query_type) = entry[0:2]
+					now = time.time()
+
+					scheduler.finished(server)
+					metrics.increment("dns_tool_in_flight_queries", -1)
+					metrics.observe("dns_tool_rtt_seconds", now - sent, server = server.name)
+
+					if args.record:
+						archive.writeRecord(server.name, now - sent, request, message, sent)
+
+					#
+					# If the server is struggling or doesn't want our queries, back off from it,
+					# and retry the query on whichever server is picked next.
+					#
+					if (message[3] & 0x0f) in backoff_rcodes:
+
+						header = parse.parseHeader(message[0:12])
+						server.failed(now, "%s for %s/%s" % (header["header_text"]["rcode_text"], name, query_type))
+
+						if tries <= args.retries:
+							retry.append((entry, tries))
+							continue
+
+					else:
+						server.succeeded()
+
+					if isinstance(entry, FollowUp):
+						finishEntry(entry[3], entry[2](args, name, query_type, server.name, request, message))
+						continue
+
+					follow_up = on_response(args, name, query_type, server.name, request, message)
+					num_responses += 1
+
+					finishEntry(entry, follow_up)
+
+			#
+			# Anything which has timed out gets retried, or given up on.
+			#
+			now = time.time()
+			for request_id in [ key for (key, sent_query) in in_flight.items() if sent_query[2] <= now ]:
+
+				(entry, server, _, tries, sent, request) = in_flight.pop(request_id)
+				(name, query_type) = entry[0:2]
+				scheduler.finished(server)
+				metrics.increment("dns_tool_in_flight_queries", -1)
+				metrics.increment("dns_tool_timeouts_total", server = server.name)
+
+				server.failed(now, "Timed out looking up %s/%s" % (name, query_type))
+
+				if tries <= args.retries:
+					retry.append((entry, tries))
+				else:
+					logger.warning("Timed out looking up %s/%s" % (name, query_type))
+
+					if args.record:
+						archive.writeRecord(server.name, None, request, b"", sent)
+
+					#
+					# A follow-up which times out is handed back, as the response it's for arrived fine.
+					#
+					if isinstance(entry, FollowUp):
+						finishEntry(entry[3], entry[2](args, name, query_type, server.name, request, None))
+						continue
+
+					num_timeouts += 1
+
+					if on_finished:
+						on_finished(entry)
+
+	except KeyboardInterrupt:
+		logger.info("Interrupted, stopping.")
+
+	finally:
+		for sock in sockets.values():
+			sock.close()
+
+	return(num_responses, num_timeouts)
+
+
@@ -0,0 +1,78 @@
+#
+# This module handles --stdin --stream, where stdin is a stream of packets, each
+# preceded by a 2-byte length (as written by --raw in batch mode, or --synthetic).
+#
+# Packets are read and handled one at a time, so the stream can be as long as we like.
+#
+
+
+import logging
+import sys
+
+from lib import canonical
+from lib import framing
+from lib import metrics
+from lib import output
+from lib import query
+from lib import validate
+
+
+logger = logging.getLogger()
+
+
+def go(args):
+	"""
+	go(args): Read each packet on stdin, and print it in whichever way was asked for.
+
+	With --raw, packets are written back out in the same framing, so that streams can be
+	piped from one dns-tool to another.
+	"""
+
+	output.flush_every = args.flush_every
+
+	count = 0
+	errors = 0
+
+	out = sys.stdout.buffer
+
+	#
+	# Each message is a view of our read buffer, which is reused for the next one.  Writing
+	# it back out, validating it, and digesting it don't keep any of it, so they don't need
+	# a copy.  Parsing does (the parsed answers hold slices of the packet), so it gets one.
+	#
+	for message in framing.readFrameViews(framing.openStdin()):
+
+		source = "#%d" % (count + errors)
+
+		try:
+			if args.raw and not args.fake_ttl:
+				framing.writeFrame(out, message)
+
+			elif args.raw:
+				framing.writeFrame(out, query.getRawMessage(args, bytes(message)))
+
+			elif args.validate:
+				if not validate.go(args, message, source):
+					errors += 1
+					continue
+
+			elif args.digest:
+				canonical.go(args, message, source)
+
+			else:
+				output.printResponse(args, query.parseMessage(args, bytes(message)))
+
+		except Exception as e:
+			logger.error("Unable to parse packet %s: %s" % (source, e))
+			metrics.increment("dns_tool_parse_errors_total")
+			errors += 1
+			continue
+
+		count += 1
+
+	output.flush()
+	out.flush()
+
+	logger.info("Stream complete: %d packets, %d errors" % (count, errors))
+
+
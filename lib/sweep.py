@@ -0,0 +1,98 @@
+#
+# This module holds our code for --ptr-sweep, which does reverse lookups on
+# every address in a CIDR range.
+#
+# Rather than one query at a time, the scheduler keeps up to --concurrency queries
+# in flight, spread across our server pool, matching responses to queries by their
+# request ID.  Responses are printed as they come in, so they may be out of order.
+#
+
+
+import ipaddress
+import logging
+
+from lib import chain
+from lib import checkpoint
+from lib import metrics
+from lib import output
+from lib import query
+from lib import scheduler
+
+
+logger = logging.getLogger()
+
+
+def generateNames(cidr, start = 0):
+	"""
+	generateNames(cidr, start = 0): Yield the in-addr.arpa or ip6.arpa name of each address in a
+		network, starting with address number start.
+
+	This is a generator, so even an IPv6 /64 doesn't have to fit in memory.
+	"""
+
+	network = ipaddress.ip_network(cidr, strict = False)
+	address = network.network_address + start
+
+	for i in range(start, network.num_addresses):
+		yield(address.reverse_pointer)
+		address += 1
+
+
+def handleResponse(args, name, query_type, server, request, message):
+	"""
+	handleResponse(args, name, query_type, server, request, message): Parse and print a response.
+
+	If a CNAME chain needs following, a follow-up query is returned for the scheduler, and the
+	response is printed once the chain is finished.
+	"""
+
+	try:
+		response = query.parseMessage(args, message)
+
+	except Exception as e:
+		logger.error("Unable to parse response for %s: %s" % (name, e))
+		metrics.increment("dns_tool_parse_errors_total")
+		return
+
+	response["server"] = server
+
+	if args.follow_cnames:
+		return(chain.start(args, response, query_type, lambda: output.printResponse(args, response)))
+
+	output.printResponse(args, response)
+
+
+def go(args):
+	"""
+	go(args): Do reverse lookups on every address in args.ptr_sweep, and print the results as they arrive.
+	"""
+
+	output.flush_every = args.flush_every
+
+	start = 0
+
+	if args.checkpoint:
+		checkpoint.start(args, "ptr-sweep:%s" % args.ptr_sweep)
+
+		#
+		# Start at the watermark, rather than counting our way up to it.
+		#
+		start = checkpoint.watermark
+
+	queries = ((name, "ptr") for name in generateNames(args.ptr_sweep, start))
+
+	if args.checkpoint:
+		queries = checkpoint.getQueries(queries, start)
+
+	logger.info("Sweeping %s via %s (concurrency: %d, rate: %s/sec)" % (
+		args.ptr_sweep, ", ".join(scheduler.getServers(args)), args.concurrency, args.rate or "unlimited"))
+
+	try:
+		(num_responses, num_timeouts) = scheduler.run(args, queries, handleResponse,
+			checkpoint.finished if checkpoint.enabled else None)
+
+	finally:
+		output.flush()
+		checkpoint.finish()
+
+	logger.info("Sweep complete: %d responses, %d timeouts" % (num_responses, num_timeouts))
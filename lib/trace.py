@@ -0,0 +1,116 @@
+#
+# This module holds our parse tracing.
+#
+# The parser's debug messages are in its innermost loops, so rather than calling
+# logger.debug() directly (which formats its arguments whether or not anything is
+# logged), the parser checks our active flag and only then calls event().  When
+# neither --debug nor --trace is in use, that check is all it costs.
+#
+# With --trace N, each event is also kept as a dictionary (its kind, the packet it
+# came from, and offsets, pointers, and the like) in a ring buffer of the last N
+# events, which is written out as JSON lines when we exit.
+#
+
+
+import atexit
+import collections
+import json
+import logging
+import sys
+
+
+logger = logging.getLogger()
+
+
+#
+# Is anyone listening?  Callers check this before calling event().
+#
+active = False
+
+#
+# Are debug messages being logged?
+#
+debug = False
+
+#
+# Our ring buffer of events, if --trace is in use, and where to write it.
+#
+events = None
+trace_file = None
+
+#
+# How many packets we have started parsing, so that events can be told apart.
+#
+packet = 0
+
+
+def setup(args):
+	"""
+	setup(args): Set our flags from the command line.  This must be called after the log level is set.
+	"""
+
+	global active
+	global debug
+	global events
+	global trace_file
+
+	debug = logger.isEnabledFor(logging.DEBUG)
+
+	if args.trace:
+		events = collections.deque(maxlen = args.trace)
+		trace_file = args.trace_file
+		atexit.register(dump)
+
+	active = debug or events is not None
+
+
+def startPacket(length):
+	"""
+	startPacket(length): Note that we're starting on a new packet.
+	"""
+
+	global packet
+	packet += 1
+
+	if active:
+		event("packet", "Parsing packet #%(packet)d, %(length)d bytes", packet = packet, length = length)
+
+
+def event(kind, message, **fields):
+	"""
+	event(kind, message, **fields): Record a parse event, and log it if we're debugging.
+
+	message - A format string, which is given fields as a dictionary, as in "Pointer at %(index)d".
+	"""
+
+	if debug:
+		logger.debug(message, fields)
+
+	if events is not None:
+		fields["event"] = kind
+		fields["packet"] = packet
+		events.append(fields)
+
+
+def dump():
+	"""
+	dump(): Write out our ring buffer as JSON lines, oldest event first, and empty it.
+	"""
+
+	if not events:
+		return
+
+	if trace_file:
+		fh = open(trace_file, "w")
+	else:
+		fh = sys.stderr
+
+	for entry in events:
+		fh.write(json.dumps(entry, sort_keys = True) + "\n")
+
+	if trace_file:
+		fh.close()
+
+	events.clear()
+
+
@@ -0,0 +1,245 @@
+#
+# This module holds our code for --validate, which checks a packet for problems
+# without building the full parse tree.
+#
+# The packet is walked once, by offset.  No dictionaries or text are created for
+# each record, so this is much faster than parseMessage() when all we want to know
+# is whether a packet is malformed or suspicious.
+#
+
+
+import logging
+import struct
+
+from lib import budget
+from lib import output
+from lib import sanity
+
+
+logger = logging.getLogger()
+
+
+#
+# Our precompiled struct layouts
+#
+header_struct = struct.Struct(">HHHHHH")
+rr_struct = struct.Struct(">HHIH")
+
+#
+# The TYPEs whose RDATA starts with a domain-name, and the offset of that name in the RDATA.
+# SOA has two names in a row, so it is handled separately.
+#
+rdata_names = {
+	2: 0,		# NS
+	5: 0,		# CNAME
+	12: 0,		# PTR
+	15: 2,		# MX
+	33: 6,		# SRV
+	}
+type_soa = 6
+
+section_names = ("answer", "authority", "additional")
+
+
+def checkName(index, data, failures, where):
+	"""
+	checkName(index, data, failures, where): Walk the domain-name at index, checking each
+		label and pointer.
+
+	Pointers must point backwards, to somewhere inside the packet, and not in a loop.
+	Returns the offset just past the name, or None if the name runs off the end of the packet.
+	"""
+
+	length = len(data)
+	retval = None
+	hops = 0
+	label_bytes = 0
+	lowest = index
+
+	while True:
+
+		if index >= length:
+			failures.append("%s: Domain-name runs past the end of the packet" % where)
+			return(None)
+
+		label = data[index]
+
+		if label == 0:
+			if retval is None:
+				retval = index + 1
+			return(retval)
+
+		if label & 0b11000000:
+
+			if (label & 0b11000000) != 0b11000000:
+				failures.append("%s: Bad pointer! Expected value of 192 or more, got %d!" % (where, label))
+				return(None)
+
+			if index + 1 >= length:
+				failures.append("%s: Pointer runs past the end of the packet" % where)
+				return(None)
+
+			if retval is None:
+				retval = index + 2
+
+			pointer = ((label & 0b00111111) << 8) | data[index + 1]
+
+			#
+			# Pointers which don't point backwards are how loops are made.
+			#
+			if pointer >= lowest:
+				failures.append("%s: Pointer to offset %d does not point backwards (from %d)" % (where, pointer, index))
+				return(retval)
+
+			hops += 1
+			if hops > budget.limits["pointer_hops"]:
+				failures.append("%s: More than %d pointers in a domain-name" % (where, budget.limits["pointer_hops"]))
+				return(retval)
+
+			lowest = pointer
+			index = pointer
+			continue
+
+		label_bytes += 1 + label
+		if label_bytes > budget.limits["label_bytes"]:
+			failures.append("%s: More than %d bytes of labels in a domain-name" % (where, budget.limits["label_bytes"]))
+			return(None)
+
+		index += 1 + label
+
+
+def validateMessage(message, request_id = None):
+	"""
+	validateMessage(message, request_id = None): Check a packet for problems.
+
+	request_id - The ID of the query that this is a response to, if we know it.
+
+	The header checks are the same as in the sanity module, and on top of that we check
+	that the counts in the header match the records in the packet, that no RDLENGTH runs
+	past the end of the packet, and that every domain-name is well formed.
+
+	A list of failures is returned, which is empty if the packet is fine.
+	"""
+
+	retval = []
+	length = len(message)
+
+	if length < header_struct.size:
+		retval.append("Packet is only %d bytes, shorter than a header" % length)
+		return(retval)
+
+	(packet_id, flags, num_questions, num_answers, num_authority, num_additional) = header_struct.unpack_from(message)
+
+	z = (flags >> 4) & 0b111
+	if z:
+		retval.append("Content of Z field in header is not zero: %s" % z)
+
+	if request_id is not None and packet_id != request_id:
+		retval.append("Request ID on answer (%04x) != request ID of question (%04x)!" % (packet_id, request_id))
+
+	opcode = (flags >> 11) & 0b1111
+	if opcode > 2:
+		retval.append("OPCODE > 2 reserved for future use! (Qtype = %s)" % opcode)
+
+	rcode = flags & 0b1111
+	if rcode > 5:
+		retval.append("Invalid RCODE (%s)" % rcode)
+
+	index = header_struct.size
+
+	for i in range(num_questions):
+
+		where = "Question #%d" % (i + 1)
+		index = checkName(index, message, retval, where)
+
+		if index is None:
+			return(retval)
+
+		if index + 4 > length:
+			retval.append("%s: QTYPE and QCLASS run past the end of the packet" % where)
+			return(retval)
+
+		index += 4
+
+	counts = (num_answers, num_authority, num_additional)
+
+	for (section, count) in zip(section_names, counts):
+
+		for i in range(count):
+
+			if index >= length:
+				retval.append("Header says there are %d %s records, but the packet ends after %d" % (
+					count, section, i))
+				return(retval)
+
+			where = "%s #%d" % (section.capitalize(), i + 1)
+			index = checkName(index, message, retval, where)
+
+			if index is None:
+				return(retval)
+
+			if index + rr_struct.size > length:
+				retval.append("%s: Record header runs past the end of the packet" % where)
+				return(retval)
+
+			(rr_type, rr_class, ttl, rdlength) = rr_struct.unpack_from(message, index)
+			index += rr_struct.size
+			rdata_end = index + rdlength
+
+			if rdata_end > length:
+				retval.append("%s: RDLENGTH of %d runs %d bytes past the end of the packet" % (
+					where, rdlength, rdata_end - length))
+				return(retval)
+
+			if rr_type != sanity.type_opt:
+				if rr_class < 1:
+					retval.append("%s: QCLASS in answer is < 1 (%s)" % (where, rr_class))
+				elif rr_class > 4:
+					retval.append("%s: QCLASS in answer is > 4 (%s)" % (where, rr_class))
+
+			if rr_type >= 252 and rr_type <= 255:
+				retval.append("%s: Got TYPE >= 252 for non-question. (%s)" % (where, rr_type))
+
+			#
+			# Check the domain-names inside the RDATA, as those are where pointers usually go wrong.
+			#
+			if rr_type in rdata_names:
+				end = checkName(index + rdata_names[rr_type], message, retval, where)
+				if end is not None and end > rdata_end:
+					retval.append("%s: Domain-name in RDATA runs past RDLENGTH" % where)
+
+			elif rr_type == type_soa:
+				end = checkName(index, message, retval, where)
+				if end is not None:
+					end = checkName(end, message, retval, where)
+				if end is not None and end + 20 != rdata_end:
+					retval.append("%s: SOA RDATA doesn't match RDLENGTH" % where)
+
+			index = rdata_end
+
+	if index < length:
+		retval.append("%d bytes left over after the last record" % (length - index))
+
+	return(retval)
+
+
+def go(args, message, source, request_id = None):
+	"""
+	go(args, message, source, request_id = None): Validate a packet, and print any failures.
+
+	source - Where this packet came from, which is printed before each failure.
+
+	Returns True if the packet was fine.
+	"""
+
+	failures = validateMessage(message, request_id)
+
+	for failure in failures:
+		output.pending.append("%s: %s\n" % (source, failure))
+
+	if failures:
+		output.endMessage()
+
+	return(not failures)
+
+
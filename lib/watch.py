@@ -0,0 +1,170 @@
+#
+# This module holds our code for --watch, which monitors a list of names and
+# prints a response only when it changes.
+#
+# Instead of polling every name on a fixed interval, each name is re-queried when
+# the TTL of its answers runs out.  All of the names are kept in a single heap,
+# ordered by when they are next due, so there is no timer per name.
+#
+# The names which are due are queried together through our scheduler, so a name
+# which times out doesn't hold up the others.  A name which times out (after
+# --retries) is tried again in --watch-min seconds.
+#
+
+
+import heapq
+import itertools
+import logging
+import time
+
+from lib import batch
+from lib import metrics
+from lib import output
+from lib import query
+from lib import scheduler
+
+
+logger = logging.getLogger()
+
+
+def getNextDelay(args, response):
+	"""
+	getNextDelay(args, response): Figure out how long until we should query this name again.
+
+	That is the lowest TTL of all the records we got back, kept between --watch-min and --watch-max.
+	If no records came back, we wait --watch-max.
+	"""
+
+	ttls = [ answer["headers"]["ttl"] for answer in response["answers"] ]
+
+	if ttls:
+		retval = min(ttls)
+	else:
+		retval = args.watch_max
+
+	retval = max(args.watch_min, min(args.watch_max, retval))
+
+	return(retval)
+
+
+def getState(response):
+	"""
+	getState(response): Get the parts of a response that we care about changing.
+
+	That's the set of answers (order doesn't matter), the RCODE, and any sanity warnings.
+	"""
+
+	answers = frozenset((answer["headers"]["type"], str(answer["rddata_text"]))
+		for answer in response["answers"])
+
+	sanity = response["sanity"]
+	warnings = tuple(sanity["header"]) + tuple(tuple(warning) for warning in sanity["answers"])
+
+	retval = (answers, response["header"]["header"]["rcode"], warnings)
+
+	return(retval)
+
+
+def checkResponse(args, states, q, query_type, message):
+	"""
+	checkResponse(args, states, q, query_type, message): Print a response if it's changed since
+		the last one for this name.
+
+	Returns how many seconds until we should query this name again.
+	"""
+
+	try:
+		response = query.parseMessage(args, message)
+
+	except Exception as e:
+		#
+		# A bad response might be a one-off, so check again later.
+		#
+		logger.error("Unable to parse response for %s/%s: %s" % (q, query_type, e))
+		metrics.increment("dns_tool_parse_errors_total")
+		return(args.watch_max)
+
+	key = (q, query_type, args.server)
+	state = getState(response)
+
+	if states.get(key) != state:
+		logger.info("Change in %s/%s: %s" % (q, query_type, [ str(answer[1]) for answer in state[0] ]))
+		states[key] = state
+		output.printResponse(args, response)
+
+	retval = getNextDelay(args, response)
+	logger.debug("Next query for %s/%s in %d seconds", q, query_type, retval)
+
+	return(retval)
+
+
+def go(args):
+	"""
+	go(args): Watch our list of names until interrupted.
+	"""
+
+	output.flush_every = args.flush_every
+
+	#
+	# Our heap is made up of (time due, sequence, name, query type).  The sequence
+	# number keeps entries which are due at the same time in the order they were read.
+	#
+	heap = []
+	states = {}
+	sequence = itertools.count()
+
+	now = time.time()
+	for (q, query_type) in batch.readQueries(args, args.watch):
+		heapq.heappush(heap, (now, next(sequence), q, query_type))
+
+	logger.info("Watching %d names" % len(heap))
+
+	#
+	# How long until each name which was just answered is due again.  The scheduler
+	# calls onFinished() right after onResponse() for the same name, and calls only
+	# onFinished() for a name which timed out.
+	#
+	delays = {}
+
+	def onResponse(args, q, query_type, server, request, message):
+		delays[(q, query_type)] = checkResponse(args, states, q, query_type, message)
+
+	def onFinished(entry):
+		(q, query_type) = entry
+		delay = delays.pop((q, query_type), args.watch_min)
+		heapq.heappush(heap, (time.time() + delay, next(sequence), q, query_type))
+
+	try:
+		while heap:
+
+			now = time.time()
+			if heap[0][0] > now:
+				#
+				# Nothing is due yet, so make sure anything we have is written out
+				# and sleep until the next name is.
+				#
+				output.flush()
+				time.sleep(heap[0][0] - now)
+				continue
+
+			due = []
+			while heap and heap[0][0] <= now:
+				(_, _, q, query_type) = heapq.heappop(heap)
+				due.append((q, query_type))
+
+			waiting = len(heap)
+			scheduler.run(args, iter(due), onResponse, onFinished)
+
+			#
+			# The scheduler stops early only if we were interrupted.
+			#
+			if len(heap) - waiting < len(due):
+				break
+
+	except KeyboardInterrupt:
+		logger.info("Interrupted, stopping.")
+
+	finally:
+		output.flush()
+
+
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+#
+# This script is a tiny DNS server for test.sh, so that the bulk modes (the scheduler,
+# CNAME chains, checkpoints, workers, and so on) can be tested without the network.
+#
+# Usage: ./test-responder.py ADDRESS
+#
+# It answers on UDP and TCP port 53 of ADDRESS until it's killed, so it has to be run as root
+# (or somewhere unprivileged users can listen on port 53).  Its zone is made up:
+#
+#	www.chain.test, www2.chain.test - CNAME to cdn.chain.test, which is all the response holds
+#	cdn.chain.test - CNAME to edge.chain.test, with the A record for edge.chain.test
+#	www.broken.test - CNAME to drop.broken.test
+#	loop1.test, loop2.test - CNAMEs to each other
+#	drop* - Never answered
+#	refused* - Answered with REFUSED
+#	wrong* - Answered, but for a different question
+#	changing* - An A record which is different every time it's asked for
+#	Anything else - An A record (or PTR) made from a hash of the name
+#
+# Over TCP, it only answers AXFR queries:
+#
+#	zone.test - Three messages, the last two without a question
+#	short.test - One message, then an empty one
+#
+
+
+import os
+import socket
+import struct
+import sys
+import threading
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lib import budget
+from lib import create
+from lib import create_response
+from lib import framing
+from lib import parse_question
+
+
+#
+# The names of our query types, keyed by number.
+#
+query_type_names = { value: key for (key, value) in create.query_types.items() }
+
+#
+# Our CNAMEs, and the records which go along with each.
+#
+cnames = {
+	"www.chain.test": ("cdn.chain.test", []),
+	"www2.chain.test": ("cdn.chain.test", []),
+	"cdn.chain.test": ("edge.chain.test", [ ("edge.chain.test", "10.0.0.1") ]),
+	"www.broken.test": ("drop.broken.test", []),
+	"loop1.test": ("loop2.test", []),
+	"loop2.test": ("loop1.test", []),
+	}
+
+ttl = 300
+
+#
+# How many times we've been asked for a changing* name.
+#
+num_changes = 0
+
+
+def getRecord(name, query_type):
+	"""
+	getRecord(name, query_type): Make up a record for a name, the same one every time.
+	"""
+
+	number = zlib.crc32(name.lower().encode("utf-8"))
+
+	if query_type == "ptr":
+		return({ "name": name, "type": "ptr", "ttl": ttl, "rdata": { "text": "host-%d.test" % (number % 100000) } })
+
+	return({ "name": name, "type": "a", "ttl": ttl,
+		"rdata": { "ip": "10.%d.%d.%d" % ((number >> 16) & 0xff, (number >> 8) & 0xff, number & 0xff) } })
+
+
+def getResponse(request):
+	"""
+	getResponse(request): Return our response to a query, or None if it shouldn't be answered.
+	"""
+
+	budget.start()
+
+	request_id = struct.unpack_from(">H", request)[0]
+	question = parse_question.parseQuestion(12, request)
+	q = question["question"]
+	query_type = query_type_names.get(question["qtype"], "a")
+	name = q.lower()
+
+	if name.startswith("drop"):
+		return(None)
+
+	if name.startswith("changing"):
+		global num_changes
+		num_changes += 1
+		return(create_response.createResponse(request_id, q, query_type,
+			[ { "name": q, "type": "a", "ttl": ttl, "rdata": { "ip": "10.255.0.%d" % (num_changes % 256) } } ]))
+
+	if name.startswith("wrong"):
+		return(create_response.createResponse(request_id, "right" + q, query_type, [ getRecord("right" + q, query_type) ]))
+
+	if name.startswith("refused"):
+		return(create_response.createResponse(request_id, q, query_type, flags = create_response.default_flags | 5))
+
+	if name in cnames:
+		(target, records) = cnames[name]
+		answers = [ { "name": q, "type": "cname", "ttl": ttl, "rdata": { "text": target } } ]
+		answers += [ { "name": owner, "type": "a", "ttl": ttl, "rdata": { "ip": ip } } for (owner, ip) in records ]
+
+	else:
+		answers = [ getRecord(q, query_type) ]
+
+	return(create_response.createResponse(request_id, q, query_type, answers))
+
+
+def getTransfer(request):
+	"""
+	getTransfer(request): Return the messages of our answer to a zone transfer.
+	"""
+
+	budget.start()
+
+	request_id = struct.unpack_from(">H", request)[0]
+	q = parse_question.parseQuestion(12, request)["question"]
+	name = q.lower()
+
+	soa = { "name": name, "type": "soa", "ttl": ttl, "rdata": { "mname": "ns." + name, "rname": "hostmaster." + name,
+		"serial": 1, "refresh": 7200, "retry": 900, "expire": 1209600, "minimum": 86400 } }
+	hosts = [ getRecord("host%d.%s" % (i, name), "a") for i in range(4) ]
+
+	if name == "zone.test":
+		return([ create_response.createResponse(request_id, q, "axfr", [ soa ] + hosts[0:2]),
+			create_response.createResponse(request_id, None, "axfr", hosts[2:4]),
+			create_response.createResponse(request_id, None, "axfr", [ soa ]) ])
+
+	if name == "short.test":
+		return([ create_response.createResponse(request_id, q, "axfr", [ soa ] + hosts[0:2]), b"" ])
+
+	return([ create_response.createResponse(request_id, q, "axfr", flags = create_response.default_flags | 5) ])
+
+
+def serveTcp(address):
+	"""
+	serveTcp(address): Answer zone transfers over TCP, one connection at a time.
+	"""
+
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	listener.bind((address, 53))
+	listener.listen()
+
+	while True:
+
+		(sock, _) = listener.accept()
+
+		try:
+			fh = sock.makefile("rwb")
+			for request in framing.readFrames(fh):
+				for message in getTransfer(request):
+					framing.writeFrame(fh, message)
+				fh.flush()
+
+		except Exception as e:
+			print("Unable to answer zone transfer: %s" % e, file = sys.stderr)
+
+		finally:
+			sock.close()
+
+
+def main():
+
+	thread = threading.Thread(target = serveTcp, args = (sys.argv[1],), daemon = True)
+	thread.start()
+
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	sock.bind((sys.argv[1], 53))
+
+	while True:
+
+		(request, address) = sock.recvfrom(4096)
+
+		try:
+			response = getResponse(request)
+
+		except Exception as e:
+			print("Unable to answer query: %s" % e, file = sys.stderr)
+			continue
+
+		if response:
+			sock.sendto(response, address)
+
+
+main()
+
+
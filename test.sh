@@ -75,6 +75,12 @@ declare -a ANSWERS_RAW_STDIN_HASH=(
 	"d6e73fd52201907c9ee5b1e8a712d6112a21cd4e"
 	)
 
+#
+# How many of our tests failed.  We keep going after a failure so that all of them
+# are reported, and exit with an error at the end.
+#
+FAILED=0
+
 RED='\033[0;31m'
 GREEN='\033[0;32m'
 NC='\033[0m'
@@ -95,6 +101,7 @@ function test_result() {
 
 	else
 		echo -e "   ${RED}[ERROR]${NC} : result '${RESULT}' != '${EXPECTED}' for query '${QUERY}'"
+		FAILED=$((FAILED + 1))
 		#exit 1 # Debugging
 
 	fi
@@ -189,5 +196,424 @@ EXPECTED="a.root-servers.net nstld.verisign-grs.com SERIAL 1800 900 604800 86400
 test_result "bad-tld" "$RESULT" "$EXPECTED"
 
 
+#
+# --stdin --stream --raw should pass a stream through unchanged, even when it arrives
+# in pieces which don't line up with the packets.
+#
+STREAM=$(mktemp)
+./dns-tool -q --synthetic 500 --seed 1 > ${STREAM}
+RESULT=$(python3 -c '
+import sys
+data = open(sys.argv[1], "rb").read()
+for i in range(0, len(data), 777):
+	sys.stdout.buffer.write(data[i:i + 777])
+	sys.stdout.buffer.flush()
+' ${STREAM} | ./dns-tool -q --stdin --stream --raw | sha1sum | awk '{print $1}')
+EXPECTED=$(sha1sum < ${STREAM} | awk '{print $1}')
+rm -f ${STREAM}
+test_result "--stdin --stream --raw" "$RESULT" "$EXPECTED"
+
+
+#
+# --output should write the same as stdout, and every JSON backend should encode the
+# same data (orjson doesn't put spaces after separators, so compare with jq).
+#
+STREAM=$(mktemp)
+OUTPUT=$(mktemp)
+./dns-tool -q --synthetic 50 --seed 1 > ${STREAM}
+./dns-tool -q --stdin --stream --json --fake-ttl --output ${OUTPUT} --flush-every 7 < ${STREAM}
+RESULT=$(sha1sum < ${OUTPUT} | awk '{print $1}')
+EXPECTED=$(./dns-tool -q --stdin --stream --json --fake-ttl < ${STREAM} | sha1sum | awk '{print $1}')
+test_result "--output" "$RESULT" "$EXPECTED"
+
+if python3 -c "import orjson" 2>/dev/null
+then
+	RESULT=$(./dns-tool -q --stdin --stream --json --fake-ttl --json-backend orjson < ${STREAM} | jq -cS . | sha1sum | awk '{print $1}')
+	EXPECTED=$(jq -cS . < ${OUTPUT} | sha1sum | awk '{print $1}')
+	test_result "--json-backend orjson" "$RESULT" "$EXPECTED"
+else
+	echo "   orjson isn't installed, skipping the test of --json-backend orjson"
+fi
+rm -f ${STREAM} ${OUTPUT}
+
+
+#
+# Our memo hands out the same parsed answers to every copy of a response, so make sure
+# that nothing changes them: the same response three times (with different request IDs)
+# should print the same with our memo as without it.
+#
+STREAM=$(mktemp)
+./dns-tool -q --synthetic 1 --seed 1 | python3 -c '
+import sys
+data = sys.stdin.buffer.read()
+for request_id in (1, 2, 3):
+	sys.stdout.buffer.write(data[0:2] + request_id.to_bytes(2, "big") + data[4:])
+' > ${STREAM}
+RESULT=$(./dns-tool -q --stdin --stream --json --text --graph --fake-ttl --parse-cache 100 < ${STREAM} | sha1sum | awk '{print $1}')
+EXPECTED=$(./dns-tool -q --stdin --stream --json --text --graph --fake-ttl --parse-cache 0 < ${STREAM} | sha1sum | awk '{print $1}')
+rm -f ${STREAM}
+test_result "memo matches no memo" "$RESULT" "$EXPECTED"
+
+#
+# Our memo key masks out TTLs, so it mustn't trust the counts in the header.  These two
+# packets claim no question, and differ only in the TYPE of their answer, which is where
+# a TTL would be if there really were no question.
+#
+STREAM=$(mktemp)
+python3 -c '
+import struct, sys
+for answer_type in (1, 99):
+	data = (struct.pack(">HHHHHH", 1, 0x8180, 0, 1, 0, 0) + bytes((0, 0, 1, 0, 1))
+		+ bytes((0,)) + struct.pack(">HHIH", answer_type, 1, 300, 4) + bytes((10, 0, 0, 1)))
+	sys.stdout.buffer.write(struct.pack(">H", len(data)) + data)
+' > ${STREAM}
+RESULT=$(./dns-tool -q --stdin --stream --json --fake-ttl --parse-cache 100 < ${STREAM} | sha1sum | awk '{print $1}')
+EXPECTED=$(./dns-tool -q --stdin --stream --json --fake-ttl --parse-cache 0 < ${STREAM} | sha1sum | awk '{print $1}')
+rm -f ${STREAM}
+test_result "memo with bad counts" "$RESULT" "$EXPECTED"
+
+
+#
+# --fields should output just the fields asked for, and refuse fields which don't exist.
+#
+RESULT=$(./dns-tool -q --synthetic 1 --seed 1 | ./dns-tool -q --stdin --stream --json --fields "header.rcode,question.question")
+EXPECTED='{"header": {"header": {"rcode": 0}}, "question": {"question": "static.org"}}'
+test_result "--fields" "$RESULT" "$EXPECTED"
+
+RESULT=$(./dns-tool -q --json --fields "header.nosuch" example.com 2>&1 | tail -n 1)
+EXPECTED='dns-tool: error: Unknown field "header.nosuch": header has header, header_text, num_additional_records, num_answers, num_authority_records, num_questions, request_id'
+test_result "--fields with a bad field" "$RESULT" "$EXPECTED"
+
+#
+# Our response encoder should write a fully qualified name (with a trailing dot) the same
+# as one without, rather than with an empty label on the end.
+#
+RESULT=$(python3 -c '
+import sys
+from lib import create_response
+answers = [ { "name": "www.example.com.", "type": "cname", "ttl": 300, "rdata": { "text": "example.com." } } ]
+sys.stdout.buffer.write(create_response.createResponse(1, "www.example.com.", "cname", answers))
+' | ./dns-tool -q --stdin --json | jq -r '[.question.question, .answers[0].rddata_text, (.sanity.answers | flatten | length)] | join(" ")')
+test_result "response encoder with a trailing dot" "$RESULT" "www.example.com example.com 0"
+
+#
+# A TXT record split across several character-strings is joined back together in rddata_text,
+# and each string is kept in rddata.strings.
+#
+RESULT=$(python3 -c '
+import struct, sys
+rdata = b"\x07v=spf1 \x04-all"
+sys.stdout.buffer.write(struct.pack(">HHHHHH", 1, 0x8180, 1, 1, 0, 0) + b"\x07example\x03com\x00" + struct.pack(">HH", 16, 1)
+	+ struct.pack(">HHHIH", 0xc00c, 16, 1, 300, len(rdata)) + rdata)
+' | ./dns-tool -q --stdin --json | jq -c '[.answers[0].rddata_text, .answers[0].rddata.strings]')
+test_result "TXT with several strings" "$RESULT" '["v=spf1 -all",["v=spf1 ","-all"]]'
+
+#
+# --digest should ignore the request ID and TTLs, but not the extended RCODE and flags
+# which an OPT pseudo-record keeps where its TTL would be.
+#
+STREAM=$(mktemp)
+python3 -c '
+import struct, sys
+for (request_id, ttl, opt_flags) in ((1, 300, 0), (2, 60, 0), (1, 300, 0x8000)):
+	data = (struct.pack(">HHHHHH", request_id, 0x8180, 1, 1, 0, 1) + b"\x07example\x03com\x00" + struct.pack(">HH", 1, 1)
+		+ struct.pack(">HHHIH", 0xc00c, 1, 1, ttl, 4) + bytes((10, 0, 0, 1))
+		+ b"\x00" + struct.pack(">HHIH", 41, 4096, opt_flags, 0))
+	sys.stdout.buffer.write(struct.pack(">H", len(data)) + data)
+' > ${STREAM}
+RESULT=$(./dns-tool -q --stdin --stream --digest packet < ${STREAM} | awk '{print $1}' | uniq | wc -l | tr -d ' ')
+rm -f ${STREAM}
+test_result "--digest" "$RESULT" "2"
+
+#
+# --validate should pass a good response, and point out where a truncated one goes wrong
+# (exiting with an error).  With --stream, only the bad packets are counted as errors.
+#
+STREAM=$(mktemp)
+./dns-tool -q --synthetic 1 --seed 1 | tail -c +3 > ${STREAM}
+RESULT=$(./dns-tool -q --stdin --validate < ${STREAM} && echo "passed" || true)
+test_result "--validate" "$RESULT" "passed"
+RESULT=$(python3 -c "import sys; sys.stdout.buffer.write(open(sys.argv[1], 'rb').read()[:-2])" ${STREAM} | ./dns-tool -q --stdin --validate | sed -e "s/ runs .*//"; echo "exit ${PIPESTATUS[1]}")
+test_result "--validate a truncated response" "$RESULT" "stdin: Additional #5: RDLENGTH of 20
+exit 1"
+./dns-tool -q --synthetic 10 --seed 1 | python3 -c '
+import sys
+from lib import framing
+for (number, message) in enumerate(framing.readFrames(sys.stdin.buffer)):
+	framing.writeFrame(sys.stdout.buffer, message[:-2] if number % 5 == 0 else message)
+' > ${STREAM}
+RESULT=$(./dns-tool --stdin --stream --validate < ${STREAM} 2>&1 >/dev/null | grep -o "Stream complete.*" || true)
+rm -f ${STREAM}
+test_result "--stdin --stream --validate" "$RESULT" "Stream complete: 8 packets, 2 errors"
+
+#
+# A query which can't even be sent (here, to the broadcast address) should be treated
+# like one which timed out, rather than stopping the batch.
+#
+RESULT=$(printf "a.test\nb.test\n" | ./dns-tool --batch - --servers 255.255.255.255 --timeout 1 --retries 1 2>&1 | grep -o "Batch complete.*" || true)
+test_result "--servers when sending fails" "$RESULT" "Batch complete: 0 responses, 2 errors"
+
+#
+# Write a stream of responses to an archive, and read them back.  They should print the same
+# as the stream does, and the index should have been used rather than scanning for records.
+#
+STREAM=$(mktemp)
+ARCHIVE=$(mktemp -d)
+./dns-tool -q --synthetic 200 --seed 1 > ${STREAM}
+python3 -c '
+import sys
+from lib import archive
+from lib import framing
+archive.openArchive(sys.argv[2])
+for message in framing.readFrames(open(sys.argv[1], "rb")):
+	archive.writeRecord("192.0.2.1", 0.01, b"", message)
+' ${STREAM} ${ARCHIVE}/test.arc
+RESULT=$(./dns-tool --read-archive ${ARCHIVE}/test.arc --json --fake-ttl 2>${ARCHIVE}/stderr | jq -c 'del(.server)' | sha1sum | awk '{print $1}')
+EXPECTED=$(./dns-tool -q --stdin --stream --json --fake-ttl < ${STREAM} | jq -c 'del(.server)' | sha1sum | awk '{print $1}')
+test_result "--read-archive" "$RESULT" "$EXPECTED"
+RESULT=$(grep -o "Read .*" ${ARCHIVE}/stderr; grep -c "weren't in the index" ${ARCHIVE}/stderr || true)
+test_result "--read-archive index" "$RESULT" "Read 200 responses from archive, 0 errors
+0"
+rm -rf ${STREAM} ${ARCHIVE}
+
+
+#
+# Interned names and labels are shared between responses, and our tables are bounded.  Parsing
+# a stream with tables far too small to hold it should give the same answers as with the
+# default size, without the tables growing past their limit, and a name seen twice should be
+# the same string both times.
+#
+RESULT=$(./dns-tool -q --synthetic 200 --seed 1 | python3 -c '
+import sys, types
+from lib import framing, interning, query
+
+args = types.SimpleNamespace(raw = False, fake_ttl = False, server = "stdin", fields = None)
+messages = list(framing.readFrames(sys.stdin.buffer))
+expected = [ query.parseMessage(args, message) for message in messages ]
+names = [ query.parseMessage(args, messages[0])["question"]["question"] for i in range(2) ]
+print("shared" if names[0] is names[1] else "not shared")
+
+interning.max_entries = 10
+for table in (interning.strings, interning.labels, interning.entries):
+	table.clear()
+
+largest = 0
+for (message, answer) in zip(messages, expected):
+	if query.parseMessage(args, message) != answer:
+		print("Different answers with small tables")
+	largest = max(largest, len(interning.strings), len(interning.labels), len(interning.entries))
+
+print("largest table %d" % largest)
+' | tr "\n" " ")
+test_result "interning" "$RESULT" "shared largest table 10 "
+
+#
+# --trace N should keep only the last N parse events, and write them out as JSON lines
+# when we exit.  With room for all of them, the first is the start of the first packet.
+#
+STREAM=$(mktemp)
+TRACE=$(mktemp)
+./dns-tool -q --synthetic 5 --seed 1 > ${STREAM}
+./dns-tool -q --stdin --stream --trace 50 --trace-file ${TRACE} < ${STREAM}
+RESULT=$(jq -s -r '[length, .[-1].packet, all(.[]; has("event"))] | join(" ")' ${TRACE})
+test_result "--trace" "$RESULT" "50 5 true"
+./dns-tool -q --stdin --stream --trace 100000 --trace-file ${TRACE} < ${STREAM}
+RESULT=$(head -1 ${TRACE} | jq -r '[.event, .packet] | join(" ")')
+rm -f ${STREAM} ${TRACE}
+test_result "--trace with room for every event" "$RESULT" "packet 1"
+
+#
+# --mem-report shouldn't change what's printed, and should count every message in its
+# report, which has a section for memory over time, by stage, and by allocation site.
+#
+STREAM=$(mktemp)
+./dns-tool -q --synthetic 50 --seed 1 > ${STREAM}
+RESULT=$(./dns-tool -q --stdin --stream --json --mem-report < ${STREAM} 2>/dev/null | sha1sum)
+EXPECTED=$(./dns-tool -q --stdin --stream --json < ${STREAM} | sha1sum)
+test_result "--mem-report output" "$RESULT" "$EXPECTED"
+RESULT=$(./dns-tool -q --stdin --stream --json --mem-report < ${STREAM} 2>&1 >/dev/null \
+	| grep -E -o "^(Memory report: [0-9]+ messages|Memory over time|Retained by stage|Top allocation sites)" | tr "\n" ",")
+rm -f ${STREAM}
+test_result "--mem-report" "$RESULT" "Memory report: 50 messages,Memory over time,Retained by stage,Top allocation sites,"
+
+#
+# Run a corpus of fuzzed responses through the parser, and make sure that every one of them
+# is parsed (or rejected as malformed) within our per-packet work budget, no matter how
+# hostile it is.  Any other exception is a bug in the parser.  This doesn't need the network.
+#
+RESULT=$(./dns-tool -q --synthetic 500 --seed 1 --fuzz | python3 -c '
+import sys, time, types
+from lib import budget, framing, query
+
+args = types.SimpleNamespace(raw = False, fake_ttl = False, server = "stdin", fields = None)
+worst = 0
+status = "OK"
+
+for (number, message) in enumerate(framing.readFrames(sys.stdin.buffer)):
+	start = time.time()
+	try:
+		query.parseMessage(args, message)
+	except query.malformed_errors:
+		pass
+	except Exception as e:
+		status = "Packet #%d raised %s: %s" % (number, type(e).__name__, e)
+		break
+	if budget.steps > budget.limits["steps"] + 1:
+		status = "Packet #%d went over budget: %d steps" % (number, budget.steps)
+	worst = max(worst, time.time() - start)
+
+if worst >= 1:
+	status = "Too slow: %.2f seconds" % worst
+
+print(status)
+' 2>/dev/null)
+test_result "fuzz corpus" "$RESULT" "OK"
+
+
+#
+# The rest of our tests run against test-responder.py, a tiny DNS server on a loopback
+# address, so they don't need the network either.  It has to listen on port 53, so if it
+# can't (we're not root, or we're on a Mac without that loopback address), they're skipped.
+#
+RESPONDER="127.0.0.153"
+TMP=$(mktemp -d)
+./test-responder.py ${RESPONDER} 2>/dev/null &
+RESPONDER_PID=$!
+trap "kill ${RESPONDER_PID} 2>/dev/null; rm -rf ${TMP}" EXIT
+sleep 1
+
+if ! kill -0 ${RESPONDER_PID} 2>/dev/null
+then
+	echo "   Unable to run test-responder.py on ${RESPONDER}:53, skipping the tests which need it"
+
+else
+
+	#
+	# CNAME chains: one which needs another query, one which loops, and one whose target is
+	# never answered.  These run through the scheduler, and so must the queries for the chains,
+	# rather than being made one at a time (which logs "Sending query").
+	#
+	printf "www.chain.test\nloop1.test\nwww.broken.test\n" > ${TMP}/chains.txt
+	RESULT=$(./dns-tool --batch ${TMP}/chains.txt --concurrency 10 --timeout 1 --retries 0 --follow-cnames --json ${RESPONDER} 2>${TMP}/stderr \
+		| jq -r '[.question.question, .cname_chain.status, .cname_chain.final_name] | join(" ")' | sort | tr "\n" " ")
+	test_result "--follow-cnames" "$RESULT" "loop1.test loop loop1.test www.broken.test error drop.broken.test www.chain.test resolved edge.chain.test "
+	RESULT=$(grep -c "Sending query" ${TMP}/stderr || true)
+	test_result "--follow-cnames through the scheduler" "$RESULT" "0"
+
+	#
+	# One query at a time, the second chain through cdn.chain.test should finish from our cache.
+	#
+	RESULT=$(printf "www.chain.test\nwww2.chain.test\n" | ./dns-tool -q --batch - --follow-cnames --json ${RESPONDER} \
+		| jq -r '[.cname_chain.hops[-1].source, .cname_chain.answers[0]] | join(" ")' | tr "\n" " ")
+	test_result "--follow-cnames cache" "$RESULT" "query 10.0.0.1 cache 10.0.0.1 "
+
+	#
+	# A zone transfer over TCP, whose later messages have no question of their own, and one
+	# which is cut short by an empty message.
+	#
+	RESULT=$(./dns-tool -q --query-type axfr --json zone.test ${RESPONDER} \
+		| jq -r '.question.question + " " + ([.answers[].headers.type] | map(tostring) | join(","))' | tr "\n" " ")
+	test_result "AXFR" "$RESULT" "zone.test 6,1,1 zone.test 1,1 zone.test 6 "
+	RESULT=$(./dns-tool -q --query-type axfr --json short.test ${RESPONDER} 2>&1 >/dev/null | grep -o "Zone transfer failed.*" || true)
+	test_result "AXFR with an empty message" "$RESULT" "Zone transfer failed, message #2 is only 0 bytes"
+
+	#
+	# Run a batch through the scheduler.  REFUSED is still a response, but a response to a
+	# different question is ignored, so that query times out just like one which is never answered.
+	#
+	printf "host1.test\nrefused1.test\ndrop1.test\nwrong1.test\n" > ${TMP}/scheduler.txt
+	RESULT=$(./dns-tool --batch ${TMP}/scheduler.txt --servers ${RESPONDER} --timeout 1 --retries 0 --json 2>${TMP}/stderr \
+		| jq -r '[.question.question, .header.header.rcode] | join(" ")' | sort | tr "\n" " ")
+	test_result "--servers" "$RESULT" "host1.test 0 refused1.test 5 "
+	RESULT=$(grep -o "Batch complete.*" ${TMP}/stderr || true)
+	test_result "--servers responses and errors" "$RESULT" "Batch complete: 2 responses, 2 errors"
 
+	#
+	# --watch should print a name again only when its answer changes.  With both limits at
+	# a second, each name is queried three or four times before we stop it.
+	#
+	printf "host1.test\nchanging.test\n" > ${TMP}/watch.txt
+	RESULT=$(timeout -s INT 3.5 ./dns-tool -q --watch ${TMP}/watch.txt --watch-min 1 --watch-max 1 --json ${RESPONDER} \
+		| jq -r .question.question | sort | uniq -c | awk '{print $2, ($1 > 1 ? "changed" : "once")}' | tr "\n" " ")
+	test_result "--watch" "$RESULT" "changing.test changed host1.test once "
+
+	#
+	# Record a batch, and replay it.  Only the name whose answer changes every time should
+	# be reported as a mismatch.
+	#
+	printf "host1.test\nhost2.test\nchanging.test\n" | ./dns-tool -q --batch - --servers ${RESPONDER} --record ${TMP}/replay.arc
+	RESULT=$(./dns-tool -q --replay ${TMP}/replay.arc --replay-speed 0 ${RESPONDER} | grep "^Responses")
+	test_result "--replay" "$RESULT" "Responses: 3, timeouts: 0, mismatches: 1, parse errors: 0"
+
+	#
+	# Resume a batch from a checkpoint which was saved with some queries done, and part of
+	# a response written after it.  That should be cut off, and only the queries which
+	# weren't done should be sent, so each name ends up in the output once.
+	#
+	for i in 0 1 2 3 4 5 6 7 8 9; do echo host$i.test; done > ${TMP}/checkpoint.txt
+	./dns-tool -q --batch ${TMP}/checkpoint.txt --servers ${RESPONDER} --json --output ${TMP}/checkpoint-full.json --checkpoint ${TMP}/checkpoint
+	jq -c 'select(.question.question | test("host[0-47]"))' ${TMP}/checkpoint-full.json > ${TMP}/checkpoint.json
+	python3 -c '
+import json, os, sys
+(path, checkpoint) = sys.argv[1:3]
+job = json.loads(open(checkpoint).readline())["job"]
+open(checkpoint, "w").write(json.dumps({ "job": job, "watermark": 5, "done": [ 7 ], "offset": os.path.getsize(path), "time": 0 }) + "\n")
+open(path, "a").write("{\"answers\": [")
+' ${TMP}/checkpoint.json ${TMP}/checkpoint
+	./dns-tool -q --batch ${TMP}/checkpoint.txt --servers ${RESPONDER} --json --output ${TMP}/checkpoint.json --checkpoint ${TMP}/checkpoint --resume
+	RESULT=$(jq -r .question.question ${TMP}/checkpoint.json | sort | tr "\n" " "; jq -r .watermark ${TMP}/checkpoint | tail -1)
+	test_result "--checkpoint and --resume" "$RESULT" "$(sort ${TMP}/checkpoint.txt | tr "\n" " ")10"
+
+	#
+	# Scrape --metrics-port during a --watch.  The first round of queries is over well before
+	# the next one, so the counters should hold one query for each name.
+	#
+	printf "host1.test\nhost2.test\nrefused1.test\ndrop1.test\n" > ${TMP}/metrics.txt
+	./dns-tool -q --watch ${TMP}/metrics.txt --timeout 1 --retries 0 --metrics-port 15303 ${RESPONDER} &
+	METRICS=$!
+	sleep 2.5
+	RESULT=$(python3 -c 'import urllib.request; print(urllib.request.urlopen("http://127.0.0.1:15303/metrics").read().decode("utf-8"), end = "")' \
+		| grep -E "^dns_tool_(queries_sent|responses|timeouts)_total" | tr "\n" ",")
+	kill ${METRICS}
+	wait ${METRICS} || true
+	test_result "--metrics-port" "$RESULT" 'dns_tool_queries_sent_total{server="127.0.0.153"} 4,dns_tool_responses_total{rcode="0"} 2,dns_tool_responses_total{rcode="5"} 1,dns_tool_timeouts_total{server="127.0.0.153"} 1,'
+
+	#
+	# Run a batch across two workers, one of which is killed first, so that its shards
+	# have to be reassigned to the other.  The output should match a plain batch.
+	#
+	for i in $(seq 1 200); do echo "host${i}.test"; done > ${TMP}/names.txt
+	EXPECTED=$(./dns-tool -q --batch ${TMP}/names.txt --json ${RESPONDER} | jq -r .answers[0].rddata_text | sort | sha1sum)
+
+	./dns-tool -q --worker 127.0.0.1:15301 ${RESPONDER} &
+	WORKER1=$!
+	./dns-tool -q --worker 127.0.0.1:15302 ${RESPONDER} &
+	WORKER2=$!
+	sleep 1
+	kill ${WORKER2}
+	wait ${WORKER2} || true
+
+	RESULT=$(./dns-tool --batch ${TMP}/names.txt --coordinate 127.0.0.1:15301,127.0.0.1:15302 --shards 8 --json 2>${TMP}/stderr \
+		| jq -r .answers[0].rddata_text | sort | sha1sum)
+	kill ${WORKER1}
+	test_result "--coordinate" "$RESULT" "$EXPECTED"
+	RESULT=$(grep -q "Reassigning shard" ${TMP}/stderr && echo "reassigned" || echo "not reassigned")
+	test_result "--coordinate after a worker fails" "$RESULT" "reassigned"
+
+fi
+
+
+#
+# Make sure that a plain lookup still starts up within our budget, and doesn't
+# import anything it doesn't need.
+#
+RESULT=$(./benchmark-startup.sh | tail -n 1)
+test_result "startup time" "$RESULT" "OK"
+
+
+if test "$FAILED" -gt 0
+then
+	echo -e "   ${RED}${FAILED} test(s) failed${NC}"
+	exit 1
+fi
 